@@ -1,10 +1,246 @@
-from flask_frozen import Freezer
-from server import app
+'''
+文書の自動生成
+
+使い方:
+    python freeze.py                      # Frozen-Flaskでリンクを辿って生成
+    python freeze.py --parallel [-j N]    # config.yamlのページ一覧をプロセスプールで並列に生成
+    python freeze.py --incremental [-j N] # 前回から入力が変わったページだけ生成
+    python freeze.py --destination DIR    # `docs/`以外に書き出す
+
+HTML・CSS・JavaScript・JSONはどのモードでも`.gz` (brotliがあれば`.br`も) を隣に書き出す
+存在しないURLに返すページはどのモードでも`404.html`に書き出す (GitHub Pagesと`scripts.prerendered`が返す)
+'''
+import argparse
+import json
+import os
+import shutil
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask_frozen import Freezer, MissingURLGeneratorWarning, patch_url_for, walk_directory
+from scripts import compression, file_hashes, image_variants, pixel_arts, prerendered, search_index, snapshot
+import server
+from server import app, document_info
 from pathlib import Path
+from typing import Any
 
-freezer = Freezer(app)
+# 引数のないルートには`/api/pikmin2/treasures`・`/search`・`/debug/metrics`などクエリ文字列で結果が変わるものや
+# 書き出してはいけないものがあり、`url_for`にはディレクトリ (`static/images`) を指すものもあるので、
+# Frozen-Flaskには列挙させずに`page_urls`と静的ファイルだけを書き出す (`--parallel`と同じURL)
+freezer = Freezer(app, with_no_argument_rules = False, log_url_for = False)
+# `page_urls`はURLの文字列を返すので、全てのエンドポイントが書き出されていないという警告になる
+warnings.filterwarnings('ignore', category = MissingURLGeneratorWarning)
 app.config['FREEZER_DESTINATION'] = str(Path(__file__).parent / 'docs')
 app.config['FREEZER_RELATIVE_URLS'] = True
+# 全ページを描画するので、サーバーの事前生成はしない
+app.config['WARM_UP'] = False
+# `python -m scripts.compression`で`static/`に作った圧縮版はコピーせず、出力先で作り直す
+app.config['FREEZER_STATIC_IGNORE'] = [f'*{suffix}' for suffix, _ in compression.ENCODINGS.values()]
+
+# 各ページの入力のハッシュを記録するマニフェスト
+MANIFEST_PATH = Path(__file__).parent / 'build/freeze-manifest.json'
+MANIFEST_VERSION = 1
+
+def get_page_urls() -> list[str]:
+    '''
+    `document_info`に載っている全ページと、静的に書き出すAPIのURL
+    '''
+    urls = ['/']
+    for category, category_info in document_info.items():
+        for page_name in category_info['pages']:
+            urls.append(f'/{category}/{page_name}.html')
+    return urls + server.get_api_urls()
+
+@freezer.register_generator
+def page_urls():
+    # APIはページからリンクされないので、ページと一緒にFrozen-Flaskにも明示的に渡す
+    yield from get_page_urls()
+
+def get_static_files() -> list[str]:
+    '''
+    `static/`以下のファイル (`static/`からの相対パス)
+    '''
+    return sorted(walk_directory(app.static_folder, ignore = app.config['FREEZER_STATIC_IGNORE']))
+
+def read_manifest() -> dict[str, Any]:
+    empty = {'version': MANIFEST_VERSION, 'destination': str(freezer.root), 'inputs': {}, 'pages': {}, 'static': {}}
+    try:
+        manifest = json.loads(MANIFEST_PATH.read_text(encoding = 'utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return empty
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('destination') != str(freezer.root):
+        return empty
+    return manifest
+
+def write_manifest(manifest: dict[str, Any]):
+    MANIFEST_PATH.parent.mkdir(parents = True, exist_ok = True)
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent = 1), encoding = 'utf-8')
+
+def write_if_changed(path: Path, data: bytes) -> bool:
+    '''
+    内容が変わるときだけ書き込み、書き込んだかを返す
+    '''
+    if path.is_file() and path.stat().st_size == len(data) and path.read_bytes() == data:
+        return False
+    path.parent.mkdir(parents = True, exist_ok = True)
+    path.write_bytes(data)
+    return True
+
+def build_page(url: str, destination: Path) -> tuple[str, float, int, bool]:
+    '''
+    1ページを生成して`destination`に書き出し、(URL, 秒数, バイト数, 書き込んだか)を返す
+    (プロセスプールの開始方法がspawnだとワーカーは`__main__`の設定を引き継がないので、出力先は引数で渡す)
+    '''
+    start = time.perf_counter()
+    with patch_url_for(app):
+        response = app.test_client().get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f'{url}: {response.status}')
+    written = write_if_changed(destination / freezer.urlpath_to_filepath(url), response.data)
+    return url, time.perf_counter() - start, len(response.data), written
+
+def copy_static_file(filename: str) -> bool:
+    source = Path(app.static_folder) / filename
+    destination = freezer.root / 'static' / filename
+    if destination.is_file() and destination.stat().st_size == source.stat().st_size \
+            and destination.read_bytes() == source.read_bytes():
+        return False
+    destination.parent.mkdir(parents = True, exist_ok = True)
+    shutil.copyfile(source, destination)
+    return True
+
+def compress_files(paths: list[Path], jobs: int | None = None) -> dict[Path, dict[str, int]]:
+    '''
+    ファイルの圧縮版をスレッドプールで書き出し、ファイルごとの圧縮後のバイト数を返す
+    '''
+    with ThreadPoolExecutor(jobs) as pool:
+        return dict(zip(paths, pool.map(compression.write_siblings, paths)))
+
+def compress_destination(jobs: int | None = None) -> dict[Path, dict[str, int]]:
+    '''
+    出力先の全てのHTML・CSS・JavaScript・JSONを圧縮する
+    '''
+    paths = sorted(
+        Path(directory) / filename
+        for directory, _, filenames in os.walk(freezer.root)
+        for filename in filenames
+        if compression.is_compressible(Path(filename))
+    )
+    sizes = compress_files(paths, jobs)
+    print(format_compressed_sizes([path.stat().st_size for path in paths], list(sizes.values())))
+    return sizes
+
+def format_compressed_sizes(sizes: list[int], compressed_sizes: list[dict[str, int]]) -> str:
+    total = sum(sizes)
+    text = f'{len(sizes)} files, {total} B'
+    for encoding in compression.ENCODINGS:
+        compressed = sum(s.get(encoding, size) for size, s in zip(sizes, compressed_sizes))
+        text += f', {encoding} {compressed} B ({compressed / max(total, 1):.1%})'
+    return text
+
+def write_not_found_page() -> Path:
+    '''
+    存在しないURLへの応答を出力先の`404.html`に書き出す (内容が変わらなければ書き換えない)
+    '''
+    path = freezer.root / prerendered.NOT_FOUND_FILE
+    response = app.test_client().get(prerendered.NOT_FOUND_URL)
+    assert response.status_code == 404, response.status
+    write_if_changed(path, response.get_data())
+    return path
+
+def freeze_pages(jobs: int | None = None, *, incremental: bool = False):
+    '''
+    ページを列挙してプロセスプールで生成し、静的ファイルはスレッドプールでコピーする
+    `incremental`なら前回のマニフェストと入力のハッシュが一致するページ・静的ファイルは飛ばす
+    (Frozen-Flaskと違い、`docs/`の余分なファイルは削除しない)
+    '''
+    start = time.perf_counter()
+    previous = read_manifest()
+    if not incremental:
+        # 入力のハッシュだけ再利用し、全ページ・全静的ファイルを対象にする
+        previous['pages'], previous['static'] = {}, {}
+    manifest: dict[str, Any] = {
+        'version': MANIFEST_VERSION,
+        'destination': str(freezer.root),
+        'inputs': {},
+        'pages': {},
+        'static': {},
+    }
+
+    urls = get_page_urls()
+    for url in urls:
+        manifest['pages'][url] = {
+            path.relative_to(Path(__file__).parent).as_posix():
+                file_hashes.hash_dependency(path, manifest['inputs'], previous['inputs'])
+            for path in server.get_page_dependencies(url)
+        }
+    stale_urls = [
+        url for url in urls
+        if previous['pages'].get(url) != manifest['pages'][url]
+        or not (freezer.root / freezer.urlpath_to_filepath(url)).is_file()
+    ]
+
+    static_files = get_static_files()
+    for filename in static_files:
+        manifest['static'][filename] = file_hashes.get_stamp(Path(app.static_folder) / filename)
+    stale_static_files = [
+        filename for filename in static_files
+        if previous['static'].get(filename) != manifest['static'][filename]
+        or not (freezer.root / 'static' / filename).is_file()
+    ]
+
+    with ThreadPoolExecutor(jobs) as copy_pool:
+        copies = copy_pool.map(copy_static_file, stale_static_files)
+        if len(stale_urls) > 1:
+            with ProcessPoolExecutor(jobs) as page_pool:
+                results = list(page_pool.map(build_page, stale_urls, [freezer.root] * len(stale_urls)))
+        else:
+            results = [build_page(url, freezer.root) for url in stale_urls]
+        num_copied = sum(copies)
+    write_manifest(manifest)
+    not_found_path = write_not_found_page()
+
+    page_paths = [freezer.root / freezer.urlpath_to_filepath(url) for url in urls] + [not_found_path]
+    static_paths = [
+        freezer.root / 'static' / filename for filename in static_files
+        if compression.is_compressible(Path(filename))
+    ]
+    compressed_sizes = compress_files(page_paths + static_paths, jobs)
+
+    for url, seconds, size, written in sorted(results, key = lambda t: -t[1]):
+        sizes = compressed_sizes[freezer.root / freezer.urlpath_to_filepath(url)]
+        compressed = ''.join(f' {encoding} {sizes[encoding]:8d} B' for encoding in sizes)
+        print(f'{seconds * 1000:9.1f} ms {size:9d} B{compressed}  {url}{"" if written else " (unchanged)"}')
+    print('pages:  ' + format_compressed_sizes(
+        [path.stat().st_size for path in page_paths], [compressed_sizes[path] for path in page_paths]))
+    print('static: ' + format_compressed_sizes(
+        [path.stat().st_size for path in static_paths], [compressed_sizes[path] for path in static_paths]))
+    print(f'{len(stale_urls)}/{len(urls)} pages rendered, '
+          f'{sum(written for *_, written in results)} pages written, '
+          f'{num_copied}/{len(static_files)} static files copied, '
+          f'{time.perf_counter() - start:.2f} s with {jobs or os.cpu_count()} workers')
 
 if __name__ == '__main__':
-    freezer.freeze()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parallel', action = 'store_true', help = 'ページを並列に生成する')
+    parser.add_argument('--incremental', action = 'store_true', help = '入力が変わったページだけ生成する')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = '並列数 (既定: CPU数)')
+    parser.add_argument('--destination', type = Path, default = None, help = '出力先 (既定: docs)')
+    args = parser.parse_args()
+    if args.destination is not None:
+        app.config['FREEZER_DESTINATION'] = str(args.destination.resolve())
+
+    # YAMLが更新されていればスナップショットを作り直す
+    snapshot.build()
+    # ドット絵のマニフェストとアトラス (静的ファイルを列挙する前に作る)
+    pixel_arts.build()
+    # お宝・CaveGenの画像の縮小版
+    image_variants.build()
+    # 全文検索の索引
+    search_index.build()
+    if args.parallel or args.incremental:
+        freeze_pages(args.jobs, incremental = args.incremental)
+    else:
+        freezer.freeze()
+        write_not_found_page()
+        compress_destination(args.jobs)
@@ -0,0 +1,272 @@
+'''
+洞窟調査の結果 (`trial.result`) を軸ごとの件数の配列として扱う
+
+`"{room: circle, mitites: 2}"`のようなキーは読み込み時に1度だけ解析し、
+同じ軸の組を持つキーを1つのNumPy配列 (軸の数だけ次元を持つ件数のテンソル) にまとめる
+表は軸の合計 (`marginalize`)・ラベルの固定 (`slice`)・並べ替え (`reindex`)・2次元への集計 (`pivot`)・
+1列への展開 (`flatten`) ができ、結果は`pikmin2_cave_surveys.create_count_table`などにそのまま渡せる
+'''
+import functools
+import itertools
+import math
+import re
+import numpy as np
+import yaml
+from typing import Any, Callable, Iterable, Iterator
+
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# YAMLとして解析しなくても結果が同じになる単純なキー (`{名前: 値, ...}`で、値は整数・true/false・英小文字の名前)
+SIMPLE_KEY_PATTERN = re.compile(r'\{\s*([A-Za-z_]\w*\s*:\s+[\w-]+(?:\s*,\s*[A-Za-z_]\w*\s*:\s+[\w-]+)*)\s*\}', re.ASCII)
+SIMPLE_INT_PATTERN = re.compile(r'-?(?:0|[1-9][0-9]*)')
+SIMPLE_STR_PATTERN = re.compile(r'[a-z_][a-z0-9_]*')
+# YAML 1.1で文字列にならない単語 (大文字・小文字を区別しない)
+YAML_KEYWORDS = {'true', 'false', 'yes', 'no', 'on', 'off', 'null'}
+
+def parse_simple_key(key: str) -> dict[str, Any] | None:
+    '''
+    単純なキーをYAMLを使わずに解析する (単純でなければ`None`)
+    '''
+    match = SIMPLE_KEY_PATTERN.fullmatch(key)
+    if match is None:
+        return None
+    coords: dict[str, Any] = {}
+    for item in match.group(1).split(','):
+        name, value = (part.strip() for part in item.split(':'))
+        if name in coords or name.lower() in YAML_KEYWORDS:
+            return None
+        if value in ('true', 'false'):
+            coords[name] = value == 'true'
+        elif SIMPLE_INT_PATTERN.fullmatch(value):
+            coords[name] = int(value)
+        elif SIMPLE_STR_PATTERN.fullmatch(value) and value not in YAML_KEYWORDS:
+            coords[name] = value
+        else:
+            return None
+    return coords
+
+def parse_result_key(key: str) -> dict[str, Any]:
+    '''
+    `"{eggs: 3, elec: true}"`を`{'eggs': 3, 'elec': True}`に変換
+    (組み合わせが数千あるとYAMLの解析が遅いので、単純なキーは正規表現で解析する)
+    '''
+    coords = parse_simple_key(key)
+    if coords is None:
+        coords = yaml.load(key, Loader = YamlLoader)
+    if not isinstance(coords, dict) or len(coords) == 0 \
+            or not all(isinstance(v, (bool, int, str)) for v in coords.values()):
+        raise ValueError(f'invalid result key: {key!r}')
+    return coords
+
+class ResultTable:
+    '''
+    同じ軸の組を持つ結果の件数 (`counts`の各次元が`axes`の各軸に対応する)
+    '''
+
+    def __init__(self, axes: tuple[str, ...], labels: tuple[tuple[Any, ...], ...], counts: np.ndarray):
+        assert len(axes) == len(labels) == counts.ndim
+        assert counts.shape == tuple(map(len, labels))
+        self.axes = axes
+        self.labels = labels
+        self.counts = counts
+        self._indices = [{label: i for i, label in enumerate(axis_labels)} for axis_labels in labels]
+
+    def axis_index(self, axis: str) -> int:
+        if axis not in self.axes:
+            raise KeyError(f'axis {axis!r} is not in {self.axes}')
+        return self.axes.index(axis)
+
+    def labels_of(self, axis: str) -> tuple[Any, ...]:
+        return self.labels[self.axis_index(axis)]
+
+    def max_label(self, axis: str) -> Any:
+        '''
+        件数が1以上の中で最大のラベル
+        '''
+        index = self.axis_index(axis)
+        other_axes = tuple(i for i in range(len(self.axes)) if i != index)
+        present = self.counts.sum(axis = other_axes) > 0
+        return max(label for label, p in zip(self.labels[index], present) if p)
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def transpose(self, *axes: str) -> 'ResultTable':
+        '''
+        軸の順番を`axes`に並べ替える
+        '''
+        if sorted(axes) != sorted(self.axes):
+            raise KeyError(f'axes {axes} do not match {self.axes}')
+        order = [self.axes.index(axis) for axis in axes]
+        return ResultTable(
+            tuple(axes),
+            tuple(self.labels[i] for i in order),
+            self.counts.transpose(order),
+        )
+
+    def reindex(self, **values: Iterable[Any]) -> 'ResultTable':
+        '''
+        指定した軸のラベルを指定した順に並べた表 (結果がないラベルは0、指定しない軸はそのまま)
+        '''
+        for axis in values:
+            self.axis_index(axis)
+        labels = tuple(
+            tuple(values[axis]) if axis in values else axis_labels
+            for axis, axis_labels in zip(self.axes, self.labels)
+        )
+        index_lists = []
+        masks = []
+        for indices, axis_labels in zip(self._indices, labels):
+            index_lists.append(np.array([indices.get(v, 0) for v in axis_labels], dtype = np.intp))
+            masks.append(np.array([v in indices for v in axis_labels], dtype = bool))
+        selected = self.counts[np.ix_(*index_lists)]
+        # 各軸のマスクを直積の形に広げる (np.ix_は真偽値をインデックスに変換してしまうので使わない)
+        ndim = len(masks)
+        masks = [mask.reshape([-1 if i == k else 1 for i in range(ndim)]) for k, mask in enumerate(masks)]
+        counts = np.where(functools.reduce(np.logical_and, masks), selected, 0)
+        return ResultTable(self.axes, labels, counts)
+
+    def select(self, **values: Iterable[Any]) -> np.ndarray:
+        '''
+        各軸のラベルを指定した順に並べた件数の配列 (結果がないラベルは0)
+        全ての軸を指定する必要がある
+        '''
+        if sorted(values) != sorted(self.axes):
+            raise KeyError(f'select needs exactly the axes {self.axes}, got {tuple(values)}')
+        return self.reindex(**values).counts
+
+    def marginalize(self, *axes: str) -> 'ResultTable':
+        '''
+        `axes`の軸について合計した表 (残りの軸の周辺分布)
+        '''
+        indices = {self.axis_index(axis) for axis in axes}
+        keep = [i for i in range(len(self.axes)) if i not in indices]
+        return ResultTable(
+            tuple(self.axes[i] for i in keep),
+            tuple(self.labels[i] for i in keep),
+            self.counts.sum(axis = tuple(sorted(indices))),
+        )
+
+    def slice(self, **labels: Any) -> 'ResultTable':
+        '''
+        指定した軸をそのラベルに固定した表 (固定した軸はなくなる、結果がないラベルなら件数は0)
+        '''
+        table = self.reindex(**{axis: [label] for axis, label in labels.items()})
+        keep = [i for i, axis in enumerate(self.axes) if axis not in labels]
+        return ResultTable(
+            tuple(self.axes[i] for i in keep),
+            tuple(self.labels[i] for i in keep),
+            table.counts.reshape([len(table.labels[i]) for i in keep]),
+        )
+
+    def pivot(self, rows: str | tuple[str, ...], columns: str | tuple[str, ...]) -> 'ResultTable':
+        '''
+        行・列以外の軸を合計した2次元の表 (行・列に複数の軸を指定すると、ラベルはその組になる)
+        '''
+        rows = (rows,) if isinstance(rows, str) else tuple(rows)
+        columns = (columns,) if isinstance(columns, str) else tuple(columns)
+        table = self.marginalize(*(axis for axis in self.axes if axis not in rows + columns))
+        table = table.transpose(*rows, *columns)
+
+        def combine(axes: tuple[str, ...]) -> tuple[str, tuple[Any, ...]]:
+            labels = [table.labels_of(axis) for axis in axes]
+            return ','.join(axes), labels[0] if len(axes) == 1 else tuple(itertools.product(*labels))
+
+        (row_axis, row_labels), (column_axis, column_labels) = combine(rows), combine(columns)
+        return ResultTable(
+            (row_axis, column_axis),
+            (row_labels, column_labels),
+            table.counts.reshape(len(row_labels), len(column_labels)),
+        )
+
+    def flatten(self, *, key: Callable[[tuple[Any, ...]], Any] | None = None, nonzero: bool = True) -> 'ResultTable':
+        '''
+        全ての軸のラベルの組を1つの軸に並べた表 (`nonzero`なら件数が1以上の組だけ、`key`があればラベルの組で安定ソート)
+        '''
+        counts = self.counts.reshape(-1)
+        flat_indices = np.flatnonzero(counts) if nonzero else np.arange(counts.size)
+        labels = [
+            tuple(axis_labels[i] for axis_labels, i in zip(self.labels, index))
+            for index in zip(*np.unravel_index(flat_indices, self.counts.shape))
+        ]
+        order = list(range(len(labels)))
+        if key is not None:
+            order.sort(key = lambda i: key(labels[i]))
+        return ResultTable(
+            (','.join(self.axes),),
+            (tuple(labels[i] for i in order),),
+            counts[flat_indices[order]] if len(order) > 0 else counts[:0],
+        )
+
+    def items(self) -> Iterator[tuple[tuple[Any, ...], int]]:
+        '''
+        件数が1以上の(ラベルの組, 件数)
+        '''
+        for index in zip(*np.nonzero(self.counts)):
+            yield tuple(labels[i] for labels, i in zip(self.labels, index)), int(self.counts[index])
+
+class SurveyResult:
+    '''
+    1ステージ分の結果 (軸の組ごとの`ResultTable`)
+    '''
+
+    def __init__(self, num_to_generate: int, tables: dict[frozenset[str], ResultTable]):
+        self.num_to_generate = num_to_generate
+        self.tables = tables
+
+    @classmethod
+    def from_trial(cls, trial: dict[str, Any]) -> 'SurveyResult':
+        '''
+        `trial`を解析する
+        どのシードも各軸の組につき1つの結果を持つので、軸の組ごとの合計は`num`に一致しなければならない
+        (キーの打ち間違いはここで検出される)
+        '''
+        num_to_generate: int = trial['num']
+        result: dict[str, int] = trial['result']
+        groups: dict[frozenset[str], list[tuple[dict[str, Any], int]]] = {}
+        for coords, count in zip(map(parse_result_key, result), result.values()):
+            groups.setdefault(frozenset(coords), []).append((coords, count))
+
+        tables: dict[frozenset[str], ResultTable] = {}
+        for axis_set, entries in groups.items():
+            axes = tuple(sorted(axis_set))
+            try:
+                labels = tuple(tuple(sorted({coords[axis] for coords, _ in entries})) for axis in axes)
+            except TypeError:
+                raise ValueError(f'labels of {axes} have mixed types')
+            indices = [{label: i for i, label in enumerate(axis_labels)} for axis_labels in labels]
+            shape = tuple(map(len, labels))
+            # 全ての結果の位置を1次元の添字にまとめ、件数のテンソルに1度で書き込む
+            flat_indices = np.ravel_multi_index(
+                [np.fromiter((axis_indices[coords[axis]] for coords, _ in entries), dtype = np.intp, count = len(entries))
+                 for axis, axis_indices in zip(axes, indices)],
+                shape,
+            )
+            if len(np.unique(flat_indices)) != len(entries):
+                duplicated = np.flatnonzero(np.bincount(flat_indices) > 1)[0]
+                coords = {axis: labels[i][j] for i, (axis, j) in enumerate(zip(axes, np.unravel_index(duplicated, shape)))}
+                raise ValueError(f'duplicated result {coords}')
+            counts = np.zeros(math.prod(shape), dtype = np.int64)
+            counts[flat_indices] = [count for _, count in entries]
+            counts = counts.reshape(shape)
+            if counts.sum() != num_to_generate:
+                raise ValueError(
+                    f'results of {axes} sum to {counts.sum()}, but num is {num_to_generate}'
+                )
+            tables[axis_set] = ResultTable(axes, labels, counts)
+        return cls(num_to_generate, tables)
+
+    def table(self, *axes: str) -> ResultTable:
+        '''
+        軸の組が`axes`の表 (軸は`axes`の順に並べる)
+        '''
+        table = self.tables.get(frozenset(axes))
+        if table is None:
+            raise KeyError(f'no results with axes {axes}; available: {[tuple(sorted(k)) for k in self.tables]}')
+        return table.transpose(*axes)
+
+    def counts(self, axis: str, labels: Iterable[Any]) -> np.ndarray:
+        '''
+        1軸の結果を`labels`の順に並べた件数
+        '''
+        return self.table(axis).select(**{axis: labels})
@@ -0,0 +1,93 @@
+'''
+HTML・CSS・JavaScript・JSONの事前圧縮
+
+gzipは標準ライブラリで、brotliは`brotli`モジュールがインストールされているときだけ使う
+
+使い方:
+    python -m scripts.compression            # static/の圧縮版を隣に書き出す (サーバーはあればそれを返す)
+    python -m scripts.compression DIR ...
+'''
+import gzip
+import os
+import sys
+from pathlib import Path
+from typing import Callable
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 圧縮するファイルの拡張子とContent-Type
+COMPRESSIBLE_SUFFIXES = {'.html', '.css', '.js', '.json'}
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json'}
+# これより小さいものは圧縮しない
+MIN_SIZE = 256
+
+def compress_gzip(data: bytes) -> bytes:
+    # 同じ入力から同じ出力になるよう更新日時は0にする
+    return gzip.compress(data, compresslevel = 9, mtime = 0)
+
+def compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality = 11)
+
+# Content-Encoding -> (拡張子, 圧縮関数) (優先する順)
+ENCODINGS: dict[str, tuple[str, Callable[[bytes], bytes]]] = {}
+if brotli is not None:
+    ENCODINGS['br'] = ('.br', compress_brotli)
+ENCODINGS['gzip'] = ('.gz', compress_gzip)
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return ENCODINGS[encoding][1](data)
+
+def is_compressible(path: Path) -> bool:
+    return path.suffix in COMPRESSIBLE_SUFFIXES
+
+def get_sibling(path: Path, encoding: str) -> Path:
+    '''
+    `index.html` -> `index.html.gz`
+    '''
+    return path.with_name(path.name + ENCODINGS[encoding][0])
+
+def write_siblings(path: Path) -> dict[str, int]:
+    '''
+    `path`の圧縮版を隣に書き出し、{Content-Encoding: 圧縮後のバイト数}を返す
+    圧縮版が元のファイルより新しければ作り直さない
+    '''
+    sizes: dict[str, int] = {}
+    stat = path.stat()
+    data = None
+    for encoding in ENCODINGS:
+        sibling = get_sibling(path, encoding)
+        if stat.st_size < MIN_SIZE:
+            sibling.unlink(missing_ok = True)
+            continue
+        if sibling.is_file() and sibling.stat().st_mtime_ns >= stat.st_mtime_ns:
+            sizes[encoding] = sibling.stat().st_size
+            continue
+        if data is None:
+            data = path.read_bytes()
+        compressed = compress(data, encoding)
+        sibling.write_bytes(compressed)
+        sizes[encoding] = len(compressed)
+    return sizes
+
+def compress_directory(root: Path) -> dict[Path, dict[str, int]]:
+    '''
+    ディレクトリ以下の全てのHTML・CSS・JavaScript・JSONの圧縮版を書き出す
+    '''
+    return {
+        path: write_siblings(path)
+        for path in sorted(
+            Path(directory) / filename
+            for directory, _, filenames in os.walk(root)
+            for filename in filenames
+        )
+        if is_compressible(path)
+    }
+
+if __name__ == '__main__':
+    roots = [Path(arg) for arg in sys.argv[1:]] or [Path(__file__).parent.parent / 'static']
+    for root in roots:
+        for path, sizes in compress_directory(root).items():
+            print(f'{path.stat().st_size:9d} B' + ''.join(f' {encoding} {size:8d} B' for encoding, size in sizes.items()) + f'  {path}')
@@ -0,0 +1,53 @@
+'''
+入力ファイルのハッシュ (freeze.pyのマニフェストとサーバーのETagで共通)
+
+ハッシュはリポジトリからの相対パスをキーにした辞書`{'stamp': [更新日時, サイズ], 'sha256': ...}`に記録し、
+更新日時とサイズが前回と同じファイルは読み直さない
+'''
+import hashlib
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).parent.parent
+
+def get_stamp(path: Path) -> list[int]:
+    stat = path.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+def get_name(path: Path) -> str:
+    return path.relative_to(ROOT).as_posix()
+
+def hash_file(path: Path, inputs: dict[str, Any], previous_inputs: dict[str, Any]) -> str:
+    '''
+    ファイルのSHA-256 (更新日時とサイズが前回と同じなら前回の値を使う)
+    '''
+    name = get_name(path)
+    if name not in inputs:
+        stamp = get_stamp(path)
+        previous = previous_inputs.get(name)
+        if previous is not None and previous['stamp'] == stamp:
+            inputs[name] = previous
+        else:
+            inputs[name] = {'stamp': stamp, 'sha256': hashlib.sha256(path.read_bytes()).hexdigest()}
+    return inputs[name]['sha256']
+
+def hash_dependency(path: Path, inputs: dict[str, Any], previous_inputs: dict[str, Any]) -> str:
+    '''
+    ディレクトリは中のファイル名とその内容のハッシュからハッシュを作る
+    '''
+    if not path.is_dir():
+        return hash_file(path, inputs, previous_inputs)
+    digest = hashlib.sha256()
+    for child in sorted(path.iterdir()):
+        if child.is_file():
+            digest.update(f'{child.name}\0{hash_file(child, inputs, previous_inputs)}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+def get_mtime_ns(path: Path) -> int:
+    '''
+    最終更新日時 (ディレクトリは中のファイルも含めて最も新しいもの)
+    '''
+    mtime_ns = path.stat().st_mtime_ns
+    if path.is_dir():
+        mtime_ns = max([mtime_ns] + [child.stat().st_mtime_ns for child in path.iterdir() if child.is_file()])
+    return mtime_ns
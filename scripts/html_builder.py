@@ -0,0 +1,57 @@
+'''
+DOMを作らずに`BeautifulSoup.prettify()`と同じ形式のHTMLを文字列として組み立てる
+'''
+from typing import Any
+
+def escape_text(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def format_attribute(value: Any) -> str:
+    '''
+    属性値をエスケープして引用符で囲む (BeautifulSoupのminimalフォーマッタと同じ規則)
+    '''
+    value = escape_text(str(value))
+    if '"' not in value:
+        return f'"{value}"'
+    elif "'" not in value:
+        return f"'{value}'"
+    else:
+        return '"' + value.replace('"', '&quot;') + '"'
+
+def format_attributes(attrs: dict[str, Any]) -> str:
+    return ''.join(
+        f' {name}={format_attribute(value)}' for name, value in sorted(attrs.items())
+    )
+
+def start_tag(depth: int, name: str, **attrs: Any) -> str:
+    return f'{" " * depth}<{name}{format_attributes(attrs)}>\n'
+
+def end_tag(depth: int, name: str) -> str:
+    return f'{" " * depth}</{name}>\n'
+
+def void_tag(depth: int, name: str, **attrs: Any) -> str:
+    '''
+    `<img/>`や`<br/>`などの空要素
+    '''
+    return f'{" " * depth}<{name}{format_attributes(attrs)}/>\n'
+
+def text(depth: int, string: Any) -> str:
+    '''
+    テキストノード (前後の空白は除去され、空なら何も出力しない)
+    '''
+    string = str(string).strip()
+    if string == '':
+        return ''
+    return f'{" " * depth}{escape_text(string)}\n'
+
+def empty_tag(depth: int, name: str, **attrs: Any) -> str:
+    '''
+    子を持たない要素 (`<p></p>`など)
+    '''
+    return start_tag(depth, name, **attrs) + end_tag(depth, name)
+
+def indent(fragment: str, depth: int) -> str:
+    '''
+    深さ0で組み立てた断片を`depth`段インデントする
+    '''
+    return ''.join(' ' * depth + line for line in fragment.splitlines(keepends = True))
@@ -0,0 +1,261 @@
+'''
+お宝・CaveGenの画像の縮小版
+
+ビルド時に表示する幅に合わせた縮小版 (パレット化などで最適化したPNG、Pillowがあれば WebP も) を作り、
+内容のハッシュをファイル名にして`static/images/variants`に置く
+元の画像と作り方が同じ間は作り直さない
+
+使い方: python -m scripts.image_variants [--force]
+'''
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from scripts import png
+from scripts.file_hashes import get_stamp
+
+ROOT = Path(__file__).parent.parent
+STATIC_DIR = ROOT / 'static'
+VARIANT_DIR = STATIC_DIR / 'images/variants'
+MANIFEST_PATH = ROOT / 'build/image-variants.json'
+# 縮小・エンコードの方法を変えたら上げる (全ての縮小版が作り直される)
+PIPELINE_VERSION = 1
+
+# 元の画像のディレクトリ (`static/`からの相対パス) -> 作る幅 (元の幅以上のものは元の幅で1つだけ作る)
+VARIANT_WIDTHS: dict[str, list[int]] = {
+    'images/treasures': [32],
+    'images/CaveGen': [480, 960],
+}
+WEBP_QUALITY = 80
+# URLでクオートしない文字 (werkzeugと同じ)
+QUOTE_SAFE = "!$&'()*+,/:;=@"
+
+def get_source_paths() -> list[Path]:
+    return sorted(
+        path
+        for directory in VARIANT_WIDTHS
+        for path in (STATIC_DIR / directory).rglob('*.png')
+        if path.is_file()
+    )
+
+def get_source_name(path: Path) -> str:
+    return path.relative_to(STATIC_DIR).as_posix()
+
+def get_widths(source_name: str, width: int) -> list[int]:
+    directory = next(d for d in VARIANT_WIDTHS if source_name.startswith(d + '/'))
+    widths = sorted({min(w, width) for w in VARIANT_WIDTHS[directory]})
+    return widths
+
+def get_resampling_matrix(size: int, new_size: int) -> np.ndarray:
+    '''
+    面積平均で`size`個の画素を`new_size`個にする(new_size, size)の重み
+    '''
+    edges = np.arange(new_size + 1) * (size / new_size)
+    lo = np.arange(size)
+    # 出力の画素[edges[i], edges[i + 1])と入力の画素[j, j + 1)が重なる長さ
+    overlap = np.clip(
+        np.minimum(edges[1:, None], lo[None, :] + 1) - np.maximum(edges[:-1, None], lo[None, :]),
+        0, None,
+    )
+    return overlap / overlap.sum(axis = 1, keepdims = True)
+
+def resize(rgba: np.ndarray, width: int, height: int) -> np.ndarray:
+    '''
+    面積平均で縮小する (透明な画素の色が混ざらないよう、アルファを掛けてから平均する)
+    '''
+    if rgba.shape[:2] == (height, width):
+        return rgba
+    image = rgba.astype(np.float64)
+    image[..., :3] *= image[..., 3:] / 255
+    rows = get_resampling_matrix(rgba.shape[0], height)
+    columns = get_resampling_matrix(rgba.shape[1], width)
+    # 縦と横に分けて行列を掛ける
+    image = (rows @ image.reshape(rgba.shape[0], -1)).reshape(height, rgba.shape[1], 4)
+    image = (image.transpose(0, 2, 1) @ columns.T).transpose(0, 2, 1)
+    alpha = image[..., 3:]
+    image[..., :3] = np.where(alpha > 0, image[..., :3] * 255 / np.maximum(alpha, 1e-9), 0)
+    return np.clip(np.rint(image), 0, 255).astype(np.uint8)
+
+def encode_webp(rgba: np.ndarray, lossless: bool) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, 'WEBP', lossless = lossless, quality = 100 if lossless else WEBP_QUALITY)
+    return buffer.getvalue()
+
+def write_variant(data: bytes, suffix: str) -> str:
+    filename = f'{hashlib.sha256(data).hexdigest()[:16]}{suffix}'
+    path = VARIANT_DIR / filename
+    if not path.exists():
+        path.write_bytes(data)
+    return filename
+
+def make_variants(path: Path) -> dict[str, Any]:
+    '''
+    1枚の画像の縮小版を書き出し、マニフェストの項目を返す
+    '''
+    source = path.read_bytes()
+    rgba = png.decode(path)
+    height, width, _ = rgba.shape
+    # 元の画像が少ない色数ならパレットのまま可逆に、そうでなければWebPは非可逆にする
+    lossless = len(np.unique(np.ascontiguousarray(rgba).view(np.uint32))) <= 256
+    variants = []
+    for variant_width in get_widths(get_source_name(path), width):
+        variant_height = max(1, round(height * variant_width / width))
+        resized = resize(rgba, variant_width, variant_height)
+        data = png.encode(resized, optimize = True)
+        if variant_width == width and len(source) <= len(data):
+            # 元の画像の方が小さければそのまま使う
+            data = source
+        variant = {
+            'width': variant_width,
+            'height': variant_height,
+            'png': write_variant(data, '.png'),
+        }
+        if Image is not None:
+            variant['webp'] = write_variant(encode_webp(resized, lossless), '.webp')
+        variants.append(variant)
+    return {'width': width, 'height': height, 'variants': variants}
+
+def get_pipeline() -> list[Any]:
+    '''
+    作り方 (これが変わったら全て作り直す)
+    '''
+    return [PIPELINE_VERSION, VARIANT_WIDTHS, Image is not None, WEBP_QUALITY]
+
+def read_manifest() -> dict[str, Any] | None:
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding = 'utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def build(force: bool = False) -> dict[str, Any]:
+    '''
+    元の画像が追加・更新されたものだけ縮小版を作り、マニフェストを返す
+    '''
+    previous = None if force else read_manifest()
+    if previous is None or previous.get('pipeline') != get_pipeline():
+        previous = {'images': {}}
+    VARIANT_DIR.mkdir(parents = True, exist_ok = True)
+    existing = {path.name for path in VARIANT_DIR.iterdir()}
+
+    images: dict[str, Any] = {}
+    for path in get_source_paths():
+        name = get_source_name(path)
+        stamp = get_stamp(path)
+        old = previous['images'].get(name)
+        if old is not None and old['stamp'] == stamp and all(
+            variant[key] in existing for variant in old['variants'] for key in ['png', 'webp'] if key in variant
+        ):
+            images[name] = old
+            continue
+        try:
+            images[name] = {'stamp': stamp, **make_variants(path)}
+        except ValueError as e:
+            print(f'skipped: {e}', file = sys.stderr)
+
+    # どの画像からも使われなくなった縮小版を消す
+    used = {variant[key] for image in images.values() for variant in image['variants'] for key in ['png', 'webp'] if key in variant}
+    for path in VARIANT_DIR.iterdir():
+        if path.name not in used:
+            path.unlink()
+
+    manifest = {'pipeline': get_pipeline(), 'images': images}
+    if manifest != read_manifest():
+        MANIFEST_PATH.parent.mkdir(parents = True, exist_ok = True)
+        temp_path = MANIFEST_PATH.with_suffix(f'.{os.getpid()}.tmp')
+        temp_path.write_text(json.dumps(manifest, indent = 1), encoding = 'utf-8')
+        temp_path.replace(MANIFEST_PATH)
+    return manifest
+
+_manifest: dict[str, Any] | None = None
+_manifest_stamp: list[int] | None = None
+_manifest_lock = threading.Lock()
+
+def get_manifest_file_stamp() -> list[int] | None:
+    try:
+        return get_stamp(MANIFEST_PATH)
+    except FileNotFoundError:
+        return None
+
+def load() -> dict[str, Any]:
+    '''
+    マニフェストを読む (ファイルが書き換えられたときだけ読み直す)
+    縮小版はリクエストの処理中には作らず (freeze.pyか`python -m scripts.image_variants`で作る)、
+    マニフェストがなければ縮小版のない空のマニフェストにして元の画像を使う
+    '''
+    global _manifest, _manifest_stamp
+    with _manifest_lock:
+        stamp = get_manifest_file_stamp()
+        if _manifest is None or stamp != _manifest_stamp:
+            manifest = read_manifest()
+            if manifest is None:
+                print(f'{MANIFEST_PATH} does not exist; using the original images '
+                      '(run freeze.py or python -m scripts.image_variants)', file = sys.stderr)
+                manifest = {'pipeline': None, 'images': {}}
+            _manifest, _manifest_stamp = manifest, stamp
+        return _manifest
+
+def get_image_attrs(source_name: str, static_prefix: str, display_width: int | None = None) -> dict[str, Any]:
+    '''
+    `static/`からの相対パスの画像を幅`display_width` (省略すると元の幅) で表示する`img`の属性
+    縮小版があれば`src`・`srcset`・`sizes`をそれに向け、いずれも遅延読み込みにする
+    '''
+    image = load()['images'].get(source_name)
+    if image is None:
+        # 縮小版がない (ビルド後に追加された) 画像は元の画像をそのまま使う
+        attrs: dict[str, Any] = {'src': f'{static_prefix}/{quote(source_name, safe = QUOTE_SAFE)}', 'loading': 'lazy'}
+        if display_width is not None:
+            attrs['width'] = display_width
+        return attrs
+    if display_width is None:
+        display_width = image['width']
+    variants = image['variants']
+    # 表示する幅以上で最小のもの (なければ最大のもの) を既定にする
+    default = next((v for v in variants if v['width'] >= display_width), variants[-1])
+    attrs = {
+        'src': f'{static_prefix}/images/variants/{default["png"]}',
+        'width': display_width,
+        'height': round(image['height'] * display_width / image['width']),
+        'loading': 'lazy',
+    }
+    if len(variants) > 1:
+        attrs['srcset'] = ', '.join(f'{static_prefix}/images/variants/{v["png"]} {v["width"]}w' for v in variants)
+        attrs['sizes'] = f'{display_width}px'
+    return attrs
+
+def get_webp_srcset(source_name: str, static_prefix: str) -> str | None:
+    '''
+    `picture`の`source`に使うWebPの`srcset` (WebPがなければ`None`)
+    '''
+    image = load()['images'].get(source_name)
+    if image is None or not all('webp' in v for v in image['variants']):
+        return None
+    return ', '.join(f'{static_prefix}/images/variants/{v["webp"]} {v["width"]}w' for v in image['variants'])
+
+def get_manifest_stamp() -> tuple[int, ...]:
+    '''
+    縮小版が作り直されると変わる値 (生成したHTMLのキャッシュキー用、マニフェストがなければ空)
+    '''
+    return tuple(get_manifest_file_stamp() or ())
+
+if __name__ == '__main__':
+    manifest = build(force = '--force' in sys.argv[1:])
+    source_bytes = sum((STATIC_DIR / name).stat().st_size for name in manifest['images'])
+    variant_bytes = {
+        key: sum((VARIANT_DIR / v[key]).stat().st_size for image in manifest['images'].values() for v in image['variants'] if key in v)
+        for key in ['png', 'webp']
+    }
+    print(f'{len(manifest["images"])} images ({source_bytes} B): '
+          + ', '.join(f'{key} {size} B' for key, size in variant_bytes.items() if size > 0))
+    print(f'-> {MANIFEST_PATH}')
@@ -0,0 +1,70 @@
+'''
+二項分布の確率の信頼区間
+
+一部のシードだけを探索した調査で、件数から求めた確率がどの範囲にあるか (配列全体をまとめて計算する)
+Wilsonの区間はNumPyだけで計算し、Clopper-Pearsonの区間は`scipy`がインストールされているときだけ使える
+'''
+import numpy as np
+from statistics import NormalDist
+
+try:
+    from scipy import stats
+except ImportError:
+    stats = None
+
+DEFAULT_CONFIDENCE = 0.95
+METHODS = ['wilson', 'clopper-pearson']
+
+def wilson(counts: np.ndarray, num: int, confidence: float = DEFAULT_CONFIDENCE) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    `num`回中`counts`回起きたときの確率のWilsonスコア区間 (下限, 上限)
+    '''
+    counts = np.asarray(counts, dtype = np.float64)
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = counts / num
+    denominator = 1 + z * z / num
+    center = (p + z * z / (2 * num)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / num + z * z / (4 * num * num)) / denominator
+    # 0件・全件のときの端は丸め誤差で0・1からずれるので、そのまま0・1にする
+    low = np.where(counts == 0, 0.0, np.clip(center - half_width, 0, 1))
+    high = np.where(counts == num, 1.0, np.clip(center + half_width, 0, 1))
+    return low, high
+
+def clopper_pearson(counts: np.ndarray, num: int, confidence: float = DEFAULT_CONFIDENCE) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    ベータ分布の分位点による正確な (保守的な) 区間 (`scipy`が必要)
+    '''
+    if stats is None:
+        raise ImportError('the Clopper-Pearson interval requires scipy')
+    counts = np.asarray(counts, dtype = np.float64)
+    alpha = 1 - confidence
+    with np.errstate(invalid = 'ignore'):
+        low = np.where(counts == 0, 0.0, stats.beta.ppf(alpha / 2, counts, num - counts + 1))
+        high = np.where(counts == num, 1.0, stats.beta.ppf(1 - alpha / 2, counts + 1, num - counts))
+    return low, high
+
+def interval(
+    counts: np.ndarray,
+    num: int,
+    confidence: float = DEFAULT_CONFIDENCE,
+    method: str = 'wilson',
+) -> tuple[np.ndarray, np.ndarray]:
+    if method == 'wilson':
+        return wilson(counts, num, confidence)
+    elif method == 'clopper-pearson':
+        return clopper_pearson(counts, num, confidence)
+    raise ValueError(f'unknown method {method!r} (one of {METHODS})')
+
+def relative_half_widths(
+    counts: np.ndarray,
+    num: int,
+    confidence: float = DEFAULT_CONFIDENCE,
+    method: str = 'wilson',
+) -> np.ndarray:
+    '''
+    区間の幅の半分を推定値で割ったもの (まだ1度も起きていなければ無限大)
+    '''
+    counts = np.asarray(counts, dtype = np.float64)
+    low, high = interval(counts, num, confidence, method)
+    with np.errstate(divide = 'ignore'):
+        return np.where(counts > 0, (high - low) / 2 / (counts / num), np.inf)
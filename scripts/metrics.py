@@ -0,0 +1,117 @@
+'''
+リクエストの処理時間の計測
+
+データの読み込み・生成・テンプレートの描画などの段階ごとの時間をリクエスト中に記録して`Server-Timing`ヘッダーにし、
+ルートごとの処理時間のヒストグラム、キャッシュのヒット率、エラー数と合わせてPrometheusのテキスト形式で出力する
+'''
+import bisect
+import flask
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# ヒストグラムの区切り (秒)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    '''
+    `BUCKETS`の区切りごとの件数と合計
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def format(self, name: str, labels: str) -> list[str]:
+        '''
+        Prometheusの`_bucket` (累積)・`_sum`・`_count`の行
+        '''
+        lines = []
+        cumulative = 0
+        for bound, count in zip([*map(str, BUCKETS), '+Inf'], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+lock = threading.Lock()
+# ルート -> 処理時間
+request_latency: dict[str, Histogram] = {}
+# 段階 -> 処理時間
+phase_latency: dict[str, Histogram] = {}
+# キャッシュの名前 -> [ヒット数, ミス数]
+cache_counts: dict[str, list[int]] = {}
+# ルート -> ステータスコードが500以上だったリクエストの数
+error_counts: dict[str, int] = {}
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    '''
+    `with`の中の処理時間を段階`name`として記録する (リクエスト中なら`Server-Timing`にも載せる)
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with lock:
+            phase_latency.setdefault(name, Histogram()).observe(seconds)
+        if flask.has_request_context():
+            flask.g.setdefault('timings', []).append((name, seconds))
+
+def record_cache(name: str, hit: bool):
+    with lock:
+        counts = cache_counts.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+def record_request(route: str, seconds: float, status_code: int):
+    with lock:
+        request_latency.setdefault(route, Histogram()).observe(seconds)
+        if status_code >= 500:
+            error_counts[route] = error_counts.get(route, 0) + 1
+
+def get_server_timing(total: float) -> str:
+    '''
+    リクエスト中に記録した段階の`Server-Timing`ヘッダーの値 (同じ段階は合計する)
+    '''
+    durations: dict[str, float] = {}
+    for name, seconds in flask.g.get('timings', []):
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in durations.items())
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus() -> str:
+    '''
+    計測結果 (Prometheusのテキスト形式)
+    '''
+    lines: list[str] = []
+    with lock:
+        lines.append('# HELP http_request_duration_seconds Request latency by route.')
+        lines.append('# TYPE http_request_duration_seconds histogram')
+        for route, histogram in sorted(request_latency.items()):
+            lines += histogram.format('http_request_duration_seconds', f'route="{escape_label(route)}"')
+        lines.append('# HELP phase_duration_seconds Time spent in each phase of request handling.')
+        lines.append('# TYPE phase_duration_seconds histogram')
+        for name, histogram in sorted(phase_latency.items()):
+            lines += histogram.format('phase_duration_seconds', f'phase="{escape_label(name)}"')
+        lines.append('# HELP cache_requests_total Cache lookups by cache and result.')
+        lines.append('# TYPE cache_requests_total counter')
+        for name, (hits, misses) in sorted(cache_counts.items()):
+            lines.append(f'cache_requests_total{{cache="{escape_label(name)}",result="hit"}} {hits}')
+            lines.append(f'cache_requests_total{{cache="{escape_label(name)}",result="miss"}} {misses}')
+        lines.append('# HELP http_request_errors_total Responses with status 5xx by route.')
+        lines.append('# TYPE http_request_errors_total counter')
+        for route, count in sorted(error_counts.items()):
+            lines.append(f'http_request_errors_total{{route="{escape_label(route)}"}} {count}')
+    return '\n'.join(lines) + '\n'
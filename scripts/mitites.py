@@ -0,0 +1,73 @@
+'''
+タマゴムシの出現数の確率分布
+
+タマゴは1つごとに独立に確率1/20でタマゴムシになるので、タマゴがe個のときのタマゴムシの数は二項分布B(e, 1/20)に従う
+分布はいずれも「インデックス = 個数」の確率の配列で表す
+'''
+import functools
+import math
+import numpy as np
+from typing import Iterable
+
+# タマゴ1つがタマゴムシになる確率
+MITITES_PROB = 1 / 20
+
+@functools.lru_cache(maxsize = None)
+def _binomial_pmf_matrix(max_eggs: int) -> np.ndarray:
+    # `math.comb(e, m) * p ** m * ...`は数が1000個程度を超えるとfloatに収まらないので、対数で計算する
+    log_factorials = np.array([math.lgamma(k + 1) for k in range(max_eggs + 1)])
+    eggs = np.arange(max_eggs + 1)[:, np.newaxis]
+    mitites = np.arange(max_eggs + 1)[np.newaxis, :]
+    others = np.maximum(eggs - mitites, 0)
+    log_matrix = (
+        log_factorials[eggs] - log_factorials[mitites] - log_factorials[others]
+        + mitites * math.log(MITITES_PROB) + others * math.log(1 - MITITES_PROB)
+    )
+    matrix = np.where(mitites <= eggs, np.exp(log_matrix), 0.)
+    matrix.flags.writeable = False
+    return matrix
+
+def binomial_pmf_matrix(max_eggs: int) -> np.ndarray:
+    '''
+    `matrix[eggs, mitites]`がタマゴ`eggs`個からタマゴムシが`mitites`匹出る確率の行列
+    (大きさ64単位で切り上げて作り、使い回す)
+    '''
+    size = -(-(max_eggs + 1) // 64) * 64
+    return _binomial_pmf_matrix(size - 1)[:max_eggs + 1, :max_eggs + 1]
+
+def fixed(count: int) -> np.ndarray:
+    '''
+    必ず`count`個になる分布
+    '''
+    distribution = np.zeros(count + 1)
+    distribution[count] = 1.
+    return distribution
+
+def from_counts(counts: Iterable[int], num_to_generate: int) -> np.ndarray:
+    '''
+    調査結果の件数 (インデックス = 個数) から分布を作る
+    '''
+    return np.asarray(counts, dtype = float) / num_to_generate
+
+def mitites_from_eggs(egg_probs: Iterable[float]) -> np.ndarray:
+    '''
+    タマゴの数の分布からタマゴムシの数の分布を求める
+    '''
+    egg_probs = np.asarray(egg_probs, dtype = float)
+    return egg_probs @ binomial_pmf_matrix(len(egg_probs) - 1)
+
+def convolve(*distributions: Iterable[float]) -> np.ndarray:
+    '''
+    独立な個数の合計の分布 (サブレベルごとの分布を畳み込む)
+    '''
+    total = np.ones(1)
+    for distribution in distributions:
+        total = np.convolve(total, np.asarray(distribution, dtype = float))
+    return total
+
+def total_mitites(*egg_distributions: Iterable[float]) -> np.ndarray:
+    '''
+    サブレベルごとのタマゴの数の分布から、全サブレベルのタマゴムシの合計数の分布を求める
+    (タマゴムシになるかはタマゴごとに独立なので、タマゴの合計数の分布に二項分布を1度掛ければよい)
+    '''
+    return mitites_from_eggs(convolve(*egg_distributions))
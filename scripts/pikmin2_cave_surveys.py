@@ -1,193 +1,222 @@
-from bs4 import BeautifulSoup
-import bs4
 import flask
 from markupsafe import Markup
 import numpy as np
 import json
-import yaml
-from typing import Any
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable
 import math
+import threading
+
+from scripts import html_builder, image_variants, intervals, metrics, mitites
+from scripts.cave_survey_results import ResultTable, SurveyResult
+
+TABLE_STYLE = 'border-collapse:collapse;text-align:center;background-color:#f0f0f0;font-size:16;white-space:nowrap'
+
+# シードの範囲は[0, 0x80000000)
+SEED_SPACE = 0x80000000
+
+# 一部のシードだけ探索したステージでは、件数の表の確率の下に信頼区間の行を付ける (`render_stage_uncached`が設定する)
+show_intervals: ContextVar[bool] = ContextVar('show_intervals', default = False)
+# 出力するページからサイトのルートへの相対パス (ページは`/pikmin2/cave-surveys.html`、1ステージ分は1階層深い)
+relative_root: ContextVar[str] = ContextVar('relative_root', default = '..')
+
+def compute_rowspans(array: np.ndarray) -> np.ndarray:
+    '''
+    `'↓'`のセルを上のセルに結合したときの各セルのrowspanを列ごとに1パスで求める
+    結合されて消えるセルは0になる (0, 1行目の`'↓'`は結合しない)
+    '''
+    merged = array == '↓'
+    merged[:2, :] = False
+    rowspans = np.ones(array.shape)
+    # 下から順に、直下に続く結合セルの数を数える
+    below = np.zeros(array.shape[1])
+    for i in range(array.shape[0] - 1, -1, -1):
+        rowspans[i] += below
+        below = np.where(merged[i], rowspans[i], 0)
+    rowspans[merged] = 0
+    return rowspans
 
 def create_table(
-        soup: BeautifulSoup,
         array: np.ndarray,
         *,
         background_color: np.ndarray | None = None
-        ) -> bs4.Tag:
+        ) -> str:
     '''
     `array`を元に表を作成
     '''
-    table_parent = soup.new_tag('div', style = 'overflow:auto')
-    table = soup.new_tag(
-        'table', 
-        border = '1',
-        style = 'border-collapse:collapse;text-align:center;background-color:#f0f0f0;font-size:16;white-space:nowrap',
-    )
-
-    rowspans = np.ones(array.shape)
-    while True:
-        changed = False
-        for i in range(array.shape[0] - 1, 1, -1):
-            for j in range(array.shape[1]):
-                if array[i, j] == '↓':
-                    array[i, j] = ''
-                    rowspans[i - 1, j] += rowspans[i, j]
-                    rowspans[i, j] = 0
-                    changed = True
-                    break
-            if changed:
-                break
-        if not changed:
-            break
-
-    for i in range(array.shape[0]):
-        table_row = soup.new_tag('tr')
-        for j in range(array.shape[1]):
-            if rowspans[i, j] == 0:
+    rowspans = compute_rowspans(array)
+    td_styles = np.full(array.shape, 'padding:5', dtype = object)
+    if background_color is not None:
+        background_color = background_color[:array.shape[0], :array.shape[1]]
+        colored = background_color != ''
+        td_styles[colored] = 'padding:5;background-color:' + background_color[colored]
+
+    html = [
+        html_builder.start_tag(0, 'div', style = 'overflow:auto'),
+        html_builder.start_tag(1, 'table', border = '1', style = TABLE_STYLE),
+    ]
+    tr_start = html_builder.start_tag(2, 'tr')
+    tr_end = html_builder.end_tag(2, 'tr')
+    td_end = html_builder.end_tag(3, 'td')
+    # 開始タグはスタイルとrowspanの組ごとに1度だけ作る
+    td_starts: dict[tuple[str, float], str] = {}
+    # セルごとに関数を呼ぶと遅いので、`html_builder.text(4, cell)`を展開して1つの文字列にする
+    # (エスケープが要るのは`&`・`<`・`>`を含むセルだけ)
+    for cells, styles, spans in zip(array.tolist(), td_styles.tolist(), rowspans.tolist()):
+        html.append(tr_start)
+        for cell, style, rowspan in zip(cells, styles, spans):
+            if rowspan == 0:
                 continue
-            td_style = 'padding:5'
-            if background_color is not None and background_color[i, j] != '':
-                td_style += f';background-color:{background_color[i, j]}'
-            options = {
-                'style': td_style,
-            }
-            if rowspans[i, j] != 1:
-                options['rowspan'] = str(rowspans[i, j])
-            table_data = soup.new_tag('td', **options)
-            table_data.string = str(array[i, j])
-            table_row.append(table_data)
-        table.append(table_row)
-
-    table_parent.append(table)
-    return table_parent
+            td_start = td_starts.get((style, rowspan))
+            if td_start is None:
+                if rowspan != 1:
+                    td_start = html_builder.start_tag(3, 'td', style = style, rowspan = str(rowspan))
+                else:
+                    td_start = html_builder.start_tag(3, 'td', style = style)
+                td_starts[style, rowspan] = td_start
+            string = str(cell).strip()
+            if string == '':
+                html.append(td_start + td_end)
+                continue
+            if '&' in string or '<' in string or '>' in string:
+                string = html_builder.escape_text(string)
+            html.append(f'{td_start}    {string}\n{td_end}')
+        html.append(tr_end)
+    html.append(html_builder.end_tag(1, 'table'))
+    html.append(html_builder.end_tag(0, 'div'))
+    return ''.join(html)
 
 def create_count_table(
-        soup: BeautifulSoup, 
-        counts: list[int], 
-        *, 
+        counts: list[int] | np.ndarray | ResultTable,
+        *,
         labels: list[str] | None = None,
-        ) -> bs4.Tag:
+        ) -> str:
     '''
     `counts`を横に並べた表を作成
+    `ResultTable`なら1次元に展開し (`ResultTable.flatten`)、ラベルも表のものを使う
     '''
+    if isinstance(counts, ResultTable):
+        table = counts if len(counts.axes) == 1 else counts.flatten()
+        counts = table.counts
+        if labels is None:
+            labels = list(map(str, table.labels[0]))
 
     assert labels is None or len(counts) == len(labels)
     if labels is None:
         labels = [str(i) for i in range(len(counts))]
 
-    num_to_generate = sum(counts)
-    left_skip = 0
-    for i in range(len(counts)):
-        if counts[i] == 0:
-            left_skip += 1
-        else:
-            break
-    array = np.full((4, len(counts[left_skip:]) + 2), '', dtype = object)
+    counts = np.asarray(counts)
+    num_to_generate = int(counts.sum())
+    nonzero = np.flatnonzero(counts)
+    left_skip = nonzero[0] if len(nonzero) > 0 else len(counts)
+    num_columns = len(counts) - left_skip
+    num_rows = get_num_count_rows()
+    array = np.full((num_rows + 1, num_columns + 2), '', dtype = object)
     array[1, 0] = '件数／確率'
-    array[2 : 4, 0] = '↓'
-    array[0, len(counts[left_skip:]) + 1] = '合計'
-    for i, count in enumerate(counts[left_skip:]):
-        array[0, 1 + i] = labels[i + left_skip]
-        array[1 : 4, 1 + i] = get_count_prob_tuple(count, num_to_generate)
-    array[1 : 4, len(counts[left_skip:]) + 1] = \
-        get_count_prob_tuple(num_to_generate, num_to_generate)
-    background_color = np.full((4, len(counts[left_skip:]) + 2), '', dtype = object)
+    array[2 : num_rows + 1, 0] = '↓'
+    array[0, num_columns + 1] = '合計'
+    array[0, 1 : num_columns + 1] = labels[left_skip:]
+    array[1 : num_rows + 1, 1 : num_columns + 1] = get_count_prob_array(counts[left_skip:], num_to_generate)
+    array[1 : num_rows + 1, num_columns + 1] = get_count_prob_tuple(num_to_generate, num_to_generate)
+    background_color = np.full((num_rows + 1, num_columns + 2), '', dtype = object)
     background_color[0, :] = '#d0d0d0'
     background_color[1, :] = '#e0e0e0'
-    table = create_table(soup, array, background_color = background_color)
+    table = create_table(array, background_color = background_color)
     return table
 
 def create_count_table2d(
-        soup: BeautifulSoup, 
-        counts: list[list[int]] | np.ndarray, 
-        xlabels: list[Any],
-        ylabels: list[Any],
+        counts: list[list[int]] | np.ndarray | ResultTable,
+        xlabels: list[Any] | None = None,
+        ylabels: list[Any] | None = None,
         *,
         title: str | None = None,
         xsum: bool = True,
         ysum: bool = True,
-        ):
+        ) -> str:
     '''
     `counts`を縦横に並べた表を作成
+    2次元の`ResultTable`なら1つ目の軸を縦、2つ目の軸を横に並べ、ラベルも表のものを使う (`ResultTable.pivot`を参照)
     '''
+    if isinstance(counts, ResultTable):
+        assert len(counts.axes) == 2, counts.axes
+        ylabels = counts.labels[0] if ylabels is None else ylabels
+        xlabels = counts.labels[1] if xlabels is None else xlabels
+        counts = counts.counts
+    assert xlabels is not None and ylabels is not None
     counts = np.array(counts)
     num_to_generate = int(counts.sum())
     xlabels = list(map(str, xlabels))
     ylabels = list(map(str, ylabels))
-    rows = 3 * counts.shape[0] + 1
-    cols = counts.shape[1] + 1
-    if ysum: rows += 3
+    height, width = counts.shape
+    # 1つの件数あたりの行数
+    k = get_num_count_rows()
+    rows = k * height + 1
+    cols = width + 1
+    if ysum: rows += k
     if xsum: cols += 1
     array = np.full((rows, cols), '', dtype = object)
     if title is not None: array[0, 0] = title
     array[1:, 0] = '↓'
-    array[3 * np.arange(counts.shape[0]) + 1, 0] = ylabels
+    array[k * np.arange(height) + 1, 0] = ylabels
     if xsum: array[0, -1] = '合計'
-    if ysum: array[-3, 0] = '合計'
-    array[0, 1: 1 + counts.shape[1]] = xlabels
-    for i in range(counts.shape[0]):
-        for j in range(counts.shape[1]):
-            array[3 * i + 1: 3 * i + 4, j + 1] = get_count_prob_tuple(counts[i, j], num_to_generate)
-        if xsum:
-            array[3 * i + 1: 3 * i + 4, -1] = get_count_prob_tuple(counts[i, :].sum(), num_to_generate)
+    if ysum: array[-k, 0] = '合計'
+    array[0, 1: 1 + width] = xlabels
+    # 件数・百分率・分数 (と信頼区間) の行を各行の下に並べる
+    array[1: k * height + 1, 1: 1 + width] = \
+        get_count_prob_array(counts, num_to_generate).transpose(1, 0, 2).reshape(k * height, width)
+    if xsum:
+        array[1: k * height + 1, -1] = \
+            get_count_prob_array(counts.sum(axis = 1), num_to_generate).T.reshape(k * height)
     if ysum:
-        for j in range(counts.shape[1]):
-            array[-3:, j + 1] = get_count_prob_tuple(counts[:, j].sum(), num_to_generate)
+        array[-k:, 1: 1 + width] = get_count_prob_array(counts.sum(axis = 0), num_to_generate)
     if xsum and ysum:
-        array[3 * counts.shape[0] + 1: 3 * counts.shape[0] + 4, counts.shape[1] + 1] = get_count_prob_tuple(num_to_generate, num_to_generate)
+        array[k * height + 1: k * height + 1 + k, width + 1] = get_count_prob_tuple(num_to_generate, num_to_generate)
     background_color = np.full(array.shape, '', dtype = object)
     background_color[0, :] = '#d0d0d0'
-    background_color[3 * np.arange(rows // 3) + 1, :] = '#e0e0e0'
-    table = create_table(soup, array, background_color = background_color)
+    background_color[k * np.arange(rows // k) + 1, :] = '#e0e0e0'
+    table = create_table(array, background_color = background_color)
     return table
 
-def create_true_false_table_from_counts(soup: BeautifulSoup, counts: list[int]) -> bs4.Tag:
+def create_true_false_table_from_counts(counts: list[int]) -> str:
     '''
     ありかなしかの2択を表す表を作成
     '''
-    return create_count_table(soup, counts, labels = ['あり', 'なし'])
+    return create_count_table(counts, labels = ['あり', 'なし'])
 
-def create_true_false_table_from_result(soup: BeautifulSoup, result: dict[str, Any], name: str) -> bs4.Tag:
-    counts = [result[f'{{{name}: true}}'], result[f'{{{name}: false}}']]
-    return create_true_false_table_from_counts(soup, counts)
+def create_true_false_table_from_result(result: SurveyResult, name: str) -> str:
+    counts = result.counts(name, [True, False])
+    return create_true_false_table_from_counts(counts)
 
 def create_mitites_table(
-        soup: BeautifulSoup, 
-        *, 
-        egg_probs: list[float] | None = None,
-        mitites_probs: list[float] | None = None,
-        ) -> bs4.Tag:
+        *,
+        egg_probs: list[float] | np.ndarray | None = None,
+        mitites_probs: list[float] | np.ndarray | None = None,
+        ) -> str:
     '''
     タマゴの確率分布`egg_probs`またはタマゴムシの確率`mitites_probs`を元に表を作成
     '''
     assert (egg_probs is not None and mitites_probs is None) or \
         (egg_probs is None and mitites_probs is not None)
     if egg_probs is not None:
-        mitites_probs = []
-        for mitites in range(len(egg_probs)):
-            mitites_probs.append(sum(
-                egg_probs[eggs] * calc_mitites_prob(eggs, mitites) 
-                for eggs in range(mitites, len(egg_probs))
-            ))
-
-    left_skip = 0
-    for i in range(len(mitites_probs)):
-        if mitites_probs[i] == 0:
-            left_skip += 1
-        else:
-            break
+        mitites_probs = mitites.mitites_from_eggs(egg_probs)
 
-    array = np.full((3, len(mitites_probs[left_skip:]) + 1), '', dtype = object)
+    mitites_probs = np.asarray(mitites_probs, dtype = float)
+    nonzero = np.flatnonzero(mitites_probs)
+    left_skip = nonzero[0] if len(nonzero) > 0 else len(mitites_probs)
+    num_columns = len(mitites_probs) - left_skip
+
+    array = np.full((3, num_columns + 1), '', dtype = object)
     array[0, 0] = 'タマゴムシのセット数'
     array[1, 0] = '確率'
     array[2, 0] = '↓'
-    for mitites, mitites_prob in enumerate(mitites_probs[left_skip:]):
-        array[0, 1 + mitites] = mitites + left_skip
-        array[1 : 3, 1 + mitites] = get_prob_tuple(mitites_prob)
-    background_color = np.full((3, len(mitites_probs) + 1), '', dtype = object)
+    array[0, 1:] = np.arange(left_skip, len(mitites_probs))
+    array[1, 1:] = get_percentage_strs(mitites_probs[left_skip:])
+    array[2, 1:] = get_fraction_strs(mitites_probs[left_skip:])
+    background_color = np.full((3, num_columns + 1), '', dtype = object)
     background_color[0, :] = '#d0d0d0'
     background_color[1, 0] = '#e0e0e0'
-    table = create_table(soup, array, background_color = background_color)
+    table = create_table(array, background_color = background_color)
     return table
 
 def get_percentage_str(probability: float) -> str:
@@ -197,7 +226,7 @@ def get_percentage_str(probability: float) -> str:
     else:
         digits = -math.floor(math.log10(probability * 100))
         return f'{probability * 100:.{digits + 3}f}%'
- 
+
 def get_fraction_str(probability: float) -> str:
     assert 0 <= probability <= 1, probability
     if probability == 0:
@@ -207,351 +236,637 @@ def get_fraction_str(probability: float) -> str:
     else:
         return f'1/{int(1 / probability)}'
 
+def format_each(format: str, values: np.ndarray) -> list[str]:
+    '''
+    `np.char.mod(format, values)`と同じ文字列の一覧 (1次元の配列を要素ごとに`%`で整形する方が速い)
+    '''
+    return [format % value for value in values.tolist()]
+
+def get_percentage_strs(probabilities: np.ndarray) -> np.ndarray:
+    '''
+    `get_percentage_str`を配列全体に適用する
+    '''
+    percentages = np.asarray(probabilities, dtype = float) * 100
+    assert ((0 <= percentages) & (percentages <= 100)).all(), probabilities
+    strs = np.empty(percentages.shape, dtype = object)
+    general = (percentages <= 1e-6) | (1 <= percentages)
+    strs[general] = format_each('%.4g%%', percentages[general])
+    # 1%未満は有効数字3桁の固定小数点で、桁数ごとにまとめて整形する
+    small = percentages[~general]
+    digits = -np.floor(np.log10(small)).astype(int)
+    small_strs = np.empty(small.shape, dtype = object)
+    for digit in np.unique(digits):
+        selected = digits == digit
+        small_strs[selected] = format_each(f'%.{digit + 3}f%%', small[selected])
+    strs[~general] = small_strs
+    return strs
+
+def get_fraction_strs(probabilities: np.ndarray) -> np.ndarray:
+    '''
+    `get_fraction_str`を配列全体に適用する
+    '''
+    probabilities = np.asarray(probabilities, dtype = float)
+    assert ((0 <= probabilities) & (probabilities <= 1)).all(), probabilities
+    strs = np.full(probabilities.shape, '1/∞', dtype = object)
+    with np.errstate(divide = 'ignore'):
+        inverses = 1 / probabilities
+    general = (probabilities != 0) & (((1 <= inverses) & (inverses <= 1e4)) | (1e6 <= inverses))
+    integral = (probabilities != 0) & ~general
+    strs[general] = format_each('1/%.4g', inverses[general])
+    strs[integral] = format_each('1/%d', np.trunc(inverses[integral]))
+    return strs
+
 def get_prob_tuple(probability: float):
     assert 0 <= probability <= 1, probability
     return (get_percentage_str(probability), get_fraction_str(probability))
-        
+
+def get_num_count_rows() -> int:
+    '''
+    1つの件数を表す行数 (件数・百分率・分数、一部だけ探索したステージでは信頼区間も)
+    '''
+    return 4 if show_intervals.get() else 3
+
+def get_interval_strs(counts: np.ndarray, num_to_generate: int) -> np.ndarray:
+    '''
+    確率の95%信頼区間 (Wilsonの区間) の文字列
+    下限と上限が同じ文字列にならないよう、小数点以下は区間の幅の有効数字2桁まで表示する
+    '''
+    low, high = intervals.wilson(counts, num_to_generate)
+    low, high = np.asarray(low) * 100, np.asarray(high) * 100
+    with np.errstate(divide = 'ignore'):
+        digits = np.clip(1 - np.floor(np.log10(high - low)), 0, 12).astype(int)
+    low_strs = np.empty(low.shape, dtype = object)
+    high_strs = np.empty(high.shape, dtype = object)
+    for digit in np.unique(digits):
+        selected = digits == digit
+        low_strs[selected] = format_each(f'%.{digit}f%%', low[selected])
+        high_strs[selected] = format_each(f'%.{digit}f%%', high[selected])
+    return low_strs + '〜' + high_strs
+
 def get_count_prob_tuple(count: int, num_to_generate: int):
+    '''
+    合計のセル (件数は全て数えたものなので、信頼区間の行は空にする)
+    '''
     assert 0 <= count <= num_to_generate
-    return (count, get_percentage_str(count / num_to_generate), get_fraction_str(count / num_to_generate))
-    
-def calc_mitites_prob(num_eggs: int, mitites: int) -> float:
-    if num_eggs < mitites:
-        return 0.
-    else:
-        mprob = 1 / 20
-        return math.comb(num_eggs, mitites) * (mprob ** mitites) * ((1 - mprob) ** (num_eggs - mitites))
+    strs = (count, get_percentage_str(count / num_to_generate), get_fraction_str(count / num_to_generate))
+    return strs + ('',) * (get_num_count_rows() - 3)
 
-def load_cavegen_image(soup: BeautifulSoup, stage_name_full: str, seed: int) -> bs4.Tag:
-    img_src = '..' + flask.url_for('static', filename = f'images/CaveGen/{stage_name_full}/{seed:08X}.png')
-    img = soup.new_tag('img', src = img_src, width = 480, decoding = "async", alt = f'{stage_name_full} - 0x{seed:08X}')
-    return img
+def get_count_prob_array(counts: np.ndarray, num_to_generate: int) -> np.ndarray:
+    '''
+    件数の配列の各要素を(件数, 百分率, 分数 (, 信頼区間))にする (結果の形は`(get_num_count_rows(), *counts.shape)`)
+    '''
+    counts = np.asarray(counts)
+    assert ((0 <= counts) & (counts <= num_to_generate)).all()
+    probabilities = counts / num_to_generate
+    array = np.empty((get_num_count_rows(), *counts.shape), dtype = object)
+    array[0] = counts
+    array[1] = get_percentage_strs(probabilities)
+    array[2] = get_fraction_strs(probabilities)
+    if show_intervals.get():
+        array[3] = get_interval_strs(counts, num_to_generate)
+    return array
+
+# CaveGenの画像を表示する幅
+CAVEGEN_IMAGE_WIDTH = 480
+
+def load_cavegen_image(stage_name_full: str, seed: int) -> str:
+    '''
+    CaveGenの画像 (縮小版を`srcset`で選ばせ、遅延読み込みにする)
+    '''
+    static_prefix = relative_root.get() + flask.request.script_root + flask.current_app.static_url_path
+    source_name = f'images/CaveGen/{stage_name_full}/{seed:08X}.png'
+    attrs = {
+        'decoding': 'async',
+        'alt': f'{stage_name_full} - 0x{seed:08X}',
+        **image_variants.get_image_attrs(source_name, static_prefix, CAVEGEN_IMAGE_WIDTH),
+    }
+    webp_srcset = image_variants.get_webp_srcset(source_name, static_prefix)
+    if webp_srcset is None:
+        return html_builder.void_tag(0, 'img', **attrs)
+    source_attrs = {'srcset': webp_srcset, 'type': 'image/webp'}
+    if 'sizes' in attrs:
+        source_attrs['sizes'] = attrs['sizes']
+    return (
+        html_builder.start_tag(0, 'picture')
+        + html_builder.void_tag(1, 'source', **source_attrs)
+        + html_builder.void_tag(1, 'img', **attrs)
+        + html_builder.end_tag(0, 'picture')
+    )
 
-def generate(data_str: str):
-    data: dict[str, Any] = yaml.safe_load(data_str)
+def get_stage_name_full(stage_name: str) -> str:
+    '''
+    `CH8`のような1階だけのステージ名に`-1`を付ける (CaveGenの画像名)
+    '''
+    return stage_name if '-' in stage_name else (stage_name + '-1')
+
+def get_jp_stage_name(stage_name: str, stage: dict[str, Any]) -> str:
+    jp_stage_name = stage['name']
+    if '-' in stage_name:
+        sublevel: int = int(stage_name.split('-')[1])
+        jp_stage_name += f' (地下{sublevel}階)'
+    return jp_stage_name
+
+# ステージ名 -> 調査結果の表を組み立てる関数
+StageRenderer = Callable[[str, dict[str, Any], SurveyResult], list[str]]
+STAGE_RENDERERS: dict[str, StageRenderer] = {}
+
+def stage_renderer(*stage_names: str) -> Callable[[StageRenderer], StageRenderer]:
+    '''
+    ステージの表を組み立てる関数を登録するデコレータ
+    関数は深さ0で組み立てた断片のリストを返す (見出しとシードの範囲は`render_stage`で付ける)
+    '''
+    def register(renderer: StageRenderer) -> StageRenderer:
+        for stage_name in stage_names:
+            assert stage_name not in STAGE_RENDERERS, stage_name
+            STAGE_RENDERERS[stage_name] = renderer
+        return renderer
+    return register
+
+@stage_renderer('FC-4', 'BK-6', 'GK-5', 'SR-5')
+def render_murasakipom(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'ムラサキポンガシ出現率'))
+    table = create_true_false_table_from_result(result, 'murasakipom')
+    tables.append(table)
+    return tables
+
+@stage_renderer('FC-7', 'SC-4')
+def render_oogane(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'オオガネモチ出現率'))
+    table = create_true_false_table_from_result(result, 'oogane')
+    tables.append(table)
+    return tables
+
+@stage_renderer('SCx-4')
+def render_scx_4(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'シロポンガシ出現数'))
+    counts = result.counts('whitepom', range(4))
+    table = create_count_table(counts)
+    tables.append(table)
+    return tables
+
+@stage_renderer('SCx-7')
+def render_scx_7(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, '固定タマコキン出現率'))
+    table = create_true_false_table_from_result(result, 'fixedTamakokin')
+    tables.append(table)
+    return tables
+
+@stage_renderer('BK-4')
+def render_bk_4(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'ムラサキポンガシ出現数'))
+    counts = result.counts('murasakipom', range(3))
+    table = create_count_table(counts)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CoS-3')
+def render_cos_3(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'ポポガシグサ出現率'))
+    table = create_true_false_table_from_result(result, 'popogashi')
+    tables.append(table)
+    return tables
+
+@stage_renderer('CoS-4')
+def render_cos_4(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'お宝持ちシャコモドキ出現率'))
+    table = create_true_false_table_from_result(result, 'chocolate')
+    tables.append(table)
+    return tables
+
+@stage_renderer('GK-3')
+def render_gk_3(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'カスタネット出現率'))
+    table = create_true_false_table_from_result(result, 'castanets')
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'キイロポンガシ出現率'))
+    table = create_true_false_table_from_result(result, 'yellowpom')
+    tables.append(table)
+    return tables
+
+@stage_renderer('SR-6')
+def render_sr_6(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'オナラシ出現率'))
+    table = create_true_false_table_from_result(result, 'onarashi')
+    tables.append(table)
+    return tables
+
+@stage_renderer('SR-7')
+def render_sr_7(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    stage_name_full = get_stage_name_full(stage_name)
+
+    tables.append(html_builder.text(0, 'ケメクジ出現率'))
+    table = create_true_false_table_from_result(result, 'kemekuji')
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    no_kemekuji_seed: int = stage['seeds']['no_kemekuji']
+    tables.append(html_builder.text(0, f'ケメクジのいない地形 (シード値 = 0x{no_kemekuji_seed:08X})'))
+    tables.append(html_builder.void_tag(0, 'br'))
+    img = load_cavegen_image(stage_name_full, no_kemekuji_seed)
+    tables.append(img)
+    tables.append(html_builder.void_tag(0, 'br'))
+    return tables
+
+@stage_renderer('CH2-2')
+def render_ch2_2(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+
+    tables.append(html_builder.text(0, '地形とタマゴムシ'))
+    counts = result.table('room', 'mitites').reindex(
+        room = ['circle', 'circle_s', 'crescent'],
+        mitites = [1, 2],
+    )
+    table = create_count_table2d(
+        counts,
+        ylabels = ['丸部屋', '丸部屋 (S字)', '三日月'],
+        title = '地形＼タマゴムシ',
+    )
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率 (B1とB2の合計)'))
+    # B1はタマゴ2個で固定、B2はタマゴムシの数を直接数えている
+    b1_mitites_probs = mitites.mitites_from_eggs(mitites.fixed(2))
+    b2_mitites_probs = mitites.from_counts([0] + counts.marginalize('room').counts.tolist(), num_to_generate)
+    mitites_probs = mitites.convolve(b1_mitites_probs, b2_mitites_probs)
+    table = create_mitites_table(mitites_probs = mitites_probs)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH5-2')
+def render_ch5_2(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    max_eggs: int = result.table('eggs').max_label('eggs')
+    eggs = result.counts('eggs', range(max_eggs + 1))
+    table = create_count_table(eggs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率 (B1とB2の合計)'))
+    # B1はタマゴ8個で固定
+    b2_egg_probs = mitites.from_counts(result.counts('eggs', range(2)), num_to_generate)
+    mitites_probs = mitites.total_mitites(mitites.fixed(8), b2_egg_probs)
+    table = create_mitites_table(mitites_probs = mitites_probs)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH7-2')
+def render_ch7_2(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    max_eggs: int = result.table('eggs').max_label('eggs')
+    eggs = result.counts('eggs', range(max_eggs + 1))
+    table = create_count_table(eggs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率'))
+    egg_probs = (eggs / num_to_generate).tolist()
+    table = create_mitites_table(egg_probs = egg_probs)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH8')
+def render_ch8(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, 'コチャ出現数'))
+    max_kochas: int = result.table('kocha').max_label('kocha')
+    kochas = result.counts('kocha', range(max_kochas + 1))
+    table = create_count_table(kochas)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH15')
+def render_ch15(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, '間欠泉の位置'))
+    geysers = result.counts('geyser', ['front', 'back'])
+    table = create_count_table(geysers, labels = ['手前', '奥'])
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH18-1')
+def render_ch18_1(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+    stage_name_full = get_stage_name_full(stage_name)
+
+    tables.append(html_builder.text(0, 'ヤキチャッピー出現率'))
+    table = create_true_false_table_from_result(result, 'yakicha')
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    max_eggs: int = result.table('eggs').max_label('eggs')
+    eggs = result.counts('eggs', range(max_eggs + 1))
+    table = create_count_table(eggs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率'))
+    egg_probs = (eggs / num_to_generate).tolist()
+    table = create_mitites_table(egg_probs = egg_probs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    _8eggs_seed: int = stage['seeds']['8eggs']
+    tables.append(html_builder.text(0, f'タマゴ8個の地形 (シード値 = 0x{_8eggs_seed:08X})'))
+    tables.append(html_builder.void_tag(0, 'br'))
+    img = load_cavegen_image(stage_name_full, _8eggs_seed)
+    tables.append(img)
+    tables.append(html_builder.void_tag(0, 'br'))
+    return tables
+
+@stage_renderer('CH20-1')
+def render_ch20_1(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+    stage_name_full = get_stage_name_full(stage_name)
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    max_eggs: int = result.table('eggs').max_label('eggs')
+    eggs = result.counts('eggs', range(max_eggs + 1))
+    table = create_count_table(eggs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率'))
+    egg_probs = (eggs / num_to_generate).tolist()
+    table = create_mitites_table(egg_probs = egg_probs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    best_seed: int = stage['seeds']['best']
+    tables.append(html_builder.text(0, f'タマゴ5個の地形(一例) (シード値 = 0x{best_seed:08X})'))
+    tables.append(html_builder.void_tag(0, 'br'))
+    img = load_cavegen_image(stage_name_full, best_seed)
+    tables.append(img)
+    tables.append(html_builder.void_tag(0, 'br'))
+    return tables
+
+@stage_renderer('CH21-1')
+def render_ch21_1(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, '敵の数 (ウジンコ♂, ウジンコ♀, トビンコ)'))
+    # 出現した組み合わせだけを、敵の数の重み付きの和の順に並べる
+    counts = result.table('ujiosu', 'ujimesu', 'tobinko').flatten(
+        key = lambda label: label[0] * 87 + label[1] * 86 + label[2] * 62,
+    )
+    table = create_count_table(counts)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH21-2')
+def render_ch21_2(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+
+    tables.append(html_builder.text(0, '間欠泉の位置'))
+    geysers = result.counts('geyser', ['front', 'back'])
+    table = create_count_table(geysers, labels = ['手前', '奥'])
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH26-3')
+def render_ch26_3(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+    stage_name_full = get_stage_name_full(stage_name)
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    max_eggs: int = result.table('eggs').max_label('eggs')
+    eggs = result.counts('eggs', range(max_eggs + 1))
+    table = create_count_table(eggs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率'))
+    egg_probs = (eggs / num_to_generate).tolist()
+    table = create_mitites_table(egg_probs = egg_probs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    _10eggs_seed: int = stage['seeds']['10eggs']
+    tables.append(html_builder.text(0, f'タマゴ10個の地形 (シード値 = 0x{_10eggs_seed:08X})'))
+    tables.append(html_builder.void_tag(0, 'br'))
+    img = load_cavegen_image(stage_name_full, _10eggs_seed)
+    tables.append(img)
+    tables.append(html_builder.void_tag(0, 'br'))
+    return tables
+
+@stage_renderer('CH28')
+def render_ch28(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+
+    tables.append(html_builder.text(0, '間欠泉出現率'))
+    table = create_true_false_table_from_result(result, 'geyser')
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    counts = result.table('elec', 'eggs').reindex(elec = [True, False], eggs = range(6))
+    table = create_count_table2d(
+        counts,
+        ylabels = ['エレキショイグモあり', 'エレキショイグモなし'],
+        title = 'タマゴ',
+        ysum = False,
+    )
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率（キショイグモあり）'))
+    egg_probs = (counts.slice(elec = True).counts / num_to_generate).tolist()
+    table = create_mitites_table(egg_probs = egg_probs)
+    tables.append(table)
+    return tables
+
+@stage_renderer('CH29')
+def render_ch29(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    tables: list[str] = []
+    num_to_generate = result.num_to_generate
+    stage_name_full = get_stage_name_full(stage_name)
+
+    tables.append(html_builder.text(0, 'タマゴ出現数'))
+    max_eggs: int = result.table('eggs').max_label('eggs')
+    eggs = result.counts('eggs', range(max_eggs + 1))
+    table = create_count_table(eggs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    tables.append(html_builder.text(0, 'タマゴムシの確率'))
+    egg_probs = (eggs / num_to_generate).tolist()
+    table = create_mitites_table(egg_probs = egg_probs)
+    tables.append(table)
+
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    _7eggs_seed: int = stage['seeds']['7eggs']
+    tables.append(html_builder.text(0, f'タマゴ7個の地形 (シード値 = 0x{_7eggs_seed:08X})'))
+    tables.append(html_builder.void_tag(0, 'br'))
+    img = load_cavegen_image(stage_name_full, _7eggs_seed)
+    tables.append(img)
+    tables.append(html_builder.void_tag(0, 'br'))
+    return tables
+
+def render_generic(stage_name: str, stage: dict[str, Any], result: SurveyResult) -> list[str]:
+    '''
+    専用の関数がないステージの表 (軸の組ごとに、1軸は横に、2軸は縦横に、3軸以上は出現した組み合わせを横に並べる)
+    '''
+    tables: list[str] = []
+    for axis_set in sorted(result.tables, key = sorted):
+        table = result.table(*sorted(axis_set))
+        if len(tables) > 0:
+            tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+        tables.append(html_builder.text(0, ', '.join(table.axes)))
+        if len(table.axes) == 1 and set(table.labels[0]) <= {True, False}:
+            tables.append(create_true_false_table_from_counts(table.select(**{table.axes[0]: [True, False]})))
+        elif len(table.axes) == 2:
+            tables.append(create_count_table2d(table, title = '＼'.join(table.axes)))
+        else:
+            tables.append(create_count_table(table))
+    return tables
+
+def render_stage_uncached(stage_name: str, stage: dict[str, Any]) -> str:
+    renderer = STAGE_RENDERERS.get(stage_name, render_generic)
+
+    # divの子要素 (深さ0で組み立て、最後にインデントする)
+    tables: list[str] = []
+    tables.append(html_builder.void_tag(0, 'br'))
+
+    trial: dict[str, Any] = stage['trial']
+    seed: int = trial['seed']
+    num_to_generate: int = trial['num']
+    result = SurveyResult.from_trial(trial)
+    tables.append(html_builder.start_tag(0, 'b'))
+    tables.append(html_builder.text(1, get_jp_stage_name(stage_name, stage)))
+    tables.append(html_builder.end_tag(0, 'b'))
+    tables.append(html_builder.void_tag(0, 'br'))
+    tables.append(html_builder.empty_tag(0, 'span', style = 'margin-right: 1em'))
+    seed_text = f'seed = 0x{seed:08X}, ..., 0x{seed + num_to_generate - 1:08X}'
+    sampled = num_to_generate < SEED_SPACE
+    if not sampled:
+        seed_text += ' (全探索)'
+    elif SEED_SPACE % num_to_generate == 0 and SEED_SPACE // num_to_generate <= 16:
+        seed_text += f' (1/{SEED_SPACE // num_to_generate}探索)'
+    if sampled:
+        seed_text += ' ※確率の下の行は95%信頼区間'
+    tables.append(html_builder.text(0, seed_text))
+    tables.append(html_builder.empty_tag(0, 'p', style = 'margin:20px'))
+
+    token = show_intervals.set(sampled)
+    try:
+        tables += renderer(stage_name, stage, result)
+    finally:
+        show_intervals.reset(token)
+
+    tables.append(html_builder.void_tag(0, 'br'))
+    return (
+        html_builder.start_tag(0, 'div', id = f'tables-{stage_name}')
+        + html_builder.indent(''.join(tables), 1)
+        + html_builder.end_tag(0, 'div')
+    )
+
+# ステージごとの断片のキャッシュ (1ステージの結果が変わっても他のステージは作り直さない)
+STAGE_CACHE_SIZE = 64
+stage_cache: OrderedDict[tuple[str, str, str, str, tuple[int, ...]], str] = OrderedDict()
+stage_cache_lock = threading.Lock()
+
+def render_stage(stage_name: str, stage: dict[str, Any], root: str = '..') -> str:
+    '''
+    1ステージ分の`<div id="tables-...">` (`root`は出力するページからサイトのルートへの相対パス)
+    ステージのデータとURLの接頭辞 (と画像の縮小版) が同じ間はキャッシュした断片を返す
+    '''
+    key = (
+        stage_name, json.dumps(stage, sort_keys = True), root, flask.request.script_root,
+        image_variants.get_manifest_stamp(),
+    )
+    with stage_cache_lock:
+        fragment = stage_cache.get(key)
+        if fragment is not None:
+            stage_cache.move_to_end(key)
+    metrics.record_cache('stage', fragment is not None)
+    if fragment is not None:
+        return fragment
+    token = relative_root.set(root)
+    try:
+        fragment = render_stage_uncached(stage_name, stage)
+    finally:
+        relative_root.reset(token)
+    with stage_cache_lock:
+        stage_cache[key] = fragment
+        while len(stage_cache) > STAGE_CACHE_SIZE:
+            stage_cache.popitem(last = False)
+    return fragment
+
+def generate_stage(data: dict[str, Any], stage_name: str):
+    '''
+    1ステージ分だけ生成する (存在しないステージは`KeyError`)
+    `/pikmin2/cave-surveys/<ステージ名>.html`で返すので、画像のURLは2階層上からの相対パスにする
+    '''
+    return Markup(render_stage(stage_name, data[stage_name], '../..'))
+
+def generate(data: dict[str, Any]):
     stage_names = list(data.keys())
-    soup = BeautifulSoup()
+    html: list[str] = []
 
     # 目次作成
-    table_of_contents = soup.new_tag('ul', **{'class': 'table-of-contents'})
+    html.append(html_builder.start_tag(0, 'ul', **{'class': 'table-of-contents'}))
     for stage_name in stage_names:
-        jp_stage_name = data[stage_name]['name']
-        if '-' in stage_name:
-            sublevel: int = int(stage_name.split('-')[1])
-            jp_stage_name += f' (地下{sublevel}階)'
-        list_item = soup.new_tag('li')
-        anchor = soup.new_tag('a', href = f'#tables-{stage_name}')
-        anchor.string = jp_stage_name
-        list_item.append(anchor)
-        table_of_contents.append(list_item)
-    soup.append(table_of_contents)
-
-    for stage_index, stage_name in enumerate(stage_names):  
+        html.append(html_builder.start_tag(1, 'li'))
+        html.append(html_builder.start_tag(2, 'a', href = f'#tables-{stage_name}'))
+        html.append(html_builder.text(3, get_jp_stage_name(stage_name, data[stage_name])))
+        html.append(html_builder.end_tag(2, 'a'))
+        html.append(html_builder.end_tag(1, 'li'))
+    html.append(html_builder.end_tag(0, 'ul'))
+
+    for stage_index, stage_name in enumerate(stage_names):
         if stage_index != 0:
-            soup.append(soup.new_tag('hr'))
-        tables = soup.new_tag('div', id = f'tables-{stage_name}')
-        tables.append(soup.new_tag('br'))
-
-        trial: dict[str, Any] = data[stage_name]['trial']
-        seed: int = trial['seed']
-        num_to_generate: int = trial['num']
-        result: dict[str, Any] = trial['result']
-        stage_name_full = stage_name if '-' in stage_name else (stage_name + '-1')
-        bold = soup.new_tag('b')
-        jp_stage_name = data[stage_name]['name']
-        if '-' in stage_name:
-            sublevel: int = int(stage_name.split('-')[1])
-            jp_stage_name += f' (地下{sublevel}階)'
-        bold.string = jp_stage_name
-        tables.append(bold)
-        tables.append(soup.new_tag('br'))
-        tables.append(soup.new_tag('span', style = 'margin-right: 1em'))
-        seed_text = f'seed = 0x{seed:08X}, ..., 0x{seed + num_to_generate - 1:08X}'
-        if num_to_generate == 0x80000000:
-            seed_text += ' (全探索)'
-        elif 0x80000000 % num_to_generate == 0 and 0x80000000 // num_to_generate <= 16:
-            seed_text += f' (1/{0x80000000 // num_to_generate}探索)'
-        tables.append(seed_text)
-        tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-        if stage_name in ['FC-4', 'BK-6', 'GK-5', 'SR-5']:
-            tables.append('ムラサキポンガシ出現率')
-            table = create_true_false_table_from_result(soup, result, 'murasakipom')
-            tables.append(table)
-        elif stage_name in ['FC-7', 'SC-4']:
-            tables.append('オオガネモチ出現率')
-            table = create_true_false_table_from_result(soup, result, 'oogane')
-            tables.append(table)
-        elif stage_name == 'SCx-4':
-            tables.append('シロポンガシ出現数')
-            counts = [result.get(f'{{whitepom: {i}}}', 0) for i in range(4)]
-            table = create_count_table(soup, counts)
-            tables.append(table)
-        elif stage_name == 'SCx-7':
-            tables.append('固定タマコキン出現率')
-            table = create_true_false_table_from_result(soup, result, 'fixedTamakokin')
-            tables.append(table)
-        elif stage_name == 'BK-4':
-            tables.append('ムラサキポンガシ出現数')
-            counts = [result.get(f'{{murasakipom: {i}}}', 0) for i in range(3)]
-            table = create_count_table(soup, counts)
-            tables.append(table)
-        elif stage_name == 'CoS-3':
-            tables.append('ポポガシグサ出現率')
-            table = create_true_false_table_from_result(soup, result, 'popogashi')
-            tables.append(table)
-        elif stage_name == 'CoS-4':
-            tables.append('お宝持ちシャコモドキ出現率')
-            table = create_true_false_table_from_result(soup, result, 'chocolate')
-            tables.append(table)
-        elif stage_name == 'GK-3':
-            tables.append('カスタネット出現率')
-            table = create_true_false_table_from_result(soup, result, 'castanets')
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('キイロポンガシ出現率')
-            table = create_true_false_table_from_result(soup, result, 'yellowpom')
-            tables.append(table)
-        elif stage_name == 'SR-6':
-            tables.append('オナラシ出現率')
-            table = create_true_false_table_from_result(soup, result, 'onarashi')
-            tables.append(table)
-        elif stage_name == 'SR-7':
-            tables.append('ケメクジ出現率')
-            table = create_true_false_table_from_result(soup, result, 'kemekuji')
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            no_kemekuji_seed: int = data[stage_name]['seeds']['no_kemekuji']
-            tables.append(f'ケメクジのいない地形 (シード値 = 0x{no_kemekuji_seed:08X})')
-            tables.append(soup.new_tag('br'))
-            img = load_cavegen_image(soup, stage_name_full, no_kemekuji_seed)
-            tables.append(img)
-            tables.append(soup.new_tag('br'))
-        elif stage_name == 'CH2-2':
-            tables.append('地形とタマゴムシ')
-            counts = np.zeros((3, 2), dtype = np.int64)
-            for i, room in enumerate(['circle', 'circle_s', 'crescent']):
-                for j, mitites in enumerate([1, 2]):
-                    counts[i, j] = result[f'{{room: {room}, mitites: {mitites}}}']
-            table = create_count_table2d(
-                soup, 
-                counts, 
-                [1, 2], 
-                ['丸部屋', '丸部屋 (S字)', '三日月'], 
-                title = '地形＼タマゴムシ',
-            )
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-            
-            tables.append('タマゴムシの確率 (B1とB2の合計)')
-            b1_mitites_probs = [calc_mitites_prob(2, mitites) for mitites in range(3)]
-            b2_mitites_probs = [0] + [
-                sum(result[f'{{room: {room}, mitites: {mitites}}}'] 
-                    for room in ['circle', 'circle_s', 'crescent']) / num_to_generate 
-                    for mitites in [1, 2]]
-            mitites_probs = [0] * (len(b1_mitites_probs) + len(b2_mitites_probs) - 1)
-            for i in range(len(b1_mitites_probs)):
-                for j in range(len(b2_mitites_probs)):
-                    mitites_probs[i + j] += b1_mitites_probs[i] * b2_mitites_probs[j] 
-            table = create_mitites_table(soup, mitites_probs = mitites_probs)
-            tables.append(table)
-        elif stage_name == 'CH5-2':
-            tables.append('タマゴ出現数')
-            max_eggs: int = max(yaml.safe_load(k)['eggs'] for k in result.keys())
-            eggs = [result.get(f'{{eggs: {egg}}}', 0) for egg in range(max_eggs + 1)]
-            table = create_count_table(soup, eggs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率 (B1とB2の合計)')
-            b1_mitites_probs = [calc_mitites_prob(8, mitites) for mitites in range(9)]
-            b2_mitites_probs = [
-                sum(result.get(f'{{eggs: {eggs}}}', 0) / num_to_generate * calc_mitites_prob(eggs, mitites) 
-                for eggs in range(2)) for mitites in range(2)
-            ]
-            mitites_probs = [0] * (len(b1_mitites_probs) + len(b2_mitites_probs) - 1)
-            for i in range(len(b1_mitites_probs)):
-                for j in range(len(b2_mitites_probs)):
-                    mitites_probs[i + j] += b1_mitites_probs[i] * b2_mitites_probs[j]
-            table = create_mitites_table(soup, mitites_probs = mitites_probs)
-            tables.append(table)
-        elif stage_name == 'CH7-2':
-            tables.append('タマゴ出現数')
-            max_eggs: int = max(yaml.safe_load(k)['eggs'] for k in result.keys())
-            eggs = [result.get(f'{{eggs: {egg}}}', 0) for egg in range(max_eggs + 1)]
-            table = create_count_table(soup, eggs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率')
-            egg_probs = [result.get(f'{{eggs: {eggs}}}', 0) / num_to_generate for eggs in range(max_eggs + 1)]
-            table = create_mitites_table(soup, egg_probs = egg_probs)
-            tables.append(table)
-        elif stage_name == 'CH8':
-            tables.append('コチャ出現数')
-            max_kochas: int = max(yaml.safe_load(k)['kocha'] for k in result.keys())
-            kochas = [result.get(f'{{kocha: {kocha}}}', 0) for kocha in range(max_kochas + 1)]
-            table = create_count_table(soup, kochas)
-            tables.append(table)
-        elif stage_name == 'CH15':
-            tables.append('間欠泉の位置')
-            geysers = [result.get(f'{{geyser: {pos}}}', 0) for pos in ['front', 'back']]
-            table = create_count_table(soup, geysers, labels = ['手前', '奥'])
-            tables.append(table)
-        elif stage_name == 'CH18-1':
-            tables.append('ヤキチャッピー出現率')
-            table = create_true_false_table_from_result(soup, result, 'yakicha')
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴ出現数')
-            max_eggs: int = max(yaml.safe_load(k).get('eggs', -1) for k in result.keys())
-            eggs = [result.get(f'{{eggs: {egg}}}', 0) for egg in range(max_eggs + 1)]
-            table = create_count_table(soup, eggs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率')
-            egg_probs = [result.get(f'{{eggs: {eggs}}}', 0) / num_to_generate for eggs in range(max_eggs + 1)]
-            table = create_mitites_table(soup, egg_probs = egg_probs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            _8eggs_seed: int = data[stage_name]['seeds']['8eggs']
-            tables.append(f'タマゴ8個の地形 (シード値 = 0x{_8eggs_seed:08X})')
-            tables.append(soup.new_tag('br'))
-            img = load_cavegen_image(soup, stage_name_full, _8eggs_seed)
-            tables.append(img)
-            tables.append(soup.new_tag('br'))
-        elif stage_name == 'CH20-1':
-            tables.append('タマゴ出現数')
-            max_eggs: int = max(yaml.safe_load(k)['eggs'] for k in result.keys())
-            eggs = [result.get(f'{{eggs: {egg}}}', 0) for egg in range(max_eggs + 1)]
-            table = create_count_table(soup, eggs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率')
-            egg_probs = [result.get(f'{{eggs: {eggs}}}', 0) / num_to_generate for eggs in range(max_eggs + 1)]
-            table = create_mitites_table(soup, egg_probs = egg_probs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            best_seed: int = data[stage_name]['seeds']['best']
-            tables.append(f'タマゴ5個の地形(一例) (シード値 = 0x{best_seed:08X})')
-            tables.append(soup.new_tag('br'))
-            img = load_cavegen_image(soup, stage_name_full, best_seed)
-            tables.append(img)
-            tables.append(soup.new_tag('br'))
-        elif stage_name == 'CH21-1':
-            tables.append('敵の数 (ウジンコ♂, ウジンコ♀, トビンコ)')
-            counts = []
-            labels = []
-            for key, count in result.items():
-                enemy_dict: dict[str, int] = yaml.safe_load(key)
-                label = (enemy_dict['ujiosu'], enemy_dict['ujimesu'], enemy_dict['tobinko'])
-                labels.append(label)
-                counts.append(count)
-            labels, counts = zip(*sorted(
-                zip(labels, counts), 
-                key = lambda t: t[0][0] * 87 + t[0][1] * 86 + t[0][2] * 62
-            ))
-            labels = list(map(str, labels))
-            table = create_count_table(soup, counts, labels = labels)
-            tables.append(table)
-        elif stage_name == 'CH21-2':
-            tables.append('間欠泉の位置')
-            geysers = [result.get(f'{{geyser: {pos}}}', 0) for pos in ['front', 'back']]
-            table = create_count_table(soup, geysers, labels = ['手前', '奥'])
-            tables.append(table)
-        elif stage_name == 'CH26-3':
-            tables.append('タマゴ出現数')
-            max_eggs: int = max(yaml.safe_load(k)['eggs'] for k in result.keys())
-            eggs = [result.get(f'{{eggs: {egg}}}', 0) for egg in range(max_eggs + 1)]
-            table = create_count_table(soup, eggs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率')
-            egg_probs = [result.get(f'{{eggs: {eggs}}}', 0) / num_to_generate for eggs in range(max_eggs + 1)]
-            table = create_mitites_table(soup, egg_probs = egg_probs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            _10eggs_seed: int = data[stage_name]['seeds']['10eggs']
-            tables.append(f'タマゴ10個の地形 (シード値 = 0x{_10eggs_seed:08X})')
-            tables.append(soup.new_tag('br'))
-            img = load_cavegen_image(soup, stage_name_full, _10eggs_seed)
-            tables.append(img)
-            tables.append(soup.new_tag('br'))
-        elif stage_name == 'CH28':
-            tables.append('間欠泉出現率')
-            table = create_true_false_table_from_result(soup, result, 'geyser')
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴ出現数')
-            counts = np.zeros((2, 6), dtype = np.int64)
-            for i, elec in enumerate(['true', 'false']):
-                for j, eggs in enumerate(range(6)):
-                    counts[i, j] = result.get(f'{{eggs: {eggs}, elec: {elec}}}', 0)
-            table = create_count_table2d(
-                soup, 
-                counts, 
-                list(range(6)), 
-                ['エレキショイグモあり', 'エレキショイグモなし'], 
-                title = 'タマゴ',
-                ysum = False,
-            )
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率（キショイグモあり）')
-            egg_probs = [result.get(f'{{eggs: {eggs}, elec: true}}', 0) / num_to_generate for eggs in range(6)]
-            table = create_mitites_table(soup, egg_probs = egg_probs)
-            tables.append(table)
-        elif stage_name == 'CH29':
-            tables.append('タマゴ出現数')
-            max_eggs: int = max(yaml.safe_load(k)['eggs'] for k in result.keys())
-            eggs = [result.get(f'{{eggs: {egg}}}', 0) for egg in range(max_eggs + 1)]
-            table = create_count_table(soup, eggs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            tables.append('タマゴムシの確率')
-            egg_probs = [result.get(f'{{eggs: {eggs}}}', 0) / num_to_generate for eggs in range(max_eggs + 1)]
-            table = create_mitites_table(soup, egg_probs = egg_probs)
-            tables.append(table)
-
-            tables.append(soup.new_tag('p', style = 'margin:20px'))
-
-            _7eggs_seed: int = data[stage_name]['seeds']['7eggs']
-            tables.append(f'タマゴ7個の地形 (シード値 = 0x{_7eggs_seed:08X})')
-            tables.append(soup.new_tag('br'))
-            img = load_cavegen_image(soup, stage_name_full, _7eggs_seed)
-            tables.append(img)
-            tables.append(soup.new_tag('br'))
-        else:
-            raise NotImplementedError
-    
-        tables.append(soup.new_tag('br'))
-        soup.append(tables)
+            html.append(html_builder.void_tag(0, 'hr'))
+        html.append(render_stage(stage_name, data[stage_name]))
 
-    return Markup(soup.prettify())
\ No newline at end of file
+    return Markup(''.join(html))
@@ -1,40 +1,108 @@
-import yaml
 import flask
-from bs4 import BeautifulSoup
 from markupsafe import Markup
+from typing import Iterator
 
-def generate(data_str: str):
-    KEY_TO_COLUMNS = {
-        'imagePath': '画像',
-        'jpId': 'No. (日本版)', 
-        'usId': 'No. (米国版)',
-        'euId': 'No. (欧州版)',
-        'jpName': '名前(日本語)', 
-        'enName': '名前(英語)', 
-        'weight': '重さ', 
-        'maxCarriers': '最大運搬数', 
-        'value': '価値', 
-        'location': '場所', 
-        'sublevel': '階層',
-        'jpSeries': 'シリーズ(日本語)', 
-        'enSeries': 'シリーズ(英語)', 
-        'jpRealLifeItem': '見た目(日本語)',
-        'enRealLifeItem': '見た目(英語)',
+from scripts import html_builder, image_variants
+
+KEY_TO_COLUMNS = {
+    'imagePath': '画像',
+    'jpId': 'No. (日本版)',
+    'usId': 'No. (米国版)',
+    'euId': 'No. (欧州版)',
+    'jpName': '名前(日本語)',
+    'enName': '名前(英語)',
+    'weight': '重さ',
+    'maxCarriers': '最大運搬数',
+    'value': '価値',
+    'location': '場所',
+    'sublevel': '階層',
+    'jpSeries': 'シリーズ(日本語)',
+    'enSeries': 'シリーズ(英語)',
+    'jpRealLifeItem': '見た目(日本語)',
+    'enRealLifeItem': '見た目(英語)',
+}
+
+TABLE_ATTRS = {
+    'id': 'treasure-table',
+    'border': '1',
+    'style': 'border-collapse:collapse;text-align:center;font-size:10px',
+}
+CELL_ATTRS = {'style': 'padding:3'}
+
+def get_image_attrs(image_path: str, static_prefix: str) -> tuple[dict[str, str | int], str | None]:
+    '''
+    お宝の画像の(`img`の属性, WebPの`srcset`) (縮小版は`scripts/image_variants.py`で作る)
+    '''
+    source_name = f'images/treasures/{image_path}'
+    attrs = {
+        'decoding': 'async',
+        'alt': image_path,
+        'title': image_path,
+        **image_variants.get_image_attrs(source_name, static_prefix),
     }
-    data: list[dict[str, int | str]] = yaml.safe_load(data_str)
+    return attrs, image_variants.get_webp_srcset(source_name, static_prefix)
+
+def stream(data: list[dict[str, int | str]]) -> Iterator[str]:
+    '''
+    お宝の表を1行ずつ出力する
+    `render_with_soup`と同じマークアップをDOMを作らずに1パスで書き出す
+    '''
+    # 行ごとにurl_forを呼ばず、static_url_path以下のファイル名をwerkzeugと同じ規則でクオートする
+    # (url_forにディレクトリを渡すとFrozen-Flaskがそれを1ページとして書き出そうとする)
+    static_prefix = '..' + flask.request.script_root + flask.current_app.static_url_path
+
+    yield html_builder.start_tag(0, 'table', **TABLE_ATTRS)
+    yield html_builder.start_tag(1, 'thead')
+    yield html_builder.start_tag(2, 'tr')
+    th_start = html_builder.start_tag(3, 'th', **CELL_ATTRS)
+    th_end = html_builder.end_tag(3, 'th')
+    for column in KEY_TO_COLUMNS.values():
+        yield th_start + html_builder.text(4, column) + th_end
+    yield html_builder.end_tag(2, 'tr')
+    yield html_builder.end_tag(1, 'thead')
+
+    yield html_builder.start_tag(1, 'tbody')
+    tr_start = html_builder.start_tag(2, 'tr')
+    tr_end = html_builder.end_tag(2, 'tr')
+    td_start = html_builder.start_tag(3, 'td', **CELL_ATTRS)
+    td_end = html_builder.end_tag(3, 'td')
+    for treasure in data:
+        row = [tr_start]
+        for key in KEY_TO_COLUMNS.keys():
+            row.append(td_start)
+            if key == 'imagePath':
+                attrs, webp_srcset = get_image_attrs(str(treasure[key]), static_prefix)
+                if webp_srcset is None:
+                    row.append(html_builder.void_tag(4, 'img', **attrs))
+                else:
+                    row.append(html_builder.start_tag(4, 'picture'))
+                    row.append(html_builder.void_tag(5, 'source', srcset = webp_srcset, type = 'image/webp'))
+                    row.append(html_builder.void_tag(5, 'img', **attrs))
+                    row.append(html_builder.end_tag(4, 'picture'))
+            else:
+                row.append(html_builder.text(4, treasure.get(key, '---')))
+            row.append(td_end)
+        row.append(tr_end)
+        yield ''.join(row)
+    yield html_builder.end_tag(1, 'tbody')
+    yield html_builder.end_tag(0, 'table')
+
+def generate(data: list[dict[str, int | str]]):
+    return Markup(''.join(stream(data)))
 
+def render_with_soup(data: list[dict[str, int | str]]):
+    '''
+    BeautifulSoupによる旧実装 (`stream`との比較・ベンチマーク用、bs4は使うときだけimportする)
+    '''
+    from bs4 import BeautifulSoup
+    static_prefix = '..' + flask.request.script_root + flask.current_app.static_url_path
     soup = BeautifulSoup()
-    table = soup.new_tag(
-        'table', 
-        id = 'treasure-table', 
-        border = "1", 
-        style = "border-collapse:collapse;text-align:center;font-size:10px",
-    )
+    table = soup.new_tag('table', **TABLE_ATTRS)
 
     thead = soup.new_tag('thead')
     tr = soup.new_tag('tr')
     for column in KEY_TO_COLUMNS.values():
-        th = soup.new_tag('th', style = "padding:3")
+        th = soup.new_tag('th', **CELL_ATTRS)
         th.append(column)
         tr.append(th)
     thead.append(tr)
@@ -44,17 +112,17 @@ def generate(data_str: str):
     for treasure in data:
         tr = soup.new_tag('tr')
         for key in KEY_TO_COLUMNS.keys():
-            td = soup.new_tag('td', style = "padding:3")
+            td = soup.new_tag('td', **CELL_ATTRS)
             if key == 'imagePath':
-                image_path = treasure[key]
-                img = soup.new_tag(
-                    'img',
-                    decoding = "async",
-                    src = '..' + flask.url_for('static', filename = f'images/treasures/{image_path}'),
-                    alt = image_path,
-                    title = image_path,
-                )
-                td.append(img) 
+                attrs, webp_srcset = get_image_attrs(str(treasure[key]), static_prefix)
+                img = soup.new_tag('img', **{name: str(value) for name, value in attrs.items()})
+                if webp_srcset is None:
+                    td.append(img)
+                else:
+                    picture = soup.new_tag('picture')
+                    picture.append(soup.new_tag('source', srcset = webp_srcset, type = 'image/webp'))
+                    picture.append(img)
+                    td.append(picture)
             else:
                 if key in treasure:
                     value = treasure[key]
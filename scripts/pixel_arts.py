@@ -1,35 +1,260 @@
-from bs4 import BeautifulSoup
-from markupsafe import Markup
+'''
+ドット絵集
+
+`static/images/pixel-arts`の画像の大きさをPNGのヘッダーから読んでマニフェストにまとめ、
+画像を数枚のスプライトアトラスに詰める (ページの読み込みは数リクエストで済む)
+別の画像の整数倍の拡大版は`tools/dedupe_pixel_arts.py`で削除し、CSSで拡大して表示する
+リクエスト時はマニフェストだけを読み、ディレクトリは見ない (マニフェストがなければページはエラーにする)
+
+使い方: python -m scripts.pixel_arts [--force]
+'''
 import flask
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import numpy as np
+from markupsafe import Markup
 from pathlib import Path
+from typing import Any
+
+from scripts import html_builder, png
+from scripts.file_hashes import get_stamp
+
+ROOT = Path(__file__).parent.parent
+IMAGE_DIR = ROOT / 'static/images/pixel-arts'
+ATLAS_DIR = ROOT / 'static/images/pixel-arts-atlas'
+MANIFEST_PATH = ROOT / 'build/pixel-arts.json'
+# マニフェストの形式やアトラスの詰め方を変えたら上げる
+MANIFEST_VERSION = 1
+
+ATLAS_WIDTH = 1024
+ATLAS_MAX_HEIGHT = 1024
+# 隣の画像がにじまないように空ける隙間
+ATLAS_PADDING = 1
+
+# `Name_WxH.png`
+SIZE_PATTERN = re.compile(r'^(.*)_(\d+)x(\d+)$')
+
+def get_name(stem: str) -> str:
+    match = SIZE_PATTERN.match(stem)
+    return match.group(1) if match is not None else stem
+
+def get_image_paths() -> list[Path]:
+    return sorted(p for p in IMAGE_DIR.iterdir() if p.is_file() and p.suffix.lower() == '.png')
+
+def read_images(previous: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    '''
+    画像ごとの大きさ (更新日時とサイズが前回と同じならヘッダーも読まない)
+    '''
+    images: dict[str, dict[str, Any]] = {}
+    for path in get_image_paths():
+        stamp = get_stamp(path)
+        old = previous.get(path.name)
+        if old is not None and old['stamp'] == stamp:
+            images[path.name] = {key: old[key] for key in ['stamp', 'name', 'width', 'height']}
+            continue
+        try:
+            width, height = png.read_size(path)
+        except ValueError as e:
+            print(f'skipped: {e}', file = sys.stderr)
+            continue
+        images[path.name] = {'stamp': stamp, 'name': get_name(path.stem), 'width': width, 'height': height}
+    return images
+
+def pack(images: dict[str, dict[str, Any]]) -> list[tuple[str, int, int, int]]:
+    '''
+    高さの順に棚に並べる詰め方で(ファイル名, アトラスの番号, x, y)を決める
+    '''
+    placements = []
+    atlas, x, y, shelf_height = 0, 0, 0, 0
+    for filename in sorted(images, key = lambda f: (-images[f]['height'], -images[f]['width'], f)):
+        width, height = images[filename]['width'], images[filename]['height']
+        if width > ATLAS_WIDTH or height > ATLAS_MAX_HEIGHT:
+            continue
+        if x + width > ATLAS_WIDTH:
+            x, y, shelf_height = 0, y + shelf_height + ATLAS_PADDING, 0
+        if y + height > ATLAS_MAX_HEIGHT:
+            atlas, x, y, shelf_height = atlas + 1, 0, 0, 0
+        placements.append((filename, atlas, x, y))
+        x += width + ATLAS_PADDING
+        shelf_height = max(shelf_height, height)
+    return placements
 
-def generate(image_dir_path: Path):
-    soup = BeautifulSoup()
-    image_paths = sorted([p for p in image_dir_path.iterdir() if p.is_file()])
-    for image_path in image_paths:
-        name, size_str = image_path.stem.split('_')
-        width = int(size_str.split('x')[0])
-        height = int(size_str.split('x')[1])
-        img_src = '..' + flask.url_for('static', filename = f'images/pixel-arts/{image_path.stem}.png')
-        a_tag = soup.new_tag(
-            'a', 
-            href = img_src, 
-            style = 'text-decoration: none;',
-            target = '_blank',
+def build_atlases(images: dict[str, dict[str, Any]]) -> list[dict[str, Any]]:
+    '''
+    アトラスを書き出し、各画像にアトラスでの位置を書き込む
+    デコードできない形式の画像はアトラスに入れず、個別の画像のまま表示する
+    '''
+    pixels: dict[str, np.ndarray] = {}
+    for filename in images:
+        images[filename]['atlas'] = None
+        try:
+            pixels[filename] = png.decode(IMAGE_DIR / filename)
+        except ValueError as e:
+            print(f'not packed: {e}', file = sys.stderr)
+
+    placements = pack({filename: images[filename] for filename in pixels})
+    num_atlases = max((atlas for _, atlas, _, _ in placements), default = -1) + 1
+    canvases = []
+    for index in range(num_atlases):
+        height = max(
+            y + images[filename]['height']
+            for filename, atlas, _, y in placements if atlas == index
         )
-        image_tag = soup.new_tag(
-            'img',
-            src = img_src, 
+        canvases.append(np.zeros((height, ATLAS_WIDTH, 4), dtype = np.uint8))
+    for filename, atlas, x, y in placements:
+        image = pixels[filename]
+        canvases[atlas][y:y + image.shape[0], x:x + image.shape[1]] = image
+        images[filename].update(atlas = atlas, x = x, y = y)
+
+    ATLAS_DIR.mkdir(parents = True, exist_ok = True)
+    atlases = []
+    for canvas in canvases:
+        data = png.encode(canvas)
+        # 内容のハッシュをファイル名にして、ブラウザのキャッシュに古いアトラスが残らないようにする
+        filename = f'{hashlib.sha256(data).hexdigest()[:16]}.png'
+        path = ATLAS_DIR / filename
+        if not path.exists():
+            path.write_bytes(data)
+        atlases.append({'file': filename, 'width': canvas.shape[1], 'height': canvas.shape[0]})
+    for path in ATLAS_DIR.iterdir():
+        if path.name not in {atlas['file'] for atlas in atlases}:
+            path.unlink()
+    return atlases
+
+def is_fresh(manifest: dict[str, Any]) -> bool:
+    if manifest.get('version') != MANIFEST_VERSION:
+        return False
+    paths = get_image_paths()
+    if sorted(manifest['sources']) != [path.name for path in paths]:
+        return False
+    return all(manifest['sources'][path.name] == get_stamp(path) for path in paths) \
+        and all((ATLAS_DIR / atlas['file']).exists() for atlas in manifest['atlases'])
+
+def read_manifest() -> dict[str, Any] | None:
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding = 'utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def build(force: bool = False) -> dict[str, Any]:
+    '''
+    画像が変わっていればマニフェストとアトラスを作り直し、マニフェストを返す
+    '''
+    manifest = None if force else read_manifest()
+    if manifest is not None and is_fresh(manifest):
+        return manifest
+    previous = {} if manifest is None or manifest.get('version') != MANIFEST_VERSION else manifest['images']
+    images = read_images(previous)
+    atlases = build_atlases(images)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        # 読めなかったファイルも含め、ディレクトリの中身の記録
+        'sources': {path.name: get_stamp(path) for path in get_image_paths()},
+        'images': images,
+        'atlases': atlases,
+    }
+    MANIFEST_PATH.parent.mkdir(parents = True, exist_ok = True)
+    temp_path = MANIFEST_PATH.with_suffix(f'.{os.getpid()}.tmp')
+    temp_path.write_text(json.dumps(manifest, indent = 1), encoding = 'utf-8')
+    temp_path.replace(MANIFEST_PATH)
+    return manifest
+
+_manifest: dict[str, Any] | None = None
+_manifest_stamp: list[int] | None = None
+_manifest_lock = threading.Lock()
+
+def load() -> dict[str, Any]:
+    '''
+    マニフェストを読む (ファイルが書き換えられたときだけ読み直す)
+    リクエストの処理中には画像のディレクトリを見ないので、なければ作らずに`FileNotFoundError`
+    (マニフェストとアトラスはfreeze.pyか`python -m scripts.pixel_arts`で作る)
+    '''
+    global _manifest, _manifest_stamp
+    with _manifest_lock:
+        try:
+            stamp = get_stamp(MANIFEST_PATH)
+        except FileNotFoundError:
+            stamp = None
+        if _manifest is None or stamp != _manifest_stamp:
+            manifest = read_manifest() if stamp is not None else None
+            if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+                raise FileNotFoundError(
+                    f'{MANIFEST_PATH} is missing or outdated; run freeze.py or python -m scripts.pixel_arts')
+            _manifest, _manifest_stamp = manifest, stamp
+        return _manifest
+
+def get_sprite_html(image: dict[str, Any], atlas: dict[str, Any] | None, img_src: str, scale: int = 1) -> str:
+    '''
+    画像1つ分 (アトラスにあればその一部を背景として表示し、`scale`倍に拡大する)
+    '''
+    width, height = image['width'] * scale, image['height'] * scale
+    if atlas is None:
+        attrs: dict[str, Any] = {}
+        if scale != 1:
+            attrs['style'] = 'image-rendering:pixelated'
+        return html_builder.void_tag(
+            1, 'img',
+            src = img_src,
             width = width,
             height = height,
-            alt = name,
+            alt = image['name'],
             decoding = 'async',
+            **attrs,
         )
-        a_tag.append(image_tag)
-        soup.append(a_tag)
+    style = f'width:{width}px;height:{height}px;background-position:-{image["x"] * scale}px -{image["y"] * scale}px'
+    if scale != 1:
+        style += f';background-size:{atlas["width"] * scale}px {atlas["height"] * scale}px'
+    return html_builder.empty_tag(
+        1, 'span',
+        **{
+            'class': f'pixel-art pixel-art-atlas-{image["atlas"]}',
+            'role': 'img',
+            'aria-label': image['name'],
+            'style': style,
+        },
+    )
+
+def generate(manifest: dict[str, Any], scaled: dict[str, dict[str, Any]] | None = None):
+    '''
+    `scaled`は削除した拡大版の画像 -> 元の画像と倍率 (`data/pixel-arts-scaled.yaml`)
+    '''
+    scaled = scaled or {}
+    static_prefix = '..' + flask.request.script_root + flask.current_app.static_url_path
+    html: list[str] = []
+
+    html.append(html_builder.start_tag(0, 'style'))
+    html.append(html_builder.text(1, '.pixel-art {display:inline-block;background-repeat:no-repeat;image-rendering:pixelated}'))
+    for index, atlas in enumerate(manifest['atlases']):
+        url = f'{static_prefix}/images/pixel-arts-atlas/{atlas["file"]}'
+        html.append(html_builder.text(1, f'.pixel-art-atlas-{index} {{background-image:url({url})}}'))
+    html.append(html_builder.end_tag(0, 'style'))
+
+    # (表示するファイル名, 実際のファイル名, 倍率)
+    entries = [(filename, filename, 1) for filename in manifest['images']]
+    for filename, entry in scaled.items():
+        if entry['source'] not in manifest['images']:
+            raise KeyError(f'{filename}: source {entry["source"]} does not exist')
+        entries.append((filename, entry['source'], entry['scale']))
+
+    for filename, source, scale in sorted(entries):
+        image = dict(manifest['images'][source], name = get_name(Path(filename).stem))
+        atlas = None if image['atlas'] is None else manifest['atlases'][image['atlas']]
+        # 拡大版は元の画像にリンクする
+        img_src = f'{static_prefix}/images/pixel-arts/{source}'
+        html.append(html_builder.start_tag(0, 'a', href = img_src, style = 'text-decoration: none;', target = '_blank'))
+        html.append(get_sprite_html(image, atlas, img_src, scale))
+        html.append(html_builder.end_tag(0, 'a'))
 
-    return Markup(soup.prettify())
+    return Markup(''.join(html))
 
 if __name__ == '__main__':
-    markup = generate(Path(__file__).parent / 'static/images/pixel-arts')
-    print(markup)
\ No newline at end of file
+    manifest = build(force = '--force' in sys.argv[1:])
+    num_packed = sum(image['atlas'] is not None for image in manifest['images'].values())
+    print(f'{len(manifest["images"])} images, {num_packed} packed into {len(manifest["atlases"])} atlases')
+    for atlas in manifest['atlases']:
+        print(f'  {atlas["file"]}: {atlas["width"]}x{atlas["height"]}')
+    print(f'-> {MANIFEST_PATH}')
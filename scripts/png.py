@@ -0,0 +1,203 @@
+'''
+PILを使わないPNGの読み書き
+
+対応するのはビット深度8・インターレースなしの画像だけ (ドット絵・お宝・CaveGenの画像はすべてこの形式)
+'''
+import struct
+import zlib
+import numpy as np
+from pathlib import Path
+from typing import Iterator
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# カラータイプ -> 1ピクセルのチャンネル数
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+def iter_chunks(data: bytes) -> Iterator[tuple[bytes, bytes]]:
+    '''
+    (チャンクの種類, 中身)
+    '''
+    if not data.startswith(SIGNATURE):
+        raise ValueError('not a PNG file')
+    position = len(SIGNATURE)
+    while position < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        yield chunk_type, data[position + 8:position + 8 + length]
+        if chunk_type == b'IEND':
+            return
+        position += 12 + length
+    raise ValueError('IEND chunk is missing')
+
+def parse_header(header: bytes) -> tuple[int, int, int, int, int]:
+    '''
+    IHDRの(幅, 高さ, ビット深度, カラータイプ, インターレース)
+    '''
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header)
+    return width, height, bit_depth, color_type, interlace
+
+def read_size(path: Path) -> tuple[int, int]:
+    '''
+    IHDRだけ読んで(幅, 高さ)を返す
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(len(SIGNATURE) + 8 + 13)
+    if not head.startswith(SIGNATURE) or head[12:16] != b'IHDR' or len(head) < 29:
+        raise ValueError(f'{path.name}: not a PNG file')
+    width, height, *_ = parse_header(head[16:29])
+    return width, height
+
+def unfilter(raw: bytes, width: int, height: int, bpp: int) -> np.ndarray:
+    '''
+    各行のフィルタを戻して(高さ, 幅 * bpp)の配列にする
+    '''
+    stride = width * bpp
+    rows = np.frombuffer(raw, dtype = np.uint8).reshape(height, stride + 1)
+    image = np.zeros((height, stride), dtype = np.uint8)
+    previous = np.zeros(stride, dtype = np.uint8)
+    for y in range(height):
+        filter_type = rows[y, 0]
+        line = rows[y, 1:]
+        if filter_type == 0:
+            current = line.copy()
+        elif filter_type == 1:
+            # Sub: 左のピクセルとの差分なので、チャンネルごとの累積和
+            current = (np.cumsum(line.reshape(width, bpp), axis = 0, dtype = np.uint64) % 256) \
+                .astype(np.uint8).reshape(stride)
+        elif filter_type == 2:
+            current = line + previous
+        elif filter_type in (3, 4):
+            current = np.zeros(stride, dtype = np.uint8)
+            line_list = line.tolist()
+            up_list = previous.tolist()
+            out = [0] * stride
+            for x in range(stride):
+                left = out[x - bpp] if x >= bpp else 0
+                up = up_list[x]
+                if filter_type == 3:
+                    predictor = (left + up) // 2
+                else:
+                    upper_left = up_list[x - bpp] if x >= bpp else 0
+                    p = left + up - upper_left
+                    pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+                    if pa <= pb and pa <= pc:
+                        predictor = left
+                    elif pb <= pc:
+                        predictor = up
+                    else:
+                        predictor = upper_left
+                out[x] = (line_list[x] + predictor) & 0xff
+            current[:] = out
+        else:
+            raise ValueError(f'unknown filter type {filter_type}')
+        image[y] = current
+        previous = current
+    return image
+
+def decode(path: Path) -> np.ndarray:
+    '''
+    PNGを(高さ, 幅, 4)のRGBAの配列として読み込む
+    '''
+    header = None
+    palette = None
+    transparency = None
+    idat: list[bytes] = []
+    for chunk_type, body in iter_chunks(path.read_bytes()):
+        if chunk_type == b'IHDR':
+            header = parse_header(body)
+        elif chunk_type == b'PLTE':
+            palette = np.frombuffer(body, dtype = np.uint8).reshape(-1, 3)
+        elif chunk_type == b'tRNS':
+            transparency = body
+        elif chunk_type == b'IDAT':
+            idat.append(body)
+    if header is None:
+        raise ValueError(f'{path.name}: IHDR chunk is missing')
+    width, height, bit_depth, color_type, interlace = header
+    if bit_depth != 8 or interlace != 0 or color_type not in CHANNELS:
+        raise ValueError(f'{path.name}: unsupported format (bit depth {bit_depth}, color type {color_type}, interlace {interlace})')
+
+    channels = CHANNELS[color_type]
+    pixels = unfilter(zlib.decompress(b''.join(idat)), width, height, channels).reshape(height, width, channels)
+    rgba = np.full((height, width, 4), 255, dtype = np.uint8)
+    if color_type == 0:
+        rgba[..., :3] = pixels
+    elif color_type == 2:
+        rgba[..., :3] = pixels
+    elif color_type == 3:
+        if palette is None:
+            raise ValueError(f'{path.name}: PLTE chunk is missing')
+        rgba[..., :3] = palette[pixels[..., 0]]
+        if transparency is not None:
+            alpha = np.full(len(palette), 255, dtype = np.uint8)
+            alpha[:len(transparency)] = np.frombuffer(transparency, dtype = np.uint8)[:len(palette)]
+            rgba[..., 3] = alpha[pixels[..., 0]]
+    elif color_type == 4:
+        rgba[..., :3] = pixels[..., :1]
+        rgba[..., 3] = pixels[..., 1]
+    else:
+        rgba[...] = pixels
+    return rgba
+
+def make_chunk(chunk_type: bytes, body: bytes) -> bytes:
+    return struct.pack('>I', len(body)) + chunk_type + body \
+        + struct.pack('>I', zlib.crc32(chunk_type + body) & 0xffffffff)
+
+def filter_rows(pixels: np.ndarray, bpp: int) -> np.ndarray:
+    '''
+    行ごとに5種類のフィルタを試し、差分の絶対値の和が最小のものを選ぶ (先頭にフィルタの種類を付けた行の配列)
+    '''
+    height, stride = pixels.shape
+    x = pixels.astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, bpp:] = x[:, :-bpp]
+    b = np.zeros_like(x)
+    b[1:] = x[:-1]
+    c = np.zeros_like(x)
+    c[1:, bpp:] = x[:-1, :-bpp]
+    p = a + b - c
+    pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    candidates = np.stack([x, x - a, x - b, x - (a + b) // 2, x - paeth]).astype(np.uint8)
+    # 差分を符号付きとみなしたときの絶対値の和 (PNGの仕様で推奨されている方法)
+    scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis = 2)
+    best = scores.argmin(axis = 0)
+    rows = np.empty((height, stride + 1), dtype = np.uint8)
+    rows[:, 0] = best
+    rows[:, 1:] = candidates[best, np.arange(height)]
+    return rows
+
+def encode(rgba: np.ndarray, *, optimize: bool = False) -> bytes:
+    '''
+    (高さ, 幅, 4)のRGBAの配列をPNGにする
+    `optimize`なら色数が256以下のときパレット、不透明ならRGBにし、行ごとにフィルタを選ぶ (いずれも可逆)
+    '''
+    height, width, _ = rgba.shape
+    chunks = []
+    if not optimize:
+        rows = np.zeros((height, width * 4 + 1), dtype = np.uint8)
+        rows[:, 1:] = rgba.reshape(height, width * 4)
+        header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    else:
+        colors, indices = np.unique(
+            np.ascontiguousarray(rgba).view(np.uint32).reshape(-1), return_inverse = True)
+        if len(colors) <= 256:
+            palette = colors.view(np.uint8).reshape(-1, 4)
+            # 透明度のある色を先に並べ、tRNSを短くする
+            order = np.argsort(palette[:, 3] == 255, kind = 'stable')
+            palette = palette[order]
+            indices = np.argsort(order)[indices].astype(np.uint8).reshape(height, width)
+            header = struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)
+            chunks.append(make_chunk(b'PLTE', palette[:, :3].tobytes()))
+            num_transparent = int((palette[:, 3] != 255).sum())
+            if num_transparent > 0:
+                chunks.append(make_chunk(b'tRNS', palette[:num_transparent, 3].tobytes()))
+            rows = filter_rows(indices, 1)
+        elif (rgba[..., 3] == 255).all():
+            header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+            rows = filter_rows(np.ascontiguousarray(rgba[..., :3]).reshape(height, width * 3), 3)
+        else:
+            header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+            rows = filter_rows(np.ascontiguousarray(rgba).reshape(height, width * 4), 4)
+    return SIGNATURE + make_chunk(b'IHDR', header) + b''.join(chunks) \
+        + make_chunk(b'IDAT', zlib.compress(rows.tobytes(), 9)) + make_chunk(b'IEND', b'')
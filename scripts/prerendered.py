@@ -0,0 +1,265 @@
+'''
+事前に描画したページをメモリから返すWSGIアプリ
+
+freeze.pyが書き出したディレクトリ (既定は`docs/`) を読み込むか、起動時に`server`で全ページ・APIの静的なJSON・
+静的ファイルを1度だけ描画して、URL -> (本文, 圧縮版, ヘッダー) の変更されない辞書にする
+リクエストごとの処理は辞書の参照と書き込みだけで、テンプレートや生成モジュールは実行しない
+(クエリ文字列で結果が変わる`/api/pikmin2/treasures`・`/search`は対象外で、静的に書き出した索引とシャードだけを返す)
+
+使い方:
+    python -m scripts.prerendered                 # docs/を読み込んで http://127.0.0.1:5000/ で返す
+    python -m scripts.prerendered --render        # 起動時に全ページを描画してから返す
+    python -m scripts.prerendered --docs DIR --host 0.0.0.0 --port 8000
+'''
+import argparse
+import functools
+import hashlib
+import mimetypes
+import os
+import time
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Iterable, Mapping
+
+from scripts import compression, snapshot
+
+ROOT = Path(__file__).parent.parent
+DOCS_DIR = ROOT / 'docs'
+# freeze.pyが書き出す、存在しないURLに返すページ
+NOT_FOUND_FILE = '404.html'
+# どのルートにも一致しないURL (`server`の404のハンドラーが描画する)
+NOT_FOUND_URL = '/404-not-found.html'
+
+class Entry:
+    '''
+    1つのURLの応答 (Content-Encoding (なしは`None`) -> (本文, ヘッダー, ETag))
+    '''
+    __slots__ = ('variants',)
+
+    def __init__(self, variants: dict[str | None, tuple[bytes, list[tuple[str, str]], str]]):
+        self.variants = variants
+
+def get_content_type(path: str) -> str:
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if mimetype.startswith('text/'):
+        return f'{mimetype}; charset=utf-8'
+    return mimetype
+
+def get_cache_control(url: str) -> str:
+    '''
+    `server.get_cache_control`と同じ値 (カテゴリのページとAPIはカテゴリの`cache_control`)
+    '''
+    config = snapshot.get_config()
+    default = config['site'].get('cache_control', 'no-cache')
+    parts = url.strip('/').split('/')
+    category = parts[1] if parts[0] == 'api' and len(parts) > 1 else parts[0]
+    return config['document_info'].get(category, {}).get('cache_control', default)
+
+def make_entry(url: str, body: bytes, compressed: dict[str, bytes] | None = None) -> Entry:
+    '''
+    ヘッダーを計算済みの応答を作る
+    `compressed`にない圧縮版は、圧縮するファイルでMIN_SIZE以上なら作る
+    '''
+    content_type = get_content_type(url if not url.endswith('/') else url + 'index.html')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    headers = [('Content-Type', content_type), ('Cache-Control', get_cache_control(url))]
+    compressible = content_type.split(';')[0] in compression.COMPRESSIBLE_MIMETYPES
+    if compressible:
+        headers.append(('Vary', 'Accept-Encoding'))
+    variants: dict[str | None, tuple[bytes, list[tuple[str, str]], str]] = {
+        None: (body, headers + [('ETag', f'"{etag}"'), ('Content-Length', str(len(body)))], etag),
+    }
+    if compressible and len(body) >= compression.MIN_SIZE:
+        compressed = compressed or {}
+        for encoding in compression.ENCODINGS:
+            data = compressed.get(encoding) or compression.compress(body, encoding)
+            # 圧縮版のETagはサーバーと同じく`-gzip`などを付ける
+            variant_etag = f'{etag}-{encoding}'
+            variants[encoding] = (data, headers + [
+                ('Content-Encoding', encoding), ('ETag', f'"{variant_etag}"'), ('Content-Length', str(len(data))),
+            ], variant_etag)
+    return Entry(variants)
+
+def get_urls(relative_path: str) -> list[str]:
+    '''
+    書き出したファイルのパスに対応するURL (`index.html`はディレクトリのURLでも返す)
+    '''
+    url = '/' + relative_path
+    if relative_path == 'index.html' or relative_path.endswith('/index.html'):
+        return [url, url.removesuffix('index.html')]
+    return [url]
+
+def load_directory(root: Path) -> dict[str, Entry]:
+    '''
+    freeze.pyの出力を読み込む (隣の`.gz`・`.br`があれば圧縮版として使う)
+    '''
+    suffixes = {suffix: encoding for encoding, (suffix, _) in compression.ENCODINGS.items()}
+    entries: dict[str, Entry] = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = Path(directory) / filename
+            if path.suffix in suffixes and path.with_suffix('').is_file():
+                continue
+            compressed = {
+                encoding: compression.get_sibling(path, encoding).read_bytes()
+                for encoding in compression.ENCODINGS
+                if compression.get_sibling(path, encoding).is_file()
+            }
+            relative_path = path.relative_to(root).as_posix()
+            entry = make_entry('/' + relative_path, path.read_bytes(), compressed)
+            for url in get_urls(relative_path):
+                entries[url] = entry
+    return entries
+
+def render_all() -> tuple[dict[str, Entry], Entry]:
+    '''
+    `server`で全ページ・APIの静的なJSON・静的ファイルを描画し、(URL -> 応答, 404の応答)を返す
+    '''
+    import server
+    server.app.config['WARM_UP'] = False
+    client = server.app.test_client()
+    urls = ['/'] + [
+        f'/{category}/{page_name}.html'
+        for category, category_info in server.document_info.items()
+        for page_name in category_info['pages']
+    ] + server.get_api_urls()
+    static_folder = Path(server.app.static_folder)
+    # 静的ファイルの隣の圧縮版は`make_entry`で作り直す
+    suffixes = {suffix for suffix, _ in compression.ENCODINGS.values()}
+    urls += sorted(
+        f'{server.app.static_url_path}/{path.relative_to(static_folder).as_posix()}'
+        for path in static_folder.rglob('*') if path.is_file() and path.suffix not in suffixes
+    )
+    entries: dict[str, Entry] = {}
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: {response.status}')
+        entry = make_entry(url, response.get_data())
+        for alias in get_urls(url.removeprefix('/')):
+            entries[alias] = entry
+        response.close()
+    return entries, render_not_found(client)
+
+def render_not_found(client: Any = None) -> Entry:
+    '''
+    `server`の404のページ (`docs/`に`404.html`がないときにも使う)
+    '''
+    if client is None:
+        import server
+        server.app.config['WARM_UP'] = False
+        client = server.app.test_client()
+    response = client.get(NOT_FOUND_URL)
+    return make_entry('/' + NOT_FOUND_FILE, response.get_data())
+
+def load_not_found(root: Path) -> Entry:
+    '''
+    freeze.pyが書き出した`404.html` (なければ`server`で描画する)
+    '''
+    path = root / NOT_FOUND_FILE
+    if not path.is_file():
+        return render_not_found()
+    compressed = {
+        encoding: compression.get_sibling(path, encoding).read_bytes()
+        for encoding in compression.ENCODINGS
+        if compression.get_sibling(path, encoding).is_file()
+    }
+    return make_entry('/' + NOT_FOUND_FILE, path.read_bytes(), compressed)
+
+def parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+    '''
+    `Accept-Encoding`をContent-Encoding -> qの値にする (qがなければ1、読めなければ0)
+    '''
+    qualities: dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, *params = item.strip().split(';')
+        if name.strip() == '':
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities
+
+@functools.lru_cache(maxsize = 256)
+def choose_encoding(accept_encoding: str) -> str | None:
+    '''
+    `Accept-Encoding`から使うContent-Encoding (ヘッダーの値は限られるのでキャッシュする)
+    qの最も大きいもの (同じなら`compression.ENCODINGS`の順) で、それが0か`identity`のqより小さければ圧縮しない
+    '''
+    qualities = parse_accept_encoding(accept_encoding)
+    default = qualities.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in compression.ENCODINGS:
+        quality = qualities.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    if best is not None and qualities.get('identity', 0.0) > best_quality:
+        return None
+    return best
+
+def is_not_modified(if_none_match: str, etag: str) -> bool:
+    return if_none_match.strip() == '*' or f'"{etag}"' in if_none_match
+
+class PrerenderedApp:
+    '''
+    URL -> 応答の辞書を引いて返すだけのWSGIアプリ
+    '''
+
+    def __init__(self, entries: Mapping[str, Entry], not_found: Entry):
+        self.entries = MappingProxyType(dict(entries))
+        self.not_found = not_found
+
+    def __call__(self, environ: dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        method = environ['REQUEST_METHOD']
+        entry = self.entries.get(environ.get('PATH_INFO') or '/')
+        status = '200 OK'
+        if entry is None:
+            entry, status = self.not_found, '404 NOT FOUND'
+        elif method not in ('GET', 'HEAD'):
+            start_response('405 METHOD NOT ALLOWED', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return []
+        variants = entry.variants
+        body, headers, etag = variants[None]
+        if len(variants) > 1:
+            encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            if encoding is not None:
+                body, headers, etag = variants[encoding]
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if status == '200 OK' and if_none_match is not None and is_not_modified(if_none_match, etag):
+            start_response('304 NOT MODIFIED', [h for h in headers if h[0] != 'Content-Length'])
+            return []
+        start_response(status, headers)
+        return [body] if method != 'HEAD' else []
+
+def create_app(docs: Path | None = DOCS_DIR, render: bool = False) -> PrerenderedApp:
+    '''
+    `render`なら起動時に描画し、そうでなければ`docs`を読み込んだアプリを作る
+    '''
+    if render:
+        entries, not_found = render_all()
+        return PrerenderedApp(entries, not_found)
+    if not (docs / 'index.html').is_file():
+        raise FileNotFoundError(f'{docs / "index.html"} does not exist; run freeze.py or use --render')
+    return PrerenderedApp(load_directory(docs), load_not_found(docs))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type = Path, default = DOCS_DIR, help = 'freeze.pyの出力先 (既定: docs/)')
+    parser.add_argument('--render', action = 'store_true', help = '`docs`を使わず、起動時に全ページを描画する')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 5000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    app = create_app(args.docs, args.render)
+    num_bytes = sum(len(body) for entry in set(app.entries.values()) for body, _, _ in entry.variants.values())
+    print(f'{len(app.entries)} urls, {num_bytes} B in memory, loaded in {time.perf_counter() - start:.2f} s')
+
+    from werkzeug.serving import run_simple
+    run_simple(args.host, args.port, app, threaded = True)
@@ -0,0 +1,201 @@
+'''
+お宝と洞窟のステージの全文検索の索引
+
+文字のn-gram (1文字と2文字) の転置索引なので、日本語も形態素解析なしで検索できる
+ビルド時に`build/search-index.json`に書き出し (データが変わったときだけ作り直す)、
+サーバーの`/search`と、静的に書き出した索引を少しずつ読むブラウザの検索 (`static/js/search.js`) が使う
+
+使い方: python -m scripts.search_index [--force] [検索語...]
+'''
+import json
+import os
+import sys
+import unicodedata
+from pathlib import Path
+from typing import Any
+
+from scripts import pikmin2_cave_surveys, snapshot
+from scripts.file_hashes import get_stamp
+
+ROOT = Path(__file__).parent.parent
+INDEX_PATH = ROOT / 'build/search-index.json'
+SOURCE_NAMES = ['pikmin2-treasures.yaml', 'pikmin2-cave-surveys.yaml']
+# 索引の形式や正規化の方法を変えたら上げる
+INDEX_VERSION = 1
+
+# 静的に書き出すときのシャード数 (n-gramの先頭の文字のコードポイントで分ける)
+NUM_SHARDS = 16
+# 検索するお宝の項目
+TREASURE_FIELDS = ['jpName', 'enName', 'jpSeries', 'enSeries', 'jpRealLifeItem', 'enRealLifeItem', 'location']
+MAX_RESULTS = 20
+
+# カタカナ -> ひらがな
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+def normalize(text: str) -> str:
+    '''
+    全角・半角、大文字・小文字、カタカナ・ひらがなの違いをなくす (`search.js`の`normalize`と同じ)
+    '''
+    return unicodedata.normalize('NFKC', text).lower().translate(KATAKANA_TO_HIRAGANA)
+
+def get_ngrams(text: str) -> set[str]:
+    '''
+    空白を含まない1文字と2文字の部分文字列
+    '''
+    ngrams = set()
+    for word in text.split():
+        ngrams.update(word)
+        ngrams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return ngrams
+
+def get_query_ngrams(term: str) -> set[str]:
+    '''
+    検索語の1語を含む文書が必ず持つn-gram (2文字以上なら2文字のものだけで絞れる)
+    '''
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+def get_shard(ngram: str) -> int:
+    return ord(ngram[0]) % NUM_SHARDS
+
+def get_documents(treasures: list[dict[str, Any]], stages: dict[str, Any]) -> list[dict[str, Any]]:
+    '''
+    検索対象の文書 (`url`はサイトのルートからの相対パス)
+    '''
+    documents = []
+    for treasure in treasures:
+        documents.append({
+            'type': 'treasure',
+            'title': treasure.get('jpName', treasure['enName']),
+            'subtitle': treasure['enName'],
+            'url': 'pikmin2/treasures.html',
+            'text': '\n'.join(normalize(str(treasure[field])) for field in TREASURE_FIELDS if field in treasure),
+        })
+    for stage_name, stage in stages.items():
+        title = pikmin2_cave_surveys.get_jp_stage_name(stage_name, stage)
+        documents.append({
+            'type': 'stage',
+            'title': title,
+            'subtitle': stage_name,
+            'url': f'pikmin2/cave-surveys.html#tables-{stage_name}',
+            'text': '\n'.join([normalize(title), normalize(stage_name)]),
+        })
+    return documents
+
+def build_postings(documents: list[dict[str, Any]]) -> dict[str, list[int]]:
+    '''
+    n-gram -> それを含む文書の番号 (昇順)
+    '''
+    postings: dict[str, list[int]] = {}
+    for doc_id, document in enumerate(documents):
+        for ngram in get_ngrams(document['text']):
+            postings.setdefault(ngram, []).append(doc_id)
+    return dict(sorted(postings.items()))
+
+def get_source_paths() -> list[Path]:
+    return [ROOT / 'data' / name for name in SOURCE_NAMES]
+
+def read_index() -> dict[str, Any] | None:
+    try:
+        return json.loads(INDEX_PATH.read_text(encoding = 'utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def is_fresh(index: dict[str, Any]) -> bool:
+    return index.get('version') == INDEX_VERSION and index.get('sources') == {
+        path.name: get_stamp(path) for path in get_source_paths()
+    }
+
+def build(force: bool = False) -> dict[str, Any]:
+    '''
+    データが変わっていれば索引を作り直し、索引を返す
+    '''
+    index = None if force else read_index()
+    if index is not None and is_fresh(index):
+        return index
+    documents = get_documents(
+        snapshot.get_data('pikmin2-treasures.yaml'),
+        snapshot.get_data('pikmin2-cave-surveys.yaml'),
+    )
+    index = {
+        'version': INDEX_VERSION,
+        'sources': {path.name: get_stamp(path) for path in get_source_paths()},
+        'documents': documents,
+        'postings': build_postings(documents),
+    }
+    INDEX_PATH.parent.mkdir(parents = True, exist_ok = True)
+    temp_path = INDEX_PATH.with_suffix(f'.{os.getpid()}.tmp')
+    temp_path.write_text(json.dumps(index, ensure_ascii = False), encoding = 'utf-8')
+    temp_path.replace(INDEX_PATH)
+    return index
+
+_index: dict[str, Any] | None = None
+# n-gram -> 文書の番号の集合 (`_index`の`postings`を引きやすくしたもの)
+_posting_sets: dict[str, frozenset[int]] = {}
+
+def load() -> dict[str, Any]:
+    '''
+    索引を読む (データが更新されたときだけ作り直して読み直す)
+    '''
+    global _index, _posting_sets
+    if _index is None or not is_fresh(_index):
+        _index = build()
+        _posting_sets = {ngram: frozenset(doc_ids) for ngram, doc_ids in _index['postings'].items()}
+    return _index
+
+def search(query: str, limit: int = MAX_RESULTS) -> dict[str, Any]:
+    '''
+    空白で区切った全ての語を含む文書を、タイトルが先頭の語で始まるもの、文書の番号の順に返す
+    n-gramの索引で候補を絞り、候補の本文にだけ語が含まれるかを確かめる (全文書は走査しない)
+    '''
+    index = load()
+    documents = index['documents']
+    terms = normalize(query).split()
+    doc_ids: set[int] | None = None
+    for term in terms:
+        postings = sorted((_posting_sets.get(ngram, frozenset()) for ngram in get_query_ngrams(term)), key = len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        if doc_ids is not None:
+            candidates &= doc_ids
+        doc_ids = {doc_id for doc_id in candidates if term in documents[doc_id]['text']}
+        if len(doc_ids) == 0:
+            break
+    if not doc_ids:
+        return {'query': query, 'total': 0, 'results': []}
+    # 本文はタイトルの項目から始まる
+    ranked = sorted(doc_ids, key = lambda doc_id: (not documents[doc_id]['text'].startswith(terms[0]), doc_id))
+    return {
+        'query': query,
+        'total': len(ranked),
+        'results': [
+            {key: documents[doc_id][key] for key in ['type', 'title', 'subtitle', 'url']}
+            for doc_id in ranked[:limit]
+        ],
+    }
+
+def get_shard_meta() -> dict[str, Any]:
+    '''
+    静的に書き出す索引の本体 (文書の一覧とシャード数)
+    '''
+    index = load()
+    return {
+        'version': INDEX_VERSION,
+        'numShards': NUM_SHARDS,
+        'documents': index['documents'],
+    }
+
+def get_shard_postings(shard: int) -> dict[str, list[int]]:
+    '''
+    先頭の文字が`shard`に振り分けられるn-gramの転置索引
+    '''
+    return {ngram: doc_ids for ngram, doc_ids in load()['postings'].items() if get_shard(ngram) == shard}
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    index = build(force = '--force' in args)
+    print(f'{len(index["documents"])} documents, {len(index["postings"])} n-grams -> {INDEX_PATH}')
+    query = ' '.join(arg for arg in args if arg != '--force')
+    if query != '':
+        for result in search(query)['results']:
+            print(f'  [{result["type"]}] {result["title"]} ({result["subtitle"]}) {result["url"]}')
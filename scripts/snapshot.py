@@ -0,0 +1,175 @@
+'''
+`config.yaml`と`data/*.yaml`を検証済みのJSONスナップショットにまとめる
+
+ソースの更新日時・サイズが記録と異なるときだけ作り直すので、
+サーバーやfreeze.pyは実行時にYAMLを解析しなくてよい
+(`yaml`や検証に使う`numpy`も、作り直すときだけimportする)
+
+使い方: python -m scripts.snapshot [--force]
+'''
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable
+
+from scripts.file_hashes import get_stamp
+
+ROOT = Path(__file__).parent.parent
+SNAPSHOT_PATH = ROOT / 'build/snapshot.json'
+# スナップショットの形式を変えたら上げる
+SNAPSHOT_VERSION = 1
+
+def get_source_paths() -> list[Path]:
+    return [ROOT / 'config.yaml', *sorted((ROOT / 'data').glob('*.yaml'))]
+
+def get_source_name(path: Path) -> str:
+    return path.relative_to(ROOT).as_posix()
+
+def validate_config(config: Any):
+    if not isinstance(config, dict) or 'site' not in config or 'document_info' not in config:
+        raise ValueError('config.yaml must have "site" and "document_info"')
+    if not isinstance(config['site'].get('cache_control', ''), str):
+        raise ValueError('site.cache_control must be a string')
+    for category, category_info in config['document_info'].items():
+        if not isinstance(category_info.get('cache_control', ''), str):
+            raise ValueError(f'{category}: "cache_control" must be a string')
+        for page_name, page_info in category_info.get('pages', {}).items():
+            for data_file in page_info.get('data', []):
+                if not (ROOT / 'data' / data_file).exists():
+                    raise ValueError(f'{category}/{page_name}: data/{data_file} does not exist')
+
+def validate_treasures(treasures: Any):
+    if not isinstance(treasures, list):
+        raise ValueError('treasures must be a list')
+    for i, treasure in enumerate(treasures):
+        for key in ['imagePath', 'enName', 'location']:
+            if not isinstance(treasure.get(key), str):
+                raise ValueError(f'treasure #{i}: "{key}" must be a string')
+        for key in ['weight', 'maxCarriers', 'value']:
+            if not isinstance(treasure.get(key), int):
+                raise ValueError(f'treasure #{i} ({treasure["enName"]}): "{key}" must be an integer')
+
+def validate_cave_surveys(stages: Any):
+    from scripts.cave_survey_results import SurveyResult
+    if not isinstance(stages, dict):
+        raise ValueError('cave surveys must be a mapping')
+    for stage_name, stage in stages.items():
+        if not isinstance(stage.get('name'), str):
+            raise ValueError(f'{stage_name}: "name" must be a string')
+        trial = stage.get('trial')
+        if not isinstance(trial, dict):
+            raise ValueError(f'{stage_name}: "trial" is missing')
+        if not isinstance(trial.get('seed'), int) or not isinstance(trial.get('num'), int) or trial['num'] <= 0:
+            raise ValueError(f'{stage_name}: "trial" must have integer "seed" and positive "num"')
+        for key, count in trial.get('result', {}).items():
+            if not isinstance(count, int) or not 0 <= count <= trial['num']:
+                raise ValueError(f'{stage_name}: count of "{key}" must be in [0, num]')
+        try:
+            SurveyResult.from_trial(trial)
+        except (KeyError, ValueError) as e:
+            raise ValueError(f'{stage_name}: {e}')
+
+def validate_pixel_arts_scaled(mapping: Any):
+    if not isinstance(mapping, dict):
+        raise ValueError('pixel-arts-scaled must be a mapping')
+    for filename, entry in mapping.items():
+        if not isinstance(entry, dict) or not isinstance(entry.get('source'), str) \
+                or not isinstance(entry.get('scale'), int) or entry['scale'] < 1:
+            raise ValueError(f'{filename}: must have string "source" and positive integer "scale"')
+        if not (ROOT / 'static/images/pixel-arts' / entry['source']).exists():
+            raise ValueError(f'{filename}: source {entry["source"]} does not exist')
+
+VALIDATORS: dict[str, Callable[[Any], None]] = {
+    'config.yaml': validate_config,
+    'data/pikmin2-treasures.yaml': validate_treasures,
+    'data/pikmin2-cave-surveys.yaml': validate_cave_surveys,
+    'data/pixel-arts-scaled.yaml': validate_pixel_arts_scaled,
+}
+
+def compile_snapshot() -> dict[str, Any]:
+    '''
+    全てのソースを読み込み、検証してスナップショットを作る
+    '''
+    import yaml
+    YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    sources: dict[str, Any] = {}
+    contents: dict[str, Any] = {}
+    for path in get_source_paths():
+        name = get_source_name(path)
+        raw = path.read_bytes()
+        content = yaml.load(raw.decode('utf-8'), Loader = YamlLoader)
+        if name in VALIDATORS:
+            VALIDATORS[name](content)
+        # JSONで往復しても同じ値になること (日付型などを弾く)
+        if json.loads(json.dumps(content, ensure_ascii = False)) != content:
+            raise ValueError(f'{name} contains values that cannot be stored as JSON')
+        sources[name] = {
+            'stamp': get_stamp(path),
+            'sha256': hashlib.sha256(raw).hexdigest(),
+        }
+        contents[name] = content
+    return {'version': SNAPSHOT_VERSION, 'sources': sources, 'contents': contents}
+
+def is_fresh(snapshot: dict[str, Any]) -> bool:
+    '''
+    スナップショット作成後にソースが追加・削除・更新されていないか
+    '''
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return False
+    paths = get_source_paths()
+    if sorted(snapshot['sources']) != sorted(map(get_source_name, paths)):
+        return False
+    return all(
+        snapshot['sources'][get_source_name(path)]['stamp'] == get_stamp(path)
+        for path in paths
+    )
+
+def read_snapshot() -> dict[str, Any] | None:
+    try:
+        return json.loads(SNAPSHOT_PATH.read_text(encoding = 'utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def build(force: bool = False) -> dict[str, Any]:
+    '''
+    必要ならスナップショットを作り直してファイルに書き出し、その内容を返す
+    '''
+    snapshot = None if force else read_snapshot()
+    if snapshot is not None and is_fresh(snapshot):
+        return snapshot
+    snapshot = compile_snapshot()
+    SNAPSHOT_PATH.parent.mkdir(parents = True, exist_ok = True)
+    temp_path = SNAPSHOT_PATH.with_suffix(f'.{os.getpid()}.tmp')
+    temp_path.write_text(json.dumps(snapshot, ensure_ascii = False), encoding = 'utf-8')
+    temp_path.replace(SNAPSHOT_PATH)
+    return snapshot
+
+_snapshot: dict[str, Any] | None = None
+
+def load(check: bool = True) -> dict[str, Any]:
+    '''
+    メモリ上のスナップショットを返す
+    `check`ならソースが更新されていないか確かめ、更新されていれば作り直す
+    (サーバーはリクエストの最初に1度だけ確かめ、リクエスト中は`check = False`で読む)
+    '''
+    global _snapshot
+    if _snapshot is None or (check and not is_fresh(_snapshot)):
+        _snapshot = build()
+    return _snapshot
+
+def get_config(check: bool = True) -> dict[str, Any]:
+    return load(check)['contents']['config.yaml']
+
+def get_data(data_file: str, check: bool = True) -> Any:
+    '''
+    `data/`以下のファイル名を指定して内容を取得
+    '''
+    return load(check)['contents'][f'data/{data_file}']
+
+if __name__ == '__main__':
+    snapshot = build(force = '--force' in sys.argv[1:])
+    for name, source in snapshot['sources'].items():
+        print(f'{name}: {source["sha256"][:12]}')
+    print(f'-> {SNAPSHOT_PATH}')
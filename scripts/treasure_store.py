@@ -0,0 +1,246 @@
+'''
+お宝のデータを列ごとの配列にまとめた検索用のストア
+
+読み込み時に1度だけ各列の並び順 (昇順・降順) と場所・シリーズごとの行の索引を作り、
+絞り込み・並べ替え・ページ分けはその配列の添字の操作だけで行う
+`/api/pikmin2/treasures`と、それを静的に書き出したJSONのシャードから使う
+'''
+import numpy as np
+from typing import Any, Iterable
+
+# 数値の列 (欠けている値はNaN)
+NUMERIC_COLUMNS = [
+    'jpId', 'usId', 'euId',
+    'weight', 'maxCarriers', 'value', 'sublevel',
+    'weight2PBattle', 'maxCarriers2PBattle',
+]
+# 文字列の列 (欠けている値はNone)
+STRING_COLUMNS = [
+    'jpName', 'enName',
+    'location',
+    'jpSeries', 'enSeries',
+    'jpRealLifeItem', 'enRealLifeItem',
+    'imagePath',
+]
+# 他の列から計算する列 -> (分子, 分母)
+DERIVED_COLUMNS = {
+    'valuePerWeight': ('value', 'weight'),
+    'valuePerCarrier': ('value', 'maxCarriers'),
+}
+# 索引を作る絞り込み -> 値を取る列 (どれかの列と一致すればよい)
+INDEXED_FILTERS = {
+    'location': ['location'],
+    'series': ['jpSeries', 'enSeries'],
+}
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 250
+
+class QueryError(ValueError):
+    '''
+    絞り込み・並べ替え・ページ分けの条件の誤り (APIでは400にする)
+    '''
+
+class TreasureStore:
+    '''
+    お宝の表 (行はYAMLの順番)
+    '''
+
+    def __init__(self, treasures: list[dict[str, Any]]):
+        self.treasures = treasures
+        self.num_rows = len(treasures)
+        self.columns: dict[str, np.ndarray] = {}
+        for column in NUMERIC_COLUMNS:
+            self.columns[column] = np.array(
+                [t.get(column, np.nan) for t in treasures], dtype = np.float64)
+        for column in STRING_COLUMNS:
+            self.columns[column] = np.array([t.get(column) for t in treasures], dtype = object)
+        for column, (numerator, denominator) in DERIVED_COLUMNS.items():
+            a, b = self.columns[numerator], self.columns[denominator]
+            self.columns[column] = np.divide(a, b, out = np.full(self.num_rows, np.nan), where = b > 0)
+
+        # 列 -> 昇順・降順の行の並び (欠けている値はどちらでも最後、同じ値は元の順番)
+        self.orders: dict[str, dict[str, np.ndarray]] = {}
+        for column in self.columns:
+            ranks, missing = self.rank(column)
+            self.orders[column] = {
+                'asc': np.lexsort((ranks, missing)),
+                'desc': np.lexsort((-ranks, missing)),
+            }
+
+        # 絞り込みの名前 -> 値 -> 行番号の配列
+        self.indexes: dict[str, dict[str, np.ndarray]] = {}
+        for name, columns in INDEXED_FILTERS.items():
+            rows: dict[str, set[int]] = {}
+            for column in columns:
+                for row, value in enumerate(self.columns[column]):
+                    if value is not None:
+                        rows.setdefault(value, set()).add(row)
+            self.indexes[name] = {value: np.array(sorted(r), dtype = np.int64) for value, r in rows.items()}
+
+    def rank(self, column: str) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        列の値の順位と、値が欠けているかの配列
+        '''
+        values = self.columns[column]
+        if values.dtype == object:
+            missing = np.array([v is None for v in values])
+            labels = sorted(set(v for v in values if v is not None))
+            rank_of = {label: i for i, label in enumerate(labels)}
+            ranks = np.array([rank_of.get(v, -1) for v in values], dtype = np.int64)
+        else:
+            missing = np.isnan(values)
+            ranks = np.unique(np.where(missing, 0, values), return_inverse = True)[1].astype(np.int64)
+        return ranks, missing
+
+    def is_numeric(self, column: str) -> bool:
+        return self.columns[column].dtype != object
+
+    def check_column(self, column: str):
+        if column not in self.columns:
+            raise QueryError(f'unknown column {column!r}')
+
+    def check_query(
+        self,
+        *,
+        indexed: dict[str, Iterable[str]] | None = None,
+        equals: dict[str, Iterable[Any]] | None = None,
+        ranges: dict[str, tuple[float | None, float | None]] | None = None,
+        sort: str | None = None,
+        order: str = 'asc',
+        offset: int = 0,
+        limit: int = DEFAULT_LIMIT,
+    ):
+        '''
+        `query`の引数を確かめる (誤りがあれば`QueryError`)
+        '''
+        for name in indexed or {}:
+            if name not in self.indexes:
+                raise QueryError(f'unknown filter {name!r}')
+        for column, values in (equals or {}).items():
+            self.check_column(column)
+            if self.is_numeric(column):
+                for value in values:
+                    try:
+                        float(value)
+                    except ValueError:
+                        raise QueryError(f'column {column!r} is numeric, got {value!r}') from None
+        for column in ranges or {}:
+            self.check_column(column)
+            if not self.is_numeric(column):
+                raise QueryError(f'column {column!r} is not numeric')
+        if sort is not None:
+            self.check_column(sort)
+        if order not in ('asc', 'desc'):
+            raise QueryError(f'order must be "asc" or "desc", got {order!r}')
+        if offset < 0 or not 0 < limit <= MAX_LIMIT:
+            raise QueryError(f'offset must be >= 0 and limit must be in [1, {MAX_LIMIT}]')
+
+    def filter(
+        self,
+        indexed: dict[str, Iterable[str]] | None = None,
+        equals: dict[str, Iterable[Any]] | None = None,
+        ranges: dict[str, tuple[float | None, float | None]] | None = None,
+    ) -> np.ndarray:
+        '''
+        条件に合う行のマスク
+        `indexed`は索引 (場所・シリーズ)、`equals`は列の値の一致 (いずれも複数の値はどれかに一致)、
+        `ranges`は数値の列の(最小値, 最大値) (端を含む)
+        (条件は`check_query`で確かめたもの)
+        '''
+        mask = np.ones(self.num_rows, dtype = bool)
+        for name, values in (indexed or {}).items():
+            matched = np.zeros(self.num_rows, dtype = bool)
+            for value in values:
+                matched[self.indexes[name].get(value, [])] = True
+            mask &= matched
+        for column, values in (equals or {}).items():
+            column_values = self.columns[column]
+            matched = np.zeros(self.num_rows, dtype = bool)
+            for value in values:
+                if self.is_numeric(column):
+                    matched |= column_values == float(value)
+                else:
+                    matched |= column_values == value
+            mask &= matched
+        for column, (low, high) in (ranges or {}).items():
+            # NaNとの比較は常にFalseなので、値が欠けている行は除かれる
+            column_values = self.columns[column]
+            if low is not None:
+                mask &= column_values >= low
+            if high is not None:
+                mask &= column_values <= high
+        return mask
+
+    def sorted_rows(self, mask: np.ndarray, sort: str | None = None, order: str = 'asc') -> np.ndarray:
+        '''
+        マスクされた行を`sort`の列で並べた行番号 (`sort`がなければ元の順番)
+        '''
+        if sort is None:
+            rows = np.arange(self.num_rows)
+        else:
+            rows = self.orders[sort][order]
+        return rows[mask[rows]]
+
+    def record(self, row: int) -> dict[str, Any]:
+        '''
+        元のデータに計算した列を加えた1行分
+        '''
+        record = dict(self.treasures[row])
+        for column in DERIVED_COLUMNS:
+            value = self.columns[column][row]
+            record[column] = None if np.isnan(value) else round(float(value), 4)
+        return record
+
+    def query(
+        self,
+        *,
+        indexed: dict[str, Iterable[str]] | None = None,
+        equals: dict[str, Iterable[Any]] | None = None,
+        ranges: dict[str, tuple[float | None, float | None]] | None = None,
+        sort: str | None = None,
+        order: str = 'asc',
+        offset: int = 0,
+        limit: int = DEFAULT_LIMIT,
+    ) -> dict[str, Any]:
+        '''
+        絞り込んで並べ替えた結果の`offset`行目から`limit`行 (条件に誤りがあれば`QueryError`)
+        '''
+        self.check_query(
+            indexed = indexed, equals = equals, ranges = ranges, sort = sort, order = order, offset = offset, limit = limit,
+        )
+        rows = self.sorted_rows(self.filter(indexed, equals, ranges), sort, order)
+        return {
+            'total': len(rows),
+            'offset': offset,
+            'limit': limit,
+            'sort': sort,
+            'order': order,
+            'items': [self.record(int(row)) for row in rows[offset:offset + limit]],
+        }
+
+    def shard_index(self, shard_size: int) -> dict[str, Any]:
+        '''
+        静的に書き出す索引 (並び順と絞り込みの索引は行番号のリスト)
+        クライアントは行を`rows-<番号>.json`から読み、同じ絞り込み・並べ替えを手元で行える
+        '''
+        return {
+            'numRows': self.num_rows,
+            'shardSize': shard_size,
+            'numShards': -(-self.num_rows // shard_size),
+            'columns': {column: 'number' if self.is_numeric(column) else 'string' for column in self.columns},
+            'orders': {
+                column: {order: rows.tolist() for order, rows in orders.items()}
+                for column, orders in self.orders.items()
+            },
+            'indexes': {
+                name: {value: rows.tolist() for value, rows in sorted(index.items())}
+                for name, index in self.indexes.items()
+            },
+        }
+
+    def shard(self, shard: int, shard_size: int) -> list[dict[str, Any]]:
+        start = shard * shard_size
+        if not 0 <= start < self.num_rows:
+            raise IndexError(f'shard {shard} is out of range')
+        return [self.record(row) for row in range(start, min(start + shard_size, self.num_rows))]
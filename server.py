@@ -1,17 +1,79 @@
 # -*- coding: utf-8 -*-
+import ast
+import functools
+import importlib
 import json
-import yaml
 import flask
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from jinja2 import TemplateNotFound, meta
 from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 from pathlib import Path
-from typing import Any
+from stat import S_ISDIR
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Callable
 
-from scripts import pikmin2_treasures, pikmin2_cave_surveys, pixel_arts
+# 起動を速くするため、numpyなどに依存する生成モジュールはそのページを最初に処理するときにimportする
+from scripts import compression, file_hashes, metrics, snapshot
+
+if TYPE_CHECKING:
+    from scripts import treasure_store
 
 app = flask.Flask(__name__)
 
-# 設定ファイルの読み込み
-config = yaml.safe_load(open(Path(__file__).parent / 'config.yaml', encoding='utf-8'))
+# `/debug/metrics`を返すか (リバースプロキシの後ろでは全てのリクエストがローカルから来るので、既定では返さない)
+app.config['DEBUG_METRICS'] = False
+# `/debug/metrics`を返すアドレス
+METRICS_ALLOWED_ADDRS = {'127.0.0.1', '::1'}
+
+@app.before_request
+def start_timer():
+    flask.g.request_start = time.perf_counter()
+
+# `create_app`で全ページの事前生成を始めるか (freeze.pyなどテストクライアントで描画するだけのときは`False`にする)
+app.config['WARM_UP'] = True
+
+@app.before_request
+def refresh_snapshot():
+    # データファイルの更新はリクエストごとに1度だけ確かめる (リクエスト中は`check = False`で読む)
+    snapshot.load()
+
+def get_route() -> str:
+    rule = flask.request.url_rule
+    return rule.rule if rule is not None else '<unmatched>'
+
+@app.after_request
+def record_timing(response: flask.Response) -> flask.Response:
+    '''
+    段階ごとの処理時間を`Server-Timing`ヘッダーにし、ルートごとの処理時間とエラー数を記録する
+    (`after_request`は登録と逆の順に呼ばれるので、圧縮の時間も含む)
+    '''
+    total = time.perf_counter() - flask.g.get('request_start', time.perf_counter())
+    metrics.record_request(get_route(), total, response.status_code)
+    flask.g.request_recorded = True
+    response.headers['Server-Timing'] = metrics.get_server_timing(total)
+    return response
+
+@app.teardown_request
+def record_unhandled_error(error: BaseException | None):
+    '''
+    例外がそのまま送出されて (`debug = True`など) `after_request`が呼ばれなかったリクエストを500として記録する
+    '''
+    if error is not None and not flask.g.get('request_recorded', False):
+        total = time.perf_counter() - flask.g.get('request_start', time.perf_counter())
+        metrics.record_request(get_route(), total, 500)
+
+# 設定ファイルの読み込み (YAMLはスナップショットにコンパイル済み)
+config = snapshot.get_config()
 document_info = config['document_info']
 
 def get_title(category: str, page_name: str) -> str:
@@ -26,67 +88,666 @@ def get_favicon(category: str, page_name: str) -> str:
     except:
         return ''
     
-def load_data_file(data_file: Path) -> str:
+def load_data_file(data_file: Path) -> Any:
     assert data_file.exists()
-    return open(data_file, encoding = 'utf-8').read()
+    with metrics.phase('load'):
+        return snapshot.get_data(data_file.name, check = False)
 
-def get_data(category: str, page_name: str) -> dict[str, str | Markup]:
+def generate_data(category: str, page_name: str) -> dict[str, Any]:
 
     # 必要なデータの取得
     try:
         data_files = document_info[category]['pages'][page_name]['data']
     except:
         data_files = []
-    data: dict[str, str | Markup] = {}
+    data: dict[str, Any] = {}
     for data_file in data_files:
         path = Path(__file__).parent / f'data/{data_file}'
         data[data_file] = load_data_file(path)
     
     # データの解析
-    if (category, page_name) == ('pikmin2', 'treasures'):
-        data['pikmin2-treasures'] = \
-            pikmin2_treasures.generate(data['pikmin2-treasures.yaml'])
-    elif (category, page_name) == ('pikmin2', 'cave-surveys'):
-        data['pikmin2-cave-surveys'] = \
-            pikmin2_cave_surveys.generate(data['pikmin2-cave-surveys.yaml'])
-    elif (category, page_name) == ('others', 'pixel-arts'):
-        data['pixel-arts'] = pixel_arts.generate(
-            Path(__file__).parent / 'static/images/pixel-arts'
-        )
+    module = get_generator_module(category, page_name)
+    with metrics.phase('generate'):
+        if (category, page_name) == ('pikmin2', 'treasures'):
+            data['pikmin2-treasures'] = \
+                module.generate(data['pikmin2-treasures.yaml'])
+        elif (category, page_name) == ('pikmin2', 'cave-surveys'):
+            data['pikmin2-cave-surveys'] = \
+                module.generate(data['pikmin2-cave-surveys.yaml'])
+        elif (category, page_name) == ('others', 'pixel-arts'):
+            data['pixel-arts'] = module.generate(module.load(), data['pixel-arts-scaled.yaml'])
     
     return data
 
+# 生成済みデータのキャッシュ (LRU)
+DATA_CACHE_SIZE = 16
+data_cache: OrderedDict[Hashable, dict[str, Any]] = OrderedDict()
+# 生成中のキャッシュキー -> 生成結果 (同じページへの同時のリクエストは1回の生成を待つ)
+data_in_flight: dict[Hashable, Future] = {}
+data_cache_lock = threading.Lock()
+
+def get_dependencies(category: str, page_name: str) -> list[Path]:
+    '''
+    ページの生成に使うデータファイル・ディレクトリの一覧
+    '''
+    try:
+        data_files = document_info[category]['pages'][page_name]['data']
+    except:
+        data_files = []
+    dependencies = [Path(__file__).parent / f'data/{data_file}' for data_file in data_files]
+    if (category, page_name) == ('others', 'pixel-arts'):
+        # 画像のディレクトリではなく、ビルド時に作るマニフェストに依存する
+        dependencies.append(MANIFEST_PATHS['scripts.pixel_arts'])
+    if (category, page_name) in [('pikmin2', 'treasures'), ('pikmin2', 'cave-surveys')]:
+        # 画像の縮小版のマニフェスト (縮小版が作り直されるとURLが変わる)
+        dependencies.append(MANIFEST_PATHS['scripts.image_variants'])
+    return dependencies
+
+# 画像から作るマニフェスト (各モジュールの`MANIFEST_PATH`と同じ)
+# ETagを求めるだけでnumpyに依存するモジュールをimportしないよう、パスはここにも持つ
+# ビルド前はまだなく、そのときは元の画像で描画する (ないことも入力の状態としてキャッシュキー・ETagに含める)
+MANIFEST_PATHS: dict[str, Path] = {
+    'scripts.pixel_arts': Path(__file__).parent / 'build/pixel-arts.json',
+    'scripts.image_variants': Path(__file__).parent / 'build/image-variants.json',
+}
+
+def import_module(name: str) -> ModuleType:
+    '''
+    モジュールを取得する (初めてのときはimportにかかった時間を段階`import`として記録する)
+    '''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with metrics.phase('import'):
+        return importlib.import_module(name)
+
+# ページごとのデータ生成モジュールの名前
+GENERATOR_MODULES: dict[tuple[str, str], str] = {
+    ('pikmin2', 'treasures'): 'scripts.pikmin2_treasures',
+    ('pikmin2', 'cave-surveys'): 'scripts.pikmin2_cave_surveys',
+    ('others', 'pixel-arts'): 'scripts.pixel_arts',
+}
+
+def get_generator_module(category: str, page_name: str) -> ModuleType | None:
+    name = GENERATOR_MODULES.get((category, page_name))
+    return None if name is None else import_module(name)
+
+def get_module_path(name: str) -> Path:
+    '''
+    `scripts.xxx`のモジュールのファイル (importせずに求める)
+    '''
+    return Path(__file__).parent.joinpath(*name.split('.')).with_suffix('.py')
+
+# Pythonファイル -> (更新日時・サイズ, importしている`scripts`のモジュールのファイル)
+imported_scripts_cache: dict[Path, tuple[list[int], list[Path]]] = {}
+
+def get_imported_scripts(path: Path) -> list[Path]:
+    '''
+    Pythonファイルが (関数の中も含めて) importしている`scripts`のモジュールのファイル
+    モジュールを実行せずに構文木から求め、ファイルが更新されたときだけ読み直す
+    '''
+    stamp = file_hashes.get_stamp(path)
+    cached = imported_scripts_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    names: list[str] = []
+    for node in ast.walk(ast.parse(path.read_bytes(), str(path))):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+            # `from scripts import html_builder`と`from scripts.png import decode`の両方に対応する
+            names += [node.module] + [f'{node.module}.{alias.name}' for alias in node.names]
+    paths = sorted(set(
+        get_module_path('.'.join(name.split('.')[:2])) for name in names
+        if name.startswith('scripts.') and get_module_path('.'.join(name.split('.')[:2])).is_file()
+    ))
+    imported_scripts_cache[path] = (stamp, paths)
+    return paths
+
+def get_code_dependencies(category: str, page_name: str) -> list[Path]:
+    '''
+    ページの生成に使うPythonファイルの一覧 (このファイル、生成モジュールとそこから辿れる`scripts`のモジュール)
+    ETagを求めるだけで生成モジュールをimportしないよう、importは構文木から辿る
+    '''
+    dependencies = [Path(__file__)]
+    name = GENERATOR_MODULES.get((category, page_name))
+    if name is not None:
+        found: set[Path] = set()
+        pending = [get_module_path(name)]
+        while pending:
+            path = pending.pop()
+            if path not in found:
+                found.add(path)
+                pending += get_imported_scripts(path)
+        dependencies += sorted(found)
+    return dependencies
+
+def get_cache_key(category: str, page_name: str) -> Hashable:
+    '''
+    依存ファイルの更新日時・サイズ (ディレクトリはファイル名の一覧) を含むキャッシュキー
+    '''
+    key: list[Hashable] = [category, page_name, flask.request.script_root]
+    for path in get_dependencies(category, page_name):
+        if path.is_dir():
+            file_names = tuple(sorted(p.name for p in path.iterdir() if p.is_file()))
+            key.append((str(path), file_names))
+        elif not path.exists():
+            key.append((str(path), None))
+        else:
+            stat = path.stat()
+            key.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(key)
+
+def get_data(category: str, page_name: str) -> dict[str, Any]:
+    '''
+    `generate_data`の結果をキャッシュして返す
+    依存ファイルが更新されるとキーが変わるので自動的に再生成される
+    別のスレッドが同じキーを生成中なら、生成し直さずにその結果を待つ
+    '''
+    key = get_cache_key(category, page_name)
+    with data_cache_lock:
+        hit = key in data_cache
+        if hit:
+            data_cache.move_to_end(key)
+            data = data_cache[key]
+        else:
+            future = data_in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = data_in_flight[key] = Future()
+    metrics.record_cache('data', hit)
+    if hit:
+        return dict(data)
+    if not leader:
+        with metrics.phase('wait'):
+            return dict(future.result())
+
+    try:
+        data = generate_data(category, page_name)
+    except BaseException as e:
+        with data_cache_lock:
+            del data_in_flight[key]
+        future.set_exception(e)
+        raise
+    with data_cache_lock:
+        data_cache[key] = data
+        while len(data_cache) > DATA_CACHE_SIZE:
+            data_cache.popitem(last = False)
+        del data_in_flight[key]
+    future.set_result(data)
+    return dict(data)
+
+# テンプレート名 -> ((ファイル, 更新日時・サイズ)の一覧, ファイルの一覧)
+template_dependencies_cache: dict[str, tuple[list[tuple[Path, list[int]]], list[Path]]] = {}
+
+def get_template_dependencies(template_name: str) -> list[Path]:
+    '''
+    テンプレートと、そこから`extends`や`include`で参照されるテンプレートのファイル
+    どのファイルも更新されていなければ、テンプレートを解析し直さずに前回の結果を返す
+    '''
+    cached = template_dependencies_cache.get(template_name)
+    if cached is not None and all(file_hashes.get_stamp(path) == stamp for path, stamp in cached[0]):
+        return cached[1]
+    paths: list[Path] = []
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        source, filename, _ = app.jinja_loader.get_source(app.jinja_env, name)
+        if Path(filename) in paths:
+            continue
+        paths.append(Path(filename))
+        pending += [n for n in meta.find_referenced_templates(app.jinja_env.parse(source)) if n is not None]
+    template_dependencies_cache[template_name] = ([(path, file_hashes.get_stamp(path)) for path in paths], paths)
+    return paths
+
+def get_page_dependencies(url: str) -> list[Path]:
+    '''
+    ページの出力に影響するファイル・ディレクトリ
+    '''
+    dependencies = [Path(__file__).parent / 'config.yaml']
+    if url.startswith('/api/pikmin2/treasures'):
+        dependencies += [TREASURES_DATA_PATH, get_module_path('scripts.treasure_store'), Path(__file__)]
+    elif url.startswith('/search'):
+        search_index = import_module('scripts.search_index')
+        dependencies += search_index.get_source_paths()
+        dependencies += [Path(search_index.__file__), get_module_path('scripts.pikmin2_cave_surveys'), Path(__file__)]
+    elif url == '/':
+        dependencies += get_template_dependencies('index.html')
+        dependencies.append(Path(__file__))
+    elif url.startswith('/pikmin2/cave-surveys/'):
+        # 1ステージ分の表 (テンプレートは使わない)
+        dependencies += get_dependencies('pikmin2', 'cave-surveys')
+        dependencies += get_code_dependencies('pikmin2', 'cave-surveys')
+    else:
+        category, page_name = url.strip('/').removesuffix('.html').split('/')
+        dependencies += get_template_dependencies(f'{category}/{page_name}.html')
+        dependencies += get_dependencies(category, page_name)
+        dependencies += get_code_dependencies(category, page_name)
+    return dependencies
+
+# ETag用の入力ファイルのハッシュ (更新日時・サイズが変わらない間は使い回す)
+input_hashes: dict[str, Any] = {}
+# (URL, アプリの配置場所) -> (入力ファイルの一覧, その更新日時・サイズ, ETag, 最終更新日時) のキャッシュ (LRU)
+# APIと検索はクエリ文字列ごとに別のURLになるので、件数を制限する
+VALIDATORS_CACHE_SIZE = 256
+validators_cache: OrderedDict[tuple[str, str], tuple[list[Path], list[Hashable], str, datetime]] = OrderedDict()
+validators_cache_lock = threading.Lock()
+
+def get_dependency_stamp(path: Path) -> Hashable:
+    '''
+    入力ファイルの更新日時・サイズ (ディレクトリは自身と中のファイルのもの、ないファイルは`None`)
+    '''
+    try:
+        status = path.stat()
+    except FileNotFoundError:
+        return None
+    if S_ISDIR(status.st_mode):
+        return (
+            (status.st_mtime_ns, status.st_size),
+            tuple((child.name, *file_hashes.get_stamp(child)) for child in sorted(path.iterdir()) if child.is_file()),
+        )
+    return (status.st_mtime_ns, status.st_size)
+
+def get_validators(url: str) -> tuple[str, datetime]:
+    '''
+    ページの入力のハッシュから作る強いETagと、入力の最終更新日時
+    入力の一覧を決めるファイル (config.yaml・テンプレート・Pythonファイル) も入力に含まれるので、
+    前回の入力の更新日時・サイズが変わっていなければ、一覧もハッシュも求め直さずに前回の値を返す
+    '''
+    cache_key = (url, flask.request.script_root)
+    with validators_cache_lock:
+        cached = validators_cache.get(cache_key)
+        if cached is not None:
+            validators_cache.move_to_end(cache_key)
+    if cached is not None:
+        dependencies, stamps, etag, last_modified = cached
+        try:
+            if [get_dependency_stamp(path) for path in dependencies] == stamps:
+                return etag, last_modified
+        except FileNotFoundError:
+            pass
+
+    dependencies = get_page_dependencies(url)
+    stamps = [get_dependency_stamp(path) for path in dependencies]
+    inputs: dict[str, Any] = {}
+    hashes = {
+        file_hashes.get_name(path): file_hashes.hash_dependency(path, inputs, input_hashes) if path.exists() else None
+        for path in dependencies
+    }
+    input_hashes.update(inputs)
+    # 相対URLで出力するので、同じ入力でもアプリの配置場所が変われば別の内容になる
+    key = json.dumps([url, flask.request.script_root, sorted(hashes.items())])
+    etag = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+    mtime_ns = max(file_hashes.get_mtime_ns(path) for path in dependencies if path.exists())
+    last_modified = datetime.fromtimestamp(mtime_ns // 10 ** 9, timezone.utc)
+    with validators_cache_lock:
+        validators_cache[cache_key] = (dependencies, stamps, etag, last_modified)
+        while len(validators_cache) > VALIDATORS_CACHE_SIZE:
+            validators_cache.popitem(last = False)
+    return etag, last_modified
+
+def get_cache_control(category: str | None = None) -> str:
+    '''
+    `Cache-Control`の値 (カテゴリの`cache_control`、なければ`site`の`cache_control`)
+    '''
+    default = config['site'].get('cache_control', 'no-cache')
+    if category is None:
+        return default
+    return document_info[category].get('cache_control', default)
+
+def conditional_response(url: str, cache_control: str, render: Callable[[], str | flask.Response]) -> flask.Response:
+    '''
+    `If-None-Match`・`If-Modified-Since`が入力と一致すれば描画せずに304を返す
+    '''
+    etag, last_modified = get_validators(url)
+    # 圧縮して返したときはETagに`-gzip`などを付けているので、それも一致とみなす
+    etags = [etag] + [f'{etag}-{encoding}' for encoding in compression.ENCODINGS]
+    if all(
+        is_resource_modified(flask.request.environ, etag = e, last_modified = last_modified)
+        for e in etags
+    ):
+        metrics.record_cache('conditional', False)
+        response = flask.make_response(render())
+    else:
+        metrics.record_cache('conditional', True)
+        response = flask.Response(status = 304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def render_template(template_name: str, **context: Any) -> str:
+    with metrics.phase('render'):
+        return flask.render_template(template_name, **context)
+
 @app.route('/')
 def index():
-    return flask.render_template(
+    return conditional_response('/', get_cache_control(), lambda: render_template(
         'index.html', 
         title = config['site']['name'],
         favicon = config['site']['home_favicon'],
         document_info = document_info,
         full_title = config['site']['name'],
-    )
+    ))
 
 @app.route('/<category>/<page_name>.html', methods=['GET'])
 def page(category: str, page_name: str):
+    # 存在しないカテゴリ・テンプレートだけ404にする (それ以外の例外は隠さず500にする)
+    if category not in document_info:
+        flask.abort(404)
     try:
-        title = get_title(category, page_name)
-        context = {
-            'title': title,
-            'favicon': get_favicon(category, page_name), 
-            'document_info': document_info,
-            'full_title': title + ' - ' + document_info[category]['title'],
-            'data': get_data(category, page_name)
-        }
-        return flask.render_template(
-            f'/{category}/{page_name}.html', 
-            **context,
-        )
-    except:
-        return flask.render_template('404.html')
+        url = f'/{category}/{page_name}.html'
+        return conditional_response(url, get_cache_control(category), lambda: render_page(category, page_name))
+    except TemplateNotFound:
+        flask.abort(404)
+
+def render_page(category: str, page_name: str) -> str:
+    title = get_title(category, page_name)
+    context = {
+        'title': title,
+        'favicon': get_favicon(category, page_name), 
+        'document_info': document_info,
+        'full_title': title + ' - ' + document_info[category]['title'],
+        'data': get_data(category, page_name)
+    }
+    return render_template(
+        f'/{category}/{page_name}.html', 
+        **context,
+    )
+
+# 起動時の事前生成の並列数
+WARM_UP_JOBS = 4
+
+def warm_up_page(category: str, page_name: str) -> float:
+    '''
+    ページを1回描画してデータのキャッシュとテンプレートを準備し、かかった秒数を返す
+    '''
+    start = time.perf_counter()
+    with app.test_request_context(f'/{category}/{page_name}.html'):
+        render_page(category, page_name)
+    return time.perf_counter() - start
+
+def start_warm_up(jobs: int = WARM_UP_JOBS) -> list[Future]:
+    '''
+    `document_info`の全ページをバックグラウンドのスレッドプールで描画し始める (終わるのを待たずに返す)
+    描画中のページへのリクエストは`get_data`で同じ生成を待つ
+    '''
+    def log_result(url: str, future: Future):
+        if future.exception() is not None:
+            app.logger.error(f'warm-up {url} failed', exc_info = future.exception())
+        else:
+            app.logger.info(f'warm-up {url} in {future.result() * 1000:.1f} ms')
+
+    pool = ThreadPoolExecutor(jobs, thread_name_prefix = 'warm-up')
+    futures = []
+    for category, category_info in document_info.items():
+        for page_name in category_info['pages']:
+            future = pool.submit(warm_up_page, category, page_name)
+            future.add_done_callback(functools.partial(log_result, f'/{category}/{page_name}.html'))
+            futures.append(future)
+    pool.shutdown(wait = False)
+    return futures
+
+warm_up_started = False
+warm_up_lock = threading.Lock()
+
+def create_app() -> flask.Flask:
+    '''
+    サーバーの起動時に呼ぶ (`WARM_UP`が有効なら、最初のリクエストを待たずに事前生成を1度だけ始める)
+    WSGIサーバーでは`server:create_app()`を読み込む (例: `gunicorn 'server:create_app()'`)
+    '''
+    global warm_up_started
+    with warm_up_lock:
+        start = app.config['WARM_UP'] and not warm_up_started
+        if start:
+            warm_up_started = True
+    if start:
+        start_warm_up()
+    return app
+
+@app.route('/pikmin2/cave-surveys/<stage_name>.html', methods=['GET'])
+def cave_survey_stage(stage_name: str):
+    '''
+    洞窟調査の1ステージ分の表だけを返す (ページ全体を作り直さずに確認・差し替えするため)
+    '''
+    stages = load_data_file(Path(__file__).parent / 'data/pikmin2-cave-surveys.yaml')
+    if stage_name not in stages:
+        flask.abort(404)
+    return conditional_response(
+        f'/pikmin2/cave-surveys/{stage_name}.html', get_cache_control('pikmin2'),
+        lambda: import_module('scripts.pikmin2_cave_surveys').generate_stage(stages, stage_name),
+    )
+
+# お宝の検索API (行は`treasure_store`の列ごとの配列から引く)
+TREASURES_DATA_PATH = Path(__file__).parent / 'data/pikmin2-treasures.yaml'
+# 静的に書き出すときの1ファイルあたりの行数
+TREASURE_SHARD_SIZE = 64
+# (データファイルの更新日時・サイズ, ストア)
+treasure_store_cache: dict[str, Any] = {}
+
+def get_treasure_store() -> 'treasure_store.TreasureStore':
+    '''
+    お宝のストア (データファイルが更新されたときだけ作り直す)
+    '''
+    stamp = file_hashes.get_stamp(TREASURES_DATA_PATH)
+    if treasure_store_cache.get('stamp') != stamp:
+        store_class = import_module('scripts.treasure_store').TreasureStore
+        treasure_store_cache['store'] = store_class(load_data_file(TREASURES_DATA_PATH))
+        treasure_store_cache['stamp'] = stamp
+    return treasure_store_cache['store']
+
+def get_api_urls() -> list[str]:
+    '''
+    静的に書き出すAPIのURL (お宝の索引と行のシャード、検索の索引とそのシャード)
+    '''
+    num_shards = -(-get_treasure_store().num_rows // TREASURE_SHARD_SIZE)
+    search_index = import_module('scripts.search_index')
+    return ['/api/pikmin2/treasures/index.json'] + [
+        f'/api/pikmin2/treasures/rows-{shard}.json' for shard in range(num_shards)
+    ] + ['/search/index.json'] + [
+        f'/search/shard-{shard}.json' for shard in range(search_index.NUM_SHARDS)
+    ]
+
+def json_response(obj: Any, status: int = 200) -> flask.Response:
+    body = json.dumps(obj, ensure_ascii = False, separators = (',', ':'))
+    return flask.Response(body, status = status, mimetype = 'application/json')
+
+def parse_treasure_query(args: Any) -> dict[str, Any]:
+    '''
+    クエリ文字列を`TreasureStore.query`の引数にする
+    `location`・`series`は索引、`min_<列>`・`max_<列>`は範囲、それ以外の列名は値の一致で絞り込む
+    '''
+    query: dict[str, Any] = {'indexed': {}, 'equals': {}, 'ranges': {}}
+    for name in args:
+        values = args.getlist(name)
+        if name in ('sort', 'order'):
+            query[name] = values[-1]
+        elif name in ('offset', 'limit'):
+            query[name] = int(values[-1])
+        elif name in import_module('scripts.treasure_store').INDEXED_FILTERS:
+            query['indexed'][name] = values
+        elif name.startswith(('min_', 'max_')):
+            column = name[4:]
+            low, high = query['ranges'].get(column, (None, None))
+            if name.startswith('min_'):
+                low = float(values[-1])
+            else:
+                high = float(values[-1])
+            query['ranges'][column] = (low, high)
+        else:
+            query['equals'][name] = values
+    return query
+
+@app.route('/api/pikmin2/treasures', methods=['GET'])
+def treasures_api():
+    '''
+    お宝の絞り込み・並べ替え・ページ分け (例: `?location=Snagret Hole&sort=valuePerWeight&order=desc&limit=10`)
+    '''
+    store = get_treasure_store()
+    # クエリの誤りだけを400にする (描画中の例外は500として記録する)
+    try:
+        query = parse_treasure_query(flask.request.args)
+        store.check_query(**query)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    return conditional_response(
+        flask.request.full_path, get_cache_control('pikmin2'),
+        lambda: json_response(store.query(**query)),
+    )
+
+@app.route('/api/pikmin2/treasures/index.json', methods=['GET'])
+def treasures_api_index():
+    '''
+    静的なシャード用の索引 (列の型・並び順・場所とシリーズの索引)
+    '''
+    return conditional_response(
+        flask.request.path, get_cache_control('pikmin2'),
+        lambda: json_response(get_treasure_store().shard_index(TREASURE_SHARD_SIZE)),
+    )
+
+@app.route('/api/pikmin2/treasures/rows-<int:shard>.json', methods=['GET'])
+def treasures_api_rows(shard: int):
+    store = get_treasure_store()
+    if not 0 <= shard * TREASURE_SHARD_SIZE < store.num_rows:
+        flask.abort(404)
+    return conditional_response(
+        flask.request.path, get_cache_control('pikmin2'),
+        lambda: json_response(store.shard(shard, TREASURE_SHARD_SIZE)),
+    )
+
+@app.route('/search', methods=['GET'])
+def search():
+    '''
+    お宝・洞窟のステージの全文検索 (例: `/search?q=ヤブレ`)
+    '''
+    search_index = import_module('scripts.search_index')
+    query = flask.request.args.get('q', '')
+    try:
+        limit = int(flask.request.args.get('limit', search_index.MAX_RESULTS))
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    return conditional_response(
+        flask.request.full_path, get_cache_control(),
+        lambda: json_response(search_index.search(query, max(limit, 0))),
+    )
+
+@app.route('/search/index.json', methods=['GET'])
+def search_index_json():
+    '''
+    静的な検索用の文書の一覧 (n-gramの転置索引は`shard-<番号>.json`に分けて必要なものだけ読む)
+    '''
+    return conditional_response(
+        flask.request.path, get_cache_control(),
+        lambda: json_response(import_module('scripts.search_index').get_shard_meta()),
+    )
+
+@app.route('/search/shard-<int:shard>.json', methods=['GET'])
+def search_shard_json(shard: int):
+    search_index = import_module('scripts.search_index')
+    if not 0 <= shard < search_index.NUM_SHARDS:
+        flask.abort(404)
+    return conditional_response(
+        flask.request.path, get_cache_control(),
+        lambda: json_response(search_index.get_shard_postings(shard)),
+    )
+
+# 圧縮済みのレスポンスのキャッシュ (LRU)
+COMPRESSED_CACHE_SIZE = 64
+compressed_cache: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+compressed_cache_lock = threading.Lock()
+
+def get_compressed(data: bytes, encoding: str, etag: str | None) -> bytes:
+    '''
+    `data`を圧縮する (強いETagがあれば内容が同じとみなしてキャッシュを使う)
+    '''
+    if etag is None:
+        return compression.compress(data, encoding)
+    key = (etag, encoding)
+    with compressed_cache_lock:
+        compressed = compressed_cache.get(key)
+        if compressed is not None:
+            compressed_cache.move_to_end(key)
+    metrics.record_cache('compressed', compressed is not None)
+    if compressed is not None:
+        return compressed
+    compressed = compression.compress(data, encoding)
+    with compressed_cache_lock:
+        compressed_cache[key] = compressed
+        while len(compressed_cache) > COMPRESSED_CACHE_SIZE:
+            compressed_cache.popitem(last = False)
+    return compressed
+
+def get_precompressed_path(filename: str, encoding: str) -> Path | None:
+    '''
+    静的ファイルの隣の圧縮版 (`python -m scripts.compression`で作る)
+    ないか元のファイルより古ければ`None`
+    '''
+    path = safe_join(app.static_folder, filename)
+    if path is None:
+        return None
+    sibling = compression.get_sibling(Path(path), encoding)
+    try:
+        if sibling.stat().st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return sibling
+    except FileNotFoundError:
+        pass
+    return None
+
+@app.after_request
+def compress_response(response: flask.Response) -> flask.Response:
+    '''
+    `Accept-Encoding`に応じてHTML・CSS・JavaScript・JSONを圧縮して返す
+    静的ファイルは隣に圧縮版があればそれを返し、その場で圧縮するのは動的なページだけにする
+    '''
+    if response.mimetype not in compression.COMPRESSIBLE_MIMETYPES \
+            or response.status_code not in (200, 304) or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = flask.request.accept_encodings.best_match(list(compression.ENCODINGS))
+    if encoding is None:
+        return response
+    precompressed_path = None
+    if flask.request.endpoint == 'static':
+        precompressed_path = get_precompressed_path(flask.request.view_args['filename'], encoding)
+        if precompressed_path is None:
+            return response
+    etag, weak = response.get_etag()
+    if response.status_code == 200:
+        # 静的ファイルはファイルを直接返すレスポンスになっているので読み込む
+        response.direct_passthrough = False
+        if precompressed_path is not None:
+            response.set_data(precompressed_path.read_bytes())
+        else:
+            data = response.get_data()
+            if len(data) < compression.MIN_SIZE:
+                return response
+            with metrics.phase('compress'):
+                response.set_data(get_compressed(data, encoding, None if weak else etag))
+        response.headers['Content-Encoding'] = encoding
+    if etag is not None:
+        response.set_etag(f'{etag}-{encoding}', weak = weak)
+        if response.status_code == 200:
+            # 静的ファイルの304はflaskが元のETagで判定しているので、圧縮版のETagで判定し直す
+            response.make_conditional(flask.request)
+    return response
+
+@app.route('/debug/metrics', methods=['GET'])
+def debug_metrics():
+    '''
+    計測結果 (Prometheusのテキスト形式、`DEBUG_METRICS`が有効なときにローカルからのリクエストだけに返す)
+    '''
+    if not app.config['DEBUG_METRICS'] or flask.request.remote_addr not in METRICS_ALLOWED_ADDRS:
+        flask.abort(404)
+    return flask.Response(metrics.format_prometheus(), mimetype = 'text/plain; version=0.0.4')
 
 @app.errorhandler(404)
 def error_404(error):
-    return flask.render_template('404.html')
+    return flask.render_template('404.html'), 404
 
 if __name__ == "__main__":
+    # 開発用のサーバーでは計測結果を返す
+    app.config['DEBUG_METRICS'] = True
+    # デバッグ用のリローダーは監視用の親プロセスでもここを実行するので、配信する子プロセスでだけ事前生成する
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(debug = True)
\ No newline at end of file
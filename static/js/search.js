@@ -0,0 +1,115 @@
+/**
+ * 静的に書き出した全文検索の索引 (scripts/search_index.py) を使う検索
+ * 文書の一覧を最初に1度読み、n-gramの転置索引は検索語に必要なシャードだけ読む
+ */
+class SearchIndex{
+    _indexUrl;
+    _baseUrl;
+    /** @type {Promise<any> | undefined} */
+    _meta = undefined;
+    /** @type {Map<number, Promise<Object<string, number[]>>>} */
+    _shards = new Map();
+
+    /**
+     * @param {string} indexUrl `search/index.json`のURL
+     */
+    constructor(indexUrl){
+        this._indexUrl = indexUrl;
+        this._baseUrl = indexUrl.slice(0, indexUrl.lastIndexOf("/") + 1);
+    }
+
+    /**
+     * 全角・半角、大文字・小文字、カタカナ・ひらがなの違いをなくす (search_index.pyのnormalizeと同じ)
+     * @param {string} text
+     * @returns {string}
+     */
+    static normalize(text){
+        return text.normalize("NFKC").toLowerCase().replace(
+            /[ァ-ヶ]/g, c => String.fromCharCode(c.charCodeAt(0) - 0x60)
+        );
+    }
+
+    /**
+     * 検索語の1語を含む文書が必ず持つn-gram
+     * @param {string[]} chars
+     * @returns {string[]}
+     */
+    static queryNgrams(chars){
+        if(chars.length === 1) return [chars[0]];
+        const ngrams = [];
+        for(let i = 0; i + 1 < chars.length; i++){
+            ngrams.push(chars[i] + chars[i + 1]);
+        }
+        return ngrams;
+    }
+
+    /**
+     * @returns {Promise<any>}
+     */
+    _loadMeta(){
+        if(this._meta === undefined){
+            this._meta = fetch(this._indexUrl).then(response => response.json());
+        }
+        return this._meta;
+    }
+
+    /**
+     * @param {number} shard
+     * @returns {Promise<Object<string, number[]>>}
+     */
+    _loadShard(shard){
+        if(!this._shards.has(shard)){
+            this._shards.set(shard, fetch(`${this._baseUrl}shard-${shard}.json`).then(response => response.json()));
+        }
+        return this._shards.get(shard);
+    }
+
+    /**
+     * @param {string} ngram
+     * @returns {Promise<number[]>}
+     */
+    async _postings(ngram){
+        const meta = await this._loadMeta();
+        const shard = await this._loadShard(ngram.codePointAt(0) % meta.numShards);
+        return shard[ngram] ?? [];
+    }
+
+    /**
+     * 空白で区切った全ての語を含む文書 (サーバーの`/search`と同じ結果)
+     * @param {string} query
+     * @param {number} limit
+     * @returns {Promise<{total: number, results: {type: string, title: string, subtitle: string, url: string}[]}>}
+     */
+    async search(query, limit = 20){
+        const meta = await this._loadMeta();
+        const terms = SearchIndex.normalize(query).split(/\s+/).filter(term => term !== "");
+        /** @type {number[] | undefined} */
+        let docIds = undefined;
+        for(const term of terms){
+            const postings = await Promise.all(SearchIndex.queryNgrams(Array.from(term)).map(ngram => this._postings(ngram)));
+            postings.sort((a, b) => a.length - b.length);
+            const others = postings.slice(1).map(p => new Set(p));
+            const current = docIds === undefined ? undefined : new Set(docIds);
+            docIds = postings[0].filter(docId =>
+                others.every(p => p.has(docId))
+                && (current === undefined || current.has(docId))
+                && meta.documents[docId].text.includes(term)
+            );
+            if(docIds.length === 0) break;
+        }
+        if(docIds === undefined || docIds.length === 0){
+            return {total: 0, results: []};
+        }
+        // 本文はタイトルの項目から始まる
+        const ranked = docIds.map(docId => [!meta.documents[docId].text.startsWith(terms[0]), docId])
+            .sort((a, b) => (a[0] - b[0]) || (a[1] - b[1]))
+            .map(([_, docId]) => docId);
+        return {
+            total: ranked.length,
+            results: ranked.slice(0, limit).map(docId => {
+                const {type, title, subtitle, url} = meta.documents[docId];
+                return {type, title, subtitle, url};
+            }),
+        };
+    }
+}
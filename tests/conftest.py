@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+# `python -m pytest`でも`pytest`でもリポジトリ直下のモジュールをimportできるようにする
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import server
+
+# `create_app`を呼んでも全ページの事前生成を始めない (`test_server.py`で個別に確かめる)
+server.app.config['WARM_UP'] = False
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+import yaml
+
+from scripts import snapshot
+from scripts.cave_survey_results import ResultTable, SurveyResult, YamlLoader, parse_result_key, parse_simple_key
+
+@pytest.mark.parametrize(('key', 'expected'), [
+    ('{eggs: 3, elec: true}', {'eggs': 3, 'elec': True}),
+    ('{ room: circle , mitites: 2 }', {'room': 'circle', 'mitites': 2}),
+    ('{a: -3}', {'a': -3}),
+    ('{a: -0}', {'a': 0}),
+    ('{a_b: c_d}', {'a_b': 'c_d'}),
+])
+def test_simple_keys(key: str, expected: dict):
+    assert parse_simple_key(key) == expected
+    assert yaml.load(key, Loader = YamlLoader) == expected
+
+@pytest.mark.parametrize('key', [
+    # `:`の後に空白がなければYAMLでは1つの名前になる
+    '{b:2}',
+    # 重複した名前はYAMLでは後の値になる
+    '{a: 1, a: 2}',
+    # YAML 1.1の真偽値・null (名前でも値でも、大文字・小文字を問わない)
+    '{yes: 1}', '{On: 1}', '{a: yes}', '{a: on}', '{a: True}', '{a: FALSE}', '{a: null}', '{a: ~}',
+    # 8進数・16進数・区切り・60進数・小数
+    '{a: 012}', '{a: 09}', '{a: 0x1F}', '{a: 1_000}', '{a: 1:2}', '{a: 1.5}', '{a: 1e3}',
+    # 大文字やハイフンを含む文字列
+    '{a: Circle}', '{a: b-c}',
+    'eggs: 3', '{}',
+])
+def test_non_simple_keys_fall_back_to_yaml(key: str):
+    assert parse_simple_key(key) is None
+
+def test_parse_result_key_matches_yaml_for_all_data():
+    for stage_name, stage in snapshot.get_data('pikmin2-cave-surveys.yaml').items():
+        for key in stage['trial']['result']:
+            assert parse_result_key(key) == yaml.load(key, Loader = YamlLoader), (stage_name, key)
+
+@pytest.mark.parametrize('key', ['{b:2}', '{a: null}', '{a: 1.5}', '[1, 2]', '{}'])
+def test_parse_result_key_rejects_invalid_keys(key: str):
+    with pytest.raises(ValueError):
+        parse_result_key(key)
+
+def make_table() -> ResultTable:
+    # 軸 (eggs, elec, room) の件数 counts[i, j, k] = 100 * i + 10 * j + k
+    counts = 100 * np.arange(2)[:, None, None] + 10 * np.arange(3)[None, :, None] + np.arange(4)[None, None, :]
+    return ResultTable(('eggs', 'elec', 'room'), ((0, 1), (False, True, None), ('a', 'b', 'c', 'd')), counts)
+
+def test_marginalize_sums_axes():
+    table = make_table()
+    eggs = table.marginalize('elec', 'room')
+    assert eggs.axes == ('eggs',) and eggs.labels == ((0, 1),)
+    # Σ_j Σ_k (100i + 10j + k) = 1200i + 40·3 + 6·3
+    assert eggs.counts.tolist() == [0 + 120 + 18, 1200 + 120 + 18]
+    room = table.marginalize('eggs', 'elec')
+    assert room.axes == ('room',)
+    assert room.counts.tolist() == [sum(100 * i + 10 * j + k for i in range(2) for j in range(3)) for k in range(4)]
+    assert table.marginalize().counts.tolist() == table.counts.tolist()
+    assert table.marginalize('eggs', 'elec', 'room').counts == table.total()
+    with pytest.raises(KeyError):
+        table.marginalize('mitites')
+
+def test_slice_fixes_labels_and_keeps_axis_order():
+    table = make_table()
+    sliced = table.slice(elec = True)
+    assert sliced.axes == ('eggs', 'room')
+    assert sliced.labels == ((0, 1), ('a', 'b', 'c', 'd'))
+    assert sliced.counts.tolist() == [[10, 11, 12, 13], [110, 111, 112, 113]]
+    assert table.slice(eggs = 1, room = 'c').counts.tolist() == [102, 112, 122]
+    # 結果がないラベルは0
+    assert table.slice(room = 'z').counts.tolist() == [[0, 0, 0], [0, 0, 0]]
+
+def test_pivot_axis_order():
+    table = make_table()
+    pivot = table.pivot('room', 'eggs')
+    assert pivot.axes == ('room', 'eggs')
+    assert pivot.labels == (('a', 'b', 'c', 'd'), (0, 1))
+    assert pivot.counts.tolist() == [[30 + 3 * k, 330 + 3 * k] for k in range(4)]
+    combined = table.pivot(('eggs', 'elec'), 'room')
+    assert combined.axes == ('eggs,elec', 'room')
+    assert combined.labels[0] == ((0, False), (0, True), (0, None), (1, False), (1, True), (1, None))
+    assert combined.counts[4].tolist() == [110, 111, 112, 113]
+
+def test_flatten_labels():
+    table = ResultTable(('eggs', 'elec'), ((0, 1), (False, True)), np.array([[3, 0], [1, 2]]))
+    flat = table.flatten()
+    assert flat.axes == ('eggs,elec',)
+    assert flat.labels == (((0, False), (1, False), (1, True)),)
+    assert flat.counts.tolist() == [3, 1, 2]
+    everything = table.flatten(nonzero = False, key = lambda labels: (labels[1], -labels[0]))
+    assert everything.labels == (((1, False), (0, False), (1, True), (0, True)),)
+    assert everything.counts.tolist() == [1, 3, 2, 0]
+    empty = ResultTable(('eggs',), ((0,),), np.array([0])).flatten()
+    assert empty.labels == ((),) and empty.counts.tolist() == []
+
+def test_reindex_fills_missing_labels_with_zero():
+    table = make_table()
+    reindexed = table.reindex(room = ['d', 'x', 'a'], eggs = [1, 5])
+    assert reindexed.axes == table.axes
+    assert reindexed.labels == ((1, 5), (False, True, None), ('d', 'x', 'a'))
+    assert reindexed.counts[0].tolist() == [[103, 0, 100], [113, 0, 110], [123, 0, 120]]
+    assert not reindexed.counts[1].any()
+    assert table.select(eggs = [0], elec = [None], room = ['b']).tolist() == [[[21]]]
+    with pytest.raises(KeyError):
+        table.reindex(mitites = [0])
+
+def test_from_trial_builds_a_table_per_axis_set():
+    result = SurveyResult.from_trial({'seed': 0, 'num': 10, 'result': {
+        '{eggs: 1, elec: true}': 2, '{eggs: 0, elec: true}': 3, '{eggs: 1, elec: false}': 5,
+        '{room: circle}': 4, '{room: square}': 6,
+    }})
+    assert set(result.tables) == {frozenset({'eggs', 'elec'}), frozenset({'room'})}
+    table = result.table('elec', 'eggs')
+    assert table.labels == ((False, True), (0, 1))
+    assert table.counts.tolist() == [[0, 5], [3, 2]]
+    assert result.counts('room', ['square', 'circle', 'triangle']).tolist() == [6, 4, 0]
+
+@pytest.mark.parametrize(('result', 'message'), [
+    ({'{eggs: 1}': 4, '{eggs: 2}': 5}, 'sum to 9, but num is 10'),
+    ({'{eggs: 1}': 10, '{room: circle}': 3, '{room: square}': 3}, 'sum to 6, but num is 10'),
+    ({'{eggs: 1}': 5, '{ eggs: 1 }': 5}, 'duplicated result'),
+    ({'{eggs: 1}': 5, '{eggs: a}': 5}, 'mixed types'),
+])
+def test_from_trial_rejects_inconsistent_results(result: dict[str, int], message: str):
+    with pytest.raises(ValueError, match = message):
+        SurveyResult.from_trial({'seed': 0, 'num': 10, 'result': result})
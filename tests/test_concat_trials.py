@@ -0,0 +1,97 @@
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'tools'))
+
+import concat_trials
+
+DATA = '''\
+CH20-10:
+  name: 10
+  trial: {"seed": 0x00000000, "num": 0x00000004, "result": {"{a: true}": 4}}
+CH20-1:
+  name: 1
+  comment: "trial: not this one"
+  trial: {"seed": 0x00000000, "num": 0x00000002, "result": {"{a: true}": 1, "{a: false}": 1}}
+  note: kept
+NO-TRIAL:
+  name: none
+OTHER:
+  trial: {"seed": 0x00000000, "num": 0x00000001, "result": {"{a: true}": 1}}
+'''
+
+def shard(seed: int, num: int, result: dict[str, int]) -> dict:
+    return {'seed': seed, 'num': num, 'result': result}
+
+def test_read_stage_trial():
+    # `CH20-1`は`CH20-10`と区別し、ステージ内の`trial: `を含む他の値は読まない
+    assert concat_trials.read_stage_trial(DATA, 'CH20-1') == shard(0, 2, {'{a: true}': 1, '{a: false}': 1})
+    assert concat_trials.read_stage_trial(DATA, 'CH20-10')['num'] == 4
+
+def test_read_stage_trial_does_not_cross_stages():
+    assert concat_trials.read_stage_trial(DATA, 'NO-TRIAL') is None
+    assert concat_trials.read_stage_trial(DATA, 'MISSING') is None
+
+def test_write_stage_trial_replaces_only_that_line(tmp_path: Path):
+    path = tmp_path / 'surveys.yaml'
+    path.write_text(DATA, encoding = 'utf-8')
+    trial = shard(0, 0x10, {'{a: false}': 6, '{a: true}': 10})
+    concat_trials.write_stage_trial(path, 'CH20-1', trial)
+    text = path.read_text(encoding = 'utf-8')
+    expected = DATA.splitlines()
+    expected[6] = '  trial: ' + concat_trials.format_trial(trial)
+    assert text.splitlines() == expected
+    assert yaml.safe_load(text)['CH20-1']['trial'] == trial
+    assert list(tmp_path.iterdir()) == [path]
+
+def test_write_stage_trial_without_trial(tmp_path: Path):
+    path = tmp_path / 'surveys.yaml'
+    path.write_text(DATA, encoding = 'utf-8')
+    with pytest.raises(KeyError):
+        concat_trials.write_stage_trial(path, 'NO-TRIAL', shard(0, 1, {'{a: true}': 1}))
+    assert path.read_text(encoding = 'utf-8') == DATA
+
+def test_read_trials_stops_at_end():
+    lines = [
+        '{"seed": 0x00000000, "num": 0x00000001, "result": {"{a: true}": 1}}\n', '\n', 'end\n',
+        '{"seed": 0x00000001, "num": 0x00000001, "result": {"{a: true}": 1}}\n',
+    ]
+    assert list(concat_trials.read_trials(lines)) == [shard(0, 1, {'{a: true}': 1})]
+
+def test_interval_set_merges_adjacent_ranges():
+    intervals = concat_trials.IntervalSet()
+    for start, end in [(4, 6), (0, 2), (2, 4), (10, 12)]:
+        intervals.add(start, end)
+    assert list(intervals) == [(0, 6), (10, 12)]
+    assert intervals.contains(1, 5) and not intervals.contains(5, 11)
+    assert intervals.overlaps(5, 11) == [(5, 6), (10, 11)]
+    assert intervals.gaps(0, 14) == [(6, 10), (12, 14)]
+
+def test_merger_in_any_order_and_skips_duplicates():
+    merger = concat_trials.TrialMerger()
+    shards = [shard(2, 2, {'{a: true}': 2}), shard(0, 2, {'{a: true}': 1, '{a: false}': 1})]
+    for trial in shards + shards:
+        merger.add(trial)
+    assert merger.num_merged == 2 and merger.num_duplicates == 2
+    assert merger.to_trial() == shard(0, 4, {'{a: false}': 1, '{a: true}': 3})
+
+def test_merger_rejects_partial_overlaps_and_conflicts():
+    merger = concat_trials.TrialMerger(shard(0, 4, {'{a: true}': 4}))
+    assert not merger.add(shard(0, 2, {'{a: true}': 2}))
+    assert not merger.add(shard(2, 4, {'{a: true}': 4}))
+    assert merger.rejected == [(2, 6)]
+    with pytest.raises(ValueError):
+        merger.add(shard(0, 4, {'{a: true}': 3}))
+    with pytest.raises(ValueError):
+        merger.add(shard(concat_trials.SEED_SPACE - 1, 2, {'{a: true}': 2}))
+
+def test_merger_requires_contiguous_ranges():
+    merger = concat_trials.TrialMerger()
+    merger.add(shard(0, 2, {'{a: true}': 2}))
+    merger.add(shard(4, 2, {'{a: true}': 2}))
+    assert merger.gaps() == [(2, 4)]
+    with pytest.raises(ValueError):
+        merger.to_trial()
@@ -0,0 +1,49 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import freeze
+
+def test_parallel_build_writes_to_destination_under_spawn(tmp_path: Path):
+    '''
+    spawnで起動したワーカーも`docs/`ではなく指定した出力先に書き出す
+    '''
+    with ProcessPoolExecutor(1, mp_context = multiprocessing.get_context('spawn')) as pool:
+        url, _, size, written = pool.submit(freeze.build_page, '/', tmp_path).result()
+    assert url == '/' and written
+    assert (tmp_path / 'index.html').stat().st_size == size
+
+def test_not_found_page_is_written_to_destination(tmp_path: Path, monkeypatch):
+    monkeypatch.setitem(freeze.app.config, 'FREEZER_DESTINATION', str(tmp_path))
+    path = freeze.write_not_found_page()
+    assert path == tmp_path / '404.html'
+    assert '指定されたURLは見つかりませんでした' in path.read_text(encoding = 'utf-8')
+
+@pytest.mark.filterwarnings('ignore::flask_frozen.MissingURLGeneratorWarning')
+def test_default_freeze_skips_query_and_debug_routes(tmp_path: Path, monkeypatch):
+    # 引数のないルートを全て書き出すと、`api/pikmin2/treasures`がファイルになってディレクトリと衝突し、
+    # `/search`やローカルの計測結果 (`/debug/metrics`) も公開されてしまう
+    monkeypatch.setitem(freeze.app.config, 'FREEZER_DESTINATION', str(tmp_path))
+    urls = freeze.freezer.freeze()
+    assert {'/api/pikmin2/treasures', '/search', '/debug/metrics'}.isdisjoint(urls)
+    assert (tmp_path / 'api/pikmin2/treasures/index.json').is_file()
+    assert not (tmp_path / 'search').is_file() and not (tmp_path / 'debug').exists()
+    assert {url for url in urls if not url.startswith('/static/')} == set(freeze.get_page_urls())
+
+def test_incremental_build_skips_unchanged_pages(tmp_path: Path, monkeypatch, capsys):
+    monkeypatch.setitem(freeze.app.config, 'FREEZER_DESTINATION', str(tmp_path / 'docs'))
+    monkeypatch.setattr(freeze, 'MANIFEST_PATH', tmp_path / 'freeze-manifest.json')
+    urls = freeze.get_page_urls()
+    freeze.freeze_pages(2)
+    assert all((tmp_path / 'docs' / freeze.freezer.urlpath_to_filepath(url)).is_file() for url in urls)
+    assert f'{len(urls)}/{len(urls)} pages rendered' in capsys.readouterr().out
+    # 入力も出力も変わっていなければ何も描画しない
+    freeze.freeze_pages(2, incremental = True)
+    assert f'0/{len(urls)} pages rendered' in capsys.readouterr().out
+    # 出力を消したページだけ描画し直す
+    (tmp_path / 'docs/index.html').unlink()
+    freeze.freeze_pages(2, incremental = True)
+    output = capsys.readouterr().out
+    assert f'1/{len(urls)} pages rendered' in output and output.count(' ms ') == 1
@@ -0,0 +1,56 @@
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import flask.testing
+import pytest
+
+import server
+from scripts import image_variants
+
+@pytest.fixture
+def missing_manifest(monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    # 入力のパスはリポジトリからの相対パスで記録するので、build/に置く
+    path = image_variants.ROOT / 'build/test-missing-image-variants.json'
+    path.unlink(missing_ok = True)
+    monkeypatch.setattr(image_variants, 'MANIFEST_PATH', path)
+    monkeypatch.setattr(server, 'MANIFEST_PATHS', {**server.MANIFEST_PATHS, 'scripts.image_variants': path})
+    # 入力の一覧は`MANIFEST_PATHS`から作るので、前のテストで覚えた一覧を使わない
+    monkeypatch.setattr(server, 'validators_cache', OrderedDict())
+    monkeypatch.setattr(image_variants, '_manifest', None)
+    monkeypatch.setattr(image_variants, '_manifest_stamp', None)
+    def fail(*args, **kwargs):
+        raise AssertionError('variants were built during a request')
+    monkeypatch.setattr(image_variants, 'build', fail)
+    yield path
+    path.unlink(missing_ok = True)
+
+def test_original_image_without_manifest(missing_manifest: Path):
+    attrs = image_variants.get_image_attrs('images/CaveGen/SH-1/00000000.png', '../static', 480)
+    assert attrs == {'src': '../static/images/CaveGen/SH-1/00000000.png', 'loading': 'lazy', 'width': 480}
+    assert image_variants.get_webp_srcset('images/CaveGen/SH-1/00000000.png', '../static') is None
+    assert image_variants.get_manifest_stamp() == ()
+    assert not missing_manifest.exists()
+
+def test_pages_without_manifest(missing_manifest: Path):
+    client: flask.testing.FlaskClient = server.app.test_client()
+    for url in ['/pikmin2/treasures.html', '/pikmin2/cave-surveys/CH20-1.html']:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert '/images/variants/' not in response.get_data(as_text = True)
+
+def test_load_reads_manifest_once_across_threads(monkeypatch: pytest.MonkeyPatch, missing_manifest: Path):
+    missing_manifest.write_text(json.dumps({'pipeline': None, 'images': {}}), encoding = 'utf-8')
+    reads = []
+    read_manifest = image_variants.read_manifest
+    monkeypatch.setattr(image_variants, 'read_manifest', lambda: reads.append(1) or read_manifest())
+    with ThreadPoolExecutor(8) as pool:
+        manifests = list(pool.map(lambda _: image_variants.load(), range(64)))
+    assert len(reads) == 1
+    assert all(manifest is manifests[0] for manifest in manifests)
+
+def test_quotes_original_image_names():
+    attrs = image_variants.get_image_attrs('images/treasures/not in manifest #1.png', '../static')
+    assert attrs['src'] == '../static/images/treasures/not%20in%20manifest%20%231.png'
@@ -0,0 +1,42 @@
+import math
+
+import numpy as np
+import pytest
+
+from scripts import intervals, pikmin2_cave_surveys
+
+def test_wilson_known_values():
+    low, high = intervals.wilson(np.array([0, 5, 10]), 10)
+    assert low[0] == 0 and math.isclose(high[0], 0.2775, abs_tol = 1e-4)
+    assert math.isclose(low[1], 0.2366, abs_tol = 1e-4) and math.isclose(high[1], 0.7634, abs_tol = 1e-4)
+    assert math.isclose(low[2], 0.7225, abs_tol = 1e-4) and high[2] == 1
+
+def test_wilson_narrows_with_more_samples():
+    low, high = intervals.wilson(np.array([50, 5000]), np.array([100, 10000]))
+    assert (high - low)[1] < (high - low)[0] / 5
+    assert ((low < 0.5) & (0.5 < high)).all()
+
+def test_clopper_pearson_contains_wilson():
+    pytest.importorskip('scipy')
+    counts = np.array([1, 20, 99])
+    wilson_low, wilson_high = intervals.wilson(counts, 100)
+    low, high = intervals.clopper_pearson(counts, 100)
+    assert (low <= wilson_low + 1e-3).all() and (wilson_high - 1e-3 <= high).all()
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        intervals.interval(np.array([1]), 10, method = 'bayes')
+
+def test_relative_half_widths():
+    widths = intervals.relative_half_widths(np.array([0, 500, 50000]), 100000)
+    assert widths[0] == np.inf
+    assert widths[2] < widths[1] < 1
+
+def test_interval_strs_keep_bounds_apart():
+    # 4桁の有効数字では下限と上限が同じ文字列になる件数
+    counts = np.array([88820974, 45396754, 0, 1])
+    strs = pikmin2_cave_surveys.get_interval_strs(counts, 0x08000000)
+    for s in strs:
+        low, high = s.split('〜')
+        assert low != high
+    assert strs[0] == '66.169%〜66.185%'
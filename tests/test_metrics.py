@@ -0,0 +1,50 @@
+import pytest
+
+import server
+from scripts import metrics
+
+ROUTE = '/<category>/<page_name>.html'
+
+@pytest.fixture
+def failing_page(monkeypatch: pytest.MonkeyPatch):
+    def fail(category: str, page_name: str) -> str:
+        raise RuntimeError('broken page')
+    monkeypatch.setattr(server, 'render_page', fail)
+
+def get_error_count() -> int:
+    return metrics.error_counts.get(ROUTE, 0)
+
+def test_propagated_exception_is_counted(failing_page, monkeypatch: pytest.MonkeyPatch):
+    # `debug = True`と同じく例外を送出させると`after_request`は呼ばれない
+    monkeypatch.setitem(server.app.config, 'PROPAGATE_EXCEPTIONS', True)
+    before = get_error_count()
+    with pytest.raises(RuntimeError):
+        server.app.test_client().get('/pikmin2/treasures.html')
+    assert get_error_count() == before + 1
+    assert f'http_request_errors_total{{route="{ROUTE}"}} {before + 1}' in metrics.format_prometheus()
+
+def test_handled_exception_is_counted_once(failing_page, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(server.app.config, 'PROPAGATE_EXCEPTIONS', False)
+    before = get_error_count()
+    assert server.app.test_client().get('/pikmin2/treasures.html').status_code == 500
+    assert get_error_count() == before + 1
+
+def test_success_is_not_an_error():
+    before = get_error_count()
+    assert server.app.test_client().get('/pikmin2/treasures.html').status_code == 200
+    assert get_error_count() == before
+
+def test_server_timing_header():
+    response = server.app.test_client().get('/')
+    assert 'total;dur=' in response.headers['Server-Timing']
+
+def test_debug_metrics_is_off_by_default(monkeypatch: pytest.MonkeyPatch):
+    # テストクライアントは127.0.0.1から来るが、設定で有効にしない限り返さない
+    client = server.app.test_client()
+    assert client.get('/debug/metrics').status_code == 404
+    monkeypatch.setitem(server.app.config, 'DEBUG_METRICS', True)
+    response = client.get('/debug/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE http_request_duration_seconds histogram' in response.get_data(as_text = True)
+    assert client.get('/debug/metrics', environ_base = {'REMOTE_ADDR': '192.0.2.1'}).status_code == 404
@@ -0,0 +1,26 @@
+import math
+
+import numpy as np
+
+from scripts import mitites
+
+def test_binomial_pmf_matches_exact_values():
+    matrix = mitites.binomial_pmf_matrix(40)
+    for eggs in range(41):
+        for count in range(41):
+            expected = math.comb(eggs, count) * mitites.MITITES_PROB ** count \
+                * (1 - mitites.MITITES_PROB) ** (eggs - count) if count <= eggs else 0.
+            assert math.isclose(matrix[eggs, count], expected, rel_tol = 1e-9, abs_tol = 1e-300)
+
+def test_binomial_pmf_large_counts():
+    # `math.comb`をそのままfloatにすると1030個程度で溢れる
+    matrix = mitites.binomial_pmf_matrix(2000)
+    assert np.isfinite(matrix).all()
+    assert np.allclose(matrix.sum(axis = 1), 1)
+    assert math.isclose(matrix[2000] @ np.arange(2001), 2000 * mitites.MITITES_PROB)
+
+def test_total_mitites_convolves_sublevels():
+    distribution = mitites.total_mitites(mitites.fixed(2), mitites.from_counts([1, 1], 2))
+    assert len(distribution) == 4
+    assert math.isclose(distribution.sum(), 1)
+    assert np.allclose(distribution, 0.5 * mitites.binomial_pmf_matrix(3)[2] + 0.5 * mitites.binomial_pmf_matrix(3)[3])
@@ -0,0 +1,81 @@
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import flask.testing
+import pytest
+
+import server
+from scripts import pixel_arts, snapshot
+
+@pytest.fixture
+def missing_manifest(monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    # 入力のパスはリポジトリからの相対パスで記録するので、build/に置く
+    path = pixel_arts.ROOT / 'build/test-missing-pixel-arts.json'
+    path.unlink(missing_ok = True)
+    monkeypatch.setattr(pixel_arts, 'MANIFEST_PATH', path)
+    monkeypatch.setattr(server, 'MANIFEST_PATHS', {**server.MANIFEST_PATHS, 'scripts.pixel_arts': path})
+    # 入力の一覧は`MANIFEST_PATHS`から作るので、前のテストで覚えた一覧を使わない
+    monkeypatch.setattr(server, 'validators_cache', OrderedDict())
+    monkeypatch.setattr(pixel_arts, '_manifest', None)
+    monkeypatch.setattr(pixel_arts, '_manifest_stamp', None)
+    def fail(*args, **kwargs):
+        raise AssertionError('the atlas was built during a request')
+    monkeypatch.setattr(pixel_arts, 'build_atlases', fail)
+    yield path
+    path.unlink(missing_ok = True)
+
+def write_manifest(path: Path):
+    # 画像を読まずに作る小さなマニフェスト (縮小版の元の画像と、アトラスに詰めた画像1つ)
+    sources = {entry['source'] for entry in snapshot.get_data('pixel-arts-scaled.yaml').values()}
+    images = {
+        filename: {'stamp': [0, 0], 'name': pixel_arts.get_name(Path(filename).stem), 'width': 16, 'height': 16, 'atlas': None}
+        for filename in sources | {'Test_16x16.png'}
+    }
+    images['Test_16x16.png'].update(atlas = 0, x = 0, y = 0)
+    manifest = {
+        'version': pixel_arts.MANIFEST_VERSION, 'sources': {}, 'images': images,
+        'atlases': [{'file': 'test.png', 'width': 16, 'height': 16}],
+    }
+    path.write_text(json.dumps(manifest), encoding = 'utf-8')
+
+def test_load_without_manifest_fails_without_reading_images(monkeypatch: pytest.MonkeyPatch, missing_manifest: Path):
+    # リクエストの処理中には画像のディレクトリを見ない
+    def fail(*args, **kwargs):
+        raise AssertionError('the image directory was read during a request')
+    monkeypatch.setattr(pixel_arts, 'get_image_paths', fail)
+    monkeypatch.setattr(pixel_arts, 'read_images', fail)
+    with pytest.raises(FileNotFoundError, match = 'python -m scripts.pixel_arts'):
+        pixel_arts.load()
+    assert not missing_manifest.exists()
+
+def test_page_without_manifest(missing_manifest: Path):
+    client: flask.testing.FlaskClient = server.app.test_client()
+    response = client.get('/others/pixel-arts.html')
+    assert response.status_code == 500
+    with server.app.test_request_context('/'):
+        etag = server.get_validators('/others/pixel-arts.html')[0]
+    # マニフェストができたらETagが変わり、ページを表示できる
+    write_manifest(missing_manifest)
+    with server.app.test_request_context('/'):
+        assert server.get_validators('/others/pixel-arts.html')[0] != etag
+    response = client.get('/others/pixel-arts.html')
+    assert response.status_code == 200
+    assert 'pixel-art-atlas-' in response.get_data(as_text = True)
+
+def test_outdated_manifest_is_an_error(missing_manifest: Path):
+    missing_manifest.write_text('{"version": 0}')
+    with pytest.raises(FileNotFoundError, match = 'outdated'):
+        pixel_arts.load()
+
+def test_load_reads_manifest_once_across_threads(monkeypatch: pytest.MonkeyPatch, missing_manifest: Path):
+    write_manifest(missing_manifest)
+    reads = []
+    read_manifest = pixel_arts.read_manifest
+    monkeypatch.setattr(pixel_arts, 'read_manifest', lambda: reads.append(1) or read_manifest())
+    with ThreadPoolExecutor(8) as pool:
+        manifests = list(pool.map(lambda _: pixel_arts.load(), range(64)))
+    assert len(reads) == 1
+    assert all(manifest is manifests[0] for manifest in manifests)
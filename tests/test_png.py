@@ -0,0 +1,87 @@
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from scripts import png
+
+PIXEL_ARTS = sorted((Path(__file__).parent.parent / 'static/images/pixel-arts').glob('*.png'))
+
+def write(path: Path, data: bytes) -> Path:
+    path.write_bytes(data)
+    return path
+
+def make_images() -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:23, 0:37]
+    gradient = np.stack([x * 7, y * 11, x * y, np.full_like(x, 255)], axis = -1).astype(np.uint8)
+    palette = rng.integers(0, 256, (5, 4), dtype = np.uint8)
+    palette[:3, 3] = 255
+    return {
+        'rgba': rng.integers(0, 256, (17, 29, 4), dtype = np.uint8),
+        'opaque': gradient,
+        'palette': palette[rng.integers(0, 5, (19, 13))],
+        'single pixel': np.array([[[1, 2, 3, 0]]], dtype = np.uint8),
+    }
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('name', list(make_images()))
+def test_round_trip(tmp_path: Path, name: str, optimize: bool):
+    rgba = make_images()[name]
+    path = write(tmp_path / 'image.png', png.encode(rgba, optimize = optimize))
+    assert png.read_size(path) == (rgba.shape[1], rgba.shape[0])
+    assert np.array_equal(png.decode(path), rgba)
+
+def test_optimize_chooses_color_type():
+    color_types = {
+        name: png.parse_header(dict(png.iter_chunks(png.encode(rgba, optimize = True)))[b'IHDR'])[3]
+        for name, rgba in make_images().items()
+    }
+    assert color_types == {'rgba': 6, 'opaque': 2, 'palette': 3, 'single pixel': 3}
+
+@pytest.mark.parametrize('path', PIXEL_ARTS[:10], ids = lambda path: path.name)
+def test_repository_images_round_trip(tmp_path: Path, path: Path):
+    rgba = png.decode(path)
+    assert png.read_size(path) == (rgba.shape[1], rgba.shape[0])
+    assert np.array_equal(png.decode(write(tmp_path / path.name, png.encode(rgba, optimize = True))), rgba)
+
+@pytest.mark.parametrize('filter_type', range(5))
+def test_unfilter_each_filter_type(filter_type: int):
+    # 同じフィルタだけを使った行を戻すと元の画像になる
+    rng = np.random.default_rng(filter_type)
+    pixels = rng.integers(0, 256, (6, 8 * 3), dtype = np.uint8)
+    x = pixels.astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, 3:] = x[:, :-3]
+    b = np.zeros_like(x)
+    b[1:] = x[:-1]
+    c = np.zeros_like(x)
+    c[1:, 3:] = x[:-1, :-3]
+    p = a + b - c
+    pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    filtered = [x, x - a, x - b, x - (a + b) // 2, x - paeth][filter_type].astype(np.uint8)
+    rows = np.concatenate([np.full((6, 1), filter_type, dtype = np.uint8), filtered], axis = 1)
+    assert np.array_equal(png.unfilter(rows.tobytes(), 8, 6, 3), pixels)
+
+@pytest.mark.parametrize(('color_type', 'channels'), [(0, 1), (4, 2)])
+def test_decode_grayscale(tmp_path: Path, color_type: int, channels: int):
+    pixels = np.arange(3 * 4 * channels, dtype = np.uint8).reshape(3, 4 * channels) * 5
+    raw = np.concatenate([np.zeros((3, 1), dtype = np.uint8), pixels], axis = 1).tobytes()
+    data = png.SIGNATURE + png.make_chunk(b'IHDR', struct.pack('>IIBBBBB', 4, 3, 8, color_type, 0, 0, 0)) \
+        + png.make_chunk(b'IDAT', zlib.compress(raw)) + png.make_chunk(b'IEND', b'')
+    rgba = png.decode(write(tmp_path / 'gray.png', data))
+    gray = pixels.reshape(3, 4, channels)
+    assert np.array_equal(rgba[..., 0], gray[..., 0]) and np.array_equal(rgba[..., 2], gray[..., 0])
+    assert np.array_equal(rgba[..., 3], gray[..., 1] if channels == 2 else np.full((3, 4), 255))
+
+def test_invalid_files(tmp_path: Path):
+    with pytest.raises(ValueError):
+        png.read_size(write(tmp_path / 'text.png', b'not a png at all, just some text'))
+    with pytest.raises(ValueError):
+        png.decode(write(tmp_path / 'truncated.png', png.encode(np.zeros((2, 2, 4), dtype = np.uint8))[:-12]))
+    header = png.make_chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 16, 6, 0, 0, 0))
+    with pytest.raises(ValueError):
+        png.decode(write(tmp_path / '16bit.png', png.SIGNATURE + header + png.make_chunk(b'IEND', b'')))
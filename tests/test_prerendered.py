@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+
+from scripts import compression, prerendered
+
+def call(app: prerendered.PrerenderedApp, path: str, **environ: str) -> tuple[str, dict[str, str], bytes]:
+    result = {}
+    def start_response(status, headers):
+        result['status'], result['headers'] = status, dict(headers)
+    body = b''.join(app({'REQUEST_METHOD': 'GET', 'PATH_INFO': path, **environ}, start_response))
+    return result['status'], result['headers'], body
+
+@pytest.mark.parametrize(('accept_encoding', 'expected'), [
+    ('', None),
+    ('gzip', 'gzip'),
+    ('gzip;q=0', None),
+    ('gzip;q=0.0, identity', None),
+    ('GZIP ; Q=0.5', 'gzip'),
+    ('gzip;q=0.5, identity;q=0.8', None),
+    ('gzip;q=0.5, identity;q=0.5', 'gzip'),
+    ('*', next(iter(compression.ENCODINGS))),
+    ('*;q=0', None),
+    ('*, gzip;q=0', next((e for e in compression.ENCODINGS if e != 'gzip'), None)),
+    ('gzip;q=abc', None),
+])
+def test_choose_encoding(accept_encoding: str, expected: str | None):
+    assert prerendered.choose_encoding(accept_encoding) == expected
+
+def test_choose_encoding_ranks_by_quality(monkeypatch: pytest.MonkeyPatch):
+    '''
+    qの大きいものを選び、同じなら`compression.ENCODINGS`の順にする
+    '''
+    monkeypatch.setattr(compression, 'ENCODINGS', {'br': ('.br', None), 'gzip': ('.gz', None)})
+    prerendered.choose_encoding.cache_clear()
+    try:
+        assert prerendered.choose_encoding('gzip;q=1, br;q=0.5') == 'gzip'
+        assert prerendered.choose_encoding('gzip;q=0.5, br;q=1') == 'br'
+        assert prerendered.choose_encoding('gzip, br') == 'br'
+    finally:
+        prerendered.choose_encoding.cache_clear()
+
+def test_docs_serves_frozen_not_found_page(tmp_path: Path):
+    (tmp_path / 'index.html').write_bytes(b'<p>index</p>')
+    (tmp_path / prerendered.NOT_FOUND_FILE).write_bytes(b'<p>frozen 404</p>')
+    app = prerendered.create_app(tmp_path)
+    status, headers, body = call(app, '/missing.html')
+    assert status.startswith('404')
+    assert body == b'<p>frozen 404</p>'
+    assert headers['Content-Type'].startswith('text/html')
+    assert call(app, '/')[2] == b'<p>index</p>'
+
+def test_docs_without_not_found_page_renders_template(tmp_path: Path):
+    (tmp_path / 'index.html').write_bytes(b'<p>index</p>')
+    status, _, body = call(prerendered.create_app(tmp_path), '/missing.html')
+    assert status.startswith('404')
+    assert '指定されたURLは見つかりませんでした' in body.decode('utf-8')
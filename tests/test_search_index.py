@@ -0,0 +1,50 @@
+import pytest
+
+import server
+from scripts import search_index
+
+@pytest.mark.parametrize('text, normalized', [
+    ('ＡＢＣ', 'abc'),
+    ('Cupid\'s GRENADE', 'cupid\'s grenade'),
+    ('ヤブレカブレ', 'やぶれかぶれ'),
+    ('ｶﾞﾗｸﾀ', 'がらくた'),
+    ('ヴヵヶ', 'ゔゕゖ'),
+    ('①　２', '1 2'),
+])
+def test_normalize(text: str, normalized: str):
+    assert search_index.normalize(text) == normalized
+
+def test_ngrams():
+    assert search_index.get_ngrams('ab c') == {'a', 'b', 'ab', 'c'}
+    assert search_index.get_query_ngrams('a') == {'a'}
+    assert search_index.get_query_ngrams('abc') == {'ab', 'bc'}
+
+def test_search_ignores_width_case_and_kana():
+    expected = search_index.search('やぶれ')
+    assert expected['total'] > 0
+    for query in ['ヤブレ', 'ﾔﾌﾞﾚ', ' ヤブレ ']:
+        assert search_index.search(query)['results'] == expected['results']
+    assert search_index.search('GRENADE')['results'] == search_index.search('grenade')['results']
+
+def test_search_requires_every_term():
+    assert search_index.search('ヤブレ 存在しない語')['total'] == 0
+    assert search_index.search('')['total'] == 0
+
+def test_search_route():
+    client = server.app.test_client()
+    assert client.get('/search?q=ヤブレ&limit=1').get_json()['results'][0]['title'] == 'ヤブレカブレ'
+    assert client.get('/search?q=a&limit=x').status_code == 400
+
+def test_shards_partition_postings():
+    # 静的に書き出したシャードを全て合わせると索引と同じになり、各n-gramは1つのシャードにだけ入る
+    client = server.app.test_client()
+    index = search_index.load()
+    meta = client.get('/search/index.json').get_json()
+    assert meta['documents'] == index['documents']
+    postings = {}
+    for shard in range(meta['numShards']):
+        shard_postings = client.get(f'/search/shard-{shard}.json').get_json()
+        assert all(search_index.get_shard(ngram) == shard for ngram in shard_postings)
+        postings.update(shard_postings)
+    assert postings == index['postings']
+    assert client.get(f'/search/shard-{meta["numShards"]}.json').status_code == 404
@@ -0,0 +1,189 @@
+import gzip
+import os
+import re
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import flask
+import flask.testing
+import pytest
+
+import server
+from scripts import compression
+
+ROOT = Path(server.__file__).parent
+SCRIPTS_DIR = ROOT / 'scripts'
+
+def test_code_dependencies_include_imported_names():
+    # `from scripts.cave_survey_results import ResultTable`のようにクラスだけimportしたモジュールも含む
+    dependencies = server.get_code_dependencies('pikmin2', 'cave-surveys')
+    assert SCRIPTS_DIR / 'cave_survey_results.py' in dependencies
+    assert SCRIPTS_DIR / 'intervals.py' in dependencies
+
+def test_code_dependencies_are_transitive():
+    dependencies = server.get_code_dependencies('others', 'pixel-arts')
+    assert SCRIPTS_DIR / 'pixel_arts.py' in dependencies
+    assert SCRIPTS_DIR / 'file_hashes.py' in dependencies
+    assert all(path.suffix == '.py' for path in dependencies)
+
+@pytest.fixture
+def client() -> flask.testing.FlaskClient:
+    return server.app.test_client()
+
+def get_image_prefixes(html: str) -> set[str]:
+    return set(re.findall(r'src="([^"]*?)images/', html))
+
+def test_stage_images_resolve_to_static(client: flask.testing.FlaskClient):
+    # `/pikmin2/cave-surveys/CH20-1.html`は1階層深いので、`../static/`では`/pikmin2/static/`になってしまう
+    response = client.get('/pikmin2/cave-surveys/CH20-1.html')
+    assert response.status_code == 200
+    assert get_image_prefixes(response.get_data(as_text = True)) == {'../../static/'}
+    page = client.get('/pikmin2/cave-surveys.html')
+    assert get_image_prefixes(page.get_data(as_text = True)) == {'../static/'}
+
+def test_stage_is_conditional(client: flask.testing.FlaskClient):
+    response = client.get('/pikmin2/cave-surveys/CH20-1.html')
+    etag = response.headers['ETag']
+    assert client.get('/pikmin2/cave-surveys/CH20-1.html', headers = {'If-None-Match': etag}).status_code == 304
+    assert client.get('/pikmin2/cave-surveys/NOPE.html').status_code == 404
+
+def test_page_etag_and_not_modified(client: flask.testing.FlaskClient):
+    response = client.get('/pikmin2/treasures.html')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get('/pikmin2/treasures.html', headers = {'If-None-Match': etag}).status_code == 304
+    assert client.get('/pikmin2/treasures.html', headers = {'If-None-Match': '"other"'}).status_code == 200
+    # 圧縮版のETagでも一致とみなす
+    assert client.get('/pikmin2/treasures.html', headers = {'If-None-Match': etag[:-1] + '-gzip"'}).status_code == 304
+
+def test_validators_are_memoized(monkeypatch: pytest.MonkeyPatch):
+    with server.app.test_request_context('/'):
+        etag, _ = server.get_validators('/others/pixel-arts.html')
+        def fail(*args):
+            raise AssertionError('dependencies were recomputed')
+        monkeypatch.setattr(server, 'get_page_dependencies', fail)
+        monkeypatch.setattr(server, 'get_template_dependencies', fail)
+        assert server.get_validators('/others/pixel-arts.html')[0] == etag
+
+def test_validators_cache_is_bounded(monkeypatch: pytest.MonkeyPatch, client: flask.testing.FlaskClient):
+    # クエリ文字列ごとにURLが変わるAPIにいくらリクエストしても、キャッシュは上限を超えない
+    monkeypatch.setattr(server, 'VALIDATORS_CACHE_SIZE', 8)
+    monkeypatch.setattr(server, 'validators_cache', OrderedDict())
+    for i in range(50):
+        assert client.get(f'/api/pikmin2/treasures?limit={i + 1}').status_code == 200
+    assert len(server.validators_cache) == 8
+    assert ('/api/pikmin2/treasures?limit=50', '') in server.validators_cache
+    # 最近使ったものは追い出されない
+    client.get('/api/pikmin2/treasures?limit=43')
+    client.get('/search?q=a')
+    assert ('/api/pikmin2/treasures?limit=43', '') in server.validators_cache
+    assert ('/api/pikmin2/treasures?limit=44', '') not in server.validators_cache
+
+def test_validators_do_not_import_generator():
+    # 別のプロセスで、生成モジュール (とnumpy) をimportせずにETagを求められることを確かめる
+    code = (
+        'import sys, server\n'
+        'with server.app.test_request_context("/"):\n'
+        '    server.get_validators("/others/pixel-arts.html")\n'
+        'print("scripts.pixel_arts" in sys.modules, "numpy" in sys.modules)\n'
+    )
+    completed = subprocess.run([sys.executable, '-c', code], cwd = ROOT, capture_output = True, text = True, check = True)
+    assert completed.stdout.split() == ['False', 'False']
+
+def test_manifest_paths_match_modules():
+    from scripts import image_variants, pixel_arts
+    assert server.MANIFEST_PATHS['scripts.pixel_arts'] == pixel_arts.MANIFEST_PATH
+    assert server.MANIFEST_PATHS['scripts.image_variants'] == image_variants.MANIFEST_PATH
+
+@pytest.fixture
+def static_folder(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(server.app, 'static_folder', str(tmp_path))
+    (tmp_path / 'main.css').write_text('body { color: black; }\n' * 50)
+    return tmp_path
+
+def test_static_serves_precompressed_sibling(client: flask.testing.FlaskClient, static_folder: Path):
+    # 隣の`.gz`をそのまま返していることが分かるよう、圧縮し直すと異なる内容にする
+    sibling = compression.get_sibling(static_folder / 'main.css', 'gzip')
+    sibling.write_bytes(gzip.compress(b'precompressed'))
+    response = client.get('/static/main.css', headers = {'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == b'precompressed'
+    etag = response.headers['ETag']
+    response.close()
+    assert etag.endswith('-gzip"')
+    assert client.get('/static/main.css', headers = {'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+def test_static_without_sibling_is_not_compressed(client: flask.testing.FlaskClient, static_folder: Path):
+    response = client.get('/static/main.css', headers = {'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    response.close()
+    # 元のファイルより古い圧縮版は使わない
+    sibling = compression.get_sibling(static_folder / 'main.css', 'gzip')
+    sibling.write_bytes(gzip.compress(b'stale'))
+    os.utime(sibling, ns = (0, 0))
+    response = client.get('/static/main.css', headers = {'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    response.close()
+
+def test_dynamic_page_is_compressed(client: flask.testing.FlaskClient):
+    response = client.get('/pikmin2/treasures.html', headers = {'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()).startswith(b'<head')
+
+def test_create_app_starts_warm_up_once(monkeypatch: pytest.MonkeyPatch, client: flask.testing.FlaskClient):
+    # 最初のリクエストを待たずに起動時に始め、何度呼ばれても1度だけ始める
+    calls = []
+    monkeypatch.setattr(server, 'start_warm_up', lambda: calls.append(threading.current_thread()))
+    monkeypatch.setattr(server, 'warm_up_started', False)
+    monkeypatch.setitem(server.app.config, 'WARM_UP', True)
+    with ThreadPoolExecutor(4) as pool:
+        apps = list(pool.map(lambda _: server.create_app(), range(8)))
+    assert apps == [server.app] * 8
+    assert len(calls) == 1
+    assert client.get('/').status_code == 200
+    assert len(calls) == 1
+
+def test_requests_do_not_start_warm_up(monkeypatch: pytest.MonkeyPatch, client: flask.testing.FlaskClient):
+    calls = []
+    monkeypatch.setattr(server, 'start_warm_up', lambda: calls.append(1))
+    monkeypatch.setattr(server, 'warm_up_started', False)
+    monkeypatch.setitem(server.app.config, 'WARM_UP', True)
+    client.get('/')
+    assert calls == []
+
+def test_warm_up_can_be_disabled(monkeypatch: pytest.MonkeyPatch):
+    calls = []
+    monkeypatch.setattr(server, 'start_warm_up', lambda: calls.append(1))
+    monkeypatch.setattr(server, 'warm_up_started', False)
+    assert server.create_app() is server.app
+    assert calls == []
+
+def test_compressed_cache_is_thread_safe(monkeypatch: pytest.MonkeyPatch):
+    # キャッシュより多いキーを並行に出し入れしても、追い出しと読み出しが競合しない
+    monkeypatch.setattr(server, 'COMPRESSED_CACHE_SIZE', 4)
+    data = b'pikmin ' * 100
+    def compress(i: int) -> bytes:
+        return server.get_compressed(data, 'gzip', f'etag-{i % 16}')
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(compress, range(2000)))
+    assert all(gzip.decompress(result) == data for result in results)
+    assert len(server.compressed_cache) <= 4
+
+def test_stage_cache_is_thread_safe(monkeypatch: pytest.MonkeyPatch):
+    from scripts import pikmin2_cave_surveys, snapshot
+    monkeypatch.setattr(pikmin2_cave_surveys, 'STAGE_CACHE_SIZE', 2)
+    monkeypatch.setattr(pikmin2_cave_surveys, 'stage_cache', OrderedDict())
+    monkeypatch.setattr(pikmin2_cave_surveys, 'render_stage_uncached', lambda name, stage: name)
+    stages = list(snapshot.get_data('pikmin2-cave-surveys.yaml').items())[:6]
+    def render(i: int) -> str:
+        stage_name, stage = stages[i % len(stages)]
+        with server.app.test_request_context('/'):
+            return pikmin2_cave_surveys.render_stage(stage_name, stage)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(render, range(1200)))
+    assert results == [stages[i % len(stages)][0] for i in range(1200)]
+    assert len(pikmin2_cave_surveys.stage_cache) <= 2
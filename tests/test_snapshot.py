@@ -0,0 +1,21 @@
+import pytest
+
+from scripts import file_hashes, snapshot
+
+def test_uses_shared_stamp_helper():
+    assert snapshot.get_stamp is file_hashes.get_stamp
+
+def test_load_without_check_does_not_stat_sources(monkeypatch: pytest.MonkeyPatch):
+    snapshot.load()
+    def fail(*args):
+        raise AssertionError('sources were checked')
+    monkeypatch.setattr(snapshot, 'is_fresh', fail)
+    assert snapshot.get_data('pikmin2-treasures.yaml', check = False)
+    with pytest.raises(AssertionError):
+        snapshot.get_data('pikmin2-treasures.yaml')
+
+def test_validators_reject_bad_data():
+    with pytest.raises(ValueError):
+        snapshot.validate_treasures([{'imagePath': 'a.png', 'enName': 'A', 'location': 'X', 'weight': '1'}])
+    with pytest.raises(ValueError):
+        snapshot.validate_cave_surveys({'FC-4': {'name': 'x', 'trial': {'seed': 0, 'num': 2, 'result': {'{a: 1}': 3}}}})
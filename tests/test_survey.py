@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'tools'))
+
+import survey
+
+SHARD = 0x01000000
+
+def test_unseen_known_outcome_is_not_precise():
+    # SR-7のように珍しい結果がまだ出ていない最初のシャードでは打ち切らない
+    trial = {'seed': 0, 'num': SHARD, 'result': {'{kemekuji: true}': SHARD}}
+    assert not survey.is_precise(trial, 0.01, known_keys = ['{kemekuji: false}', '{kemekuji: true}'])
+
+def test_unseen_bool_value_is_not_precise():
+    # 既存の`trial`がなくても、真偽値の軸の片方しか出ていなければ打ち切らない
+    trial = {'seed': 0, 'num': SHARD, 'result': {'{kemekuji: true}': SHARD}}
+    assert not survey.is_precise(trial, 0.01)
+    assert list(survey.get_outcome_counts(trial)) == [SHARD, SHARD, 0]
+
+def test_precise_when_every_outcome_is_frequent():
+    trial = {'seed': 0, 'num': SHARD, 'result': {'{oogane: true}': SHARD // 2, '{oogane: false}': SHARD // 2}}
+    assert survey.is_precise(trial, 0.01, known_keys = ['{oogane: true}'])
+    counts = {'{eggs: 0}': SHARD // 2, '{eggs: 1}': SHARD // 2}
+    assert survey.is_precise({'seed': 0, 'num': SHARD, 'result': counts}, 0.01)
+    assert not survey.is_precise({'seed': 0, 'num': SHARD, 'result': counts}, 0.01, known_keys = ['{eggs: 5}'])
+
+def test_get_prefix_stops_at_first_gap():
+    shards = survey.split_shards(0, 4 * SHARD, SHARD)
+    results = {shards[0]: {'num': SHARD}, shards[2]: {'num': SHARD}}
+    assert survey.get_prefix(shards, results) == [{'num': SHARD}]
@@ -0,0 +1,64 @@
+import flask.testing
+import pytest
+
+import server
+from scripts import treasure_store
+
+@pytest.fixture
+def client() -> flask.testing.FlaskClient:
+    return server.app.test_client()
+
+@pytest.mark.parametrize('query, message', [
+    ('sort=noSuchColumn', "unknown column 'noSuchColumn'"),
+    ('noSuchColumn=1', "unknown column 'noSuchColumn'"),
+    ('min_noSuchColumn=1', "unknown column 'noSuchColumn'"),
+    ('order=up', 'order must be "asc" or "desc", got \'up\''),
+    ('min_location=1', "column 'location' is not numeric"),
+    ('limit=0', f'offset must be >= 0 and limit must be in [1, {treasure_store.MAX_LIMIT}]'),
+    (f'limit={treasure_store.MAX_LIMIT + 1}', f'offset must be >= 0 and limit must be in [1, {treasure_store.MAX_LIMIT}]'),
+    ('offset=-1', f'offset must be >= 0 and limit must be in [1, {treasure_store.MAX_LIMIT}]'),
+])
+def test_invalid_query_is_400(client: flask.testing.FlaskClient, query: str, message: str):
+    response = client.get(f'/api/pikmin2/treasures?{query}')
+    assert response.status_code == 400
+    # KeyErrorのメッセージも`repr`で二重に引用しない
+    assert response.get_json() == {'error': message}
+
+@pytest.mark.parametrize('query', ['limit=ten', 'offset=1.5', 'max_weight=heavy', 'weight=heavy'])
+def test_unparsable_number_is_400(client: flask.testing.FlaskClient, query: str):
+    response = client.get(f'/api/pikmin2/treasures?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_query_filters_and_sorts(client: flask.testing.FlaskClient):
+    response = client.get('/api/pikmin2/treasures?min_weight=50&sort=valuePerWeight&order=desc&limit=5')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert 0 < len(result['items']) <= 5
+    assert all(item['weight'] >= 50 for item in result['items'])
+    ratios = [item['valuePerWeight'] for item in result['items']]
+    assert ratios == sorted(ratios, reverse = True)
+
+@pytest.mark.parametrize('error', [KeyError('jpName'), ValueError(), IndexError(3)])
+def test_internal_error_is_500(monkeypatch: pytest.MonkeyPatch, client: flask.testing.FlaskClient, error: Exception):
+    # 描画中の例外はクエリの誤りではないので400にしない
+    def fail(self, **query):
+        raise error
+    monkeypatch.setattr(treasure_store.TreasureStore, 'query', fail)
+    assert client.get('/api/pikmin2/treasures?limit=3').status_code == 500
+
+def test_search_internal_error_is_500(monkeypatch: pytest.MonkeyPatch, client: flask.testing.FlaskClient):
+    from scripts import search_index
+    def fail(query, limit):
+        raise ValueError()
+    monkeypatch.setattr(search_index, 'search', fail)
+    assert client.get('/search?q=a').status_code == 500
+    assert client.get('/search?q=a&limit=x').status_code == 400
+
+def test_check_query():
+    store = server.get_treasure_store()
+    store.check_query(equals = {'weight': ['20']}, ranges = {'value': (1, None)}, sort = 'jpName')
+    with pytest.raises(treasure_store.QueryError, match = 'unknown filter'):
+        store.check_query(indexed = {'color': ['red']})
+    with pytest.raises(treasure_store.QueryError, match = 'is numeric'):
+        store.check_query(equals = {'weight': ['heavy']})
@@ -0,0 +1,305 @@
+'''
+ベンチマーク
+
+生成モジュール・表の組み立てを実データと大きな合成データで、サーバーの起動 (import、`/`を返すまで) とfreeze.py全体をサブプロセスで計測する
+結果はJSONに書き出し、保存したベースラインより遅くなったものがあれば終了コード1で終わる
+
+使い方:
+    python tools/benchmark.py                    # 計測してベースラインと比較
+    python tools/benchmark.py --save-baseline    # 計測結果をベースライン (tools/benchmark-baseline.json) として保存
+    python tools/benchmark.py --only cave_surveys --skip-freeze
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from werkzeug.test import EnvironBuilder
+
+from server import app
+from scripts import pikmin2_cave_surveys, pikmin2_treasures, pixel_arts, prerendered, snapshot
+from scripts.cave_survey_results import SurveyResult
+from import_profile import run_child
+
+OUTPUT_PATH = ROOT / 'build/benchmark.json'
+# リポジトリにコミットするベースライン (性能が変わる変更と一緒に`--save-baseline`で更新する)
+BASELINE_PATH = Path(__file__).parent / 'benchmark-baseline.json'
+# ベースラインよりこの割合以上遅ければ性能の低下とみなす
+DEFAULT_TOLERANCE = 0.2
+# 合成データの乱数のシード (毎回同じ入力にする)
+SEED = 0
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    '''
+    `func`を`repeat`回実行し、最速の1回の秒数を返す
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# ベンチマークの名前 -> (計測する関数, 繰り返す回数)
+BENCHMARKS: dict[str, tuple[Callable[[int], float], int]] = {}
+
+def benchmark(name: str, repeat: int = 10) -> Callable[[Callable[[int], float]], Callable[[int], float]]:
+    '''
+    `repeat`を受け取って秒数を返す関数を登録するデコレータ
+    '''
+    def register(func: Callable[[int], float]) -> Callable[[int], float]:
+        BENCHMARKS[name] = (func, repeat)
+        return func
+    return register
+
+def make_synthetic_treasures(num_rows: int) -> list[dict[str, Any]]:
+    '''
+    実データの行を繰り返し、名前と数値を変えた`num_rows`行のお宝
+    '''
+    rng = np.random.default_rng(SEED)
+    treasures = snapshot.get_data('pikmin2-treasures.yaml')
+    rows = []
+    for i in range(num_rows):
+        treasure = dict(treasures[i % len(treasures)])
+        treasure['enName'] = f'{treasure["enName"]} #{i}'
+        treasure['value'] = int(rng.integers(5, 300))
+        treasure['weight'] = int(rng.integers(1, 100))
+        rows.append(treasure)
+    return rows
+
+@benchmark('treasures.generate')
+def bench_treasures(repeat: int) -> float:
+    data = snapshot.get_data('pikmin2-treasures.yaml')
+    with app.test_request_context():
+        return measure(lambda: pikmin2_treasures.generate(data), repeat)
+
+@benchmark('treasures.render_with_soup', repeat = 3)
+def bench_treasures_soup(repeat: int) -> float:
+    data = snapshot.get_data('pikmin2-treasures.yaml')
+    with app.test_request_context():
+        # 旧実装と同じマークアップであることも確かめる
+        assert ''.join(pikmin2_treasures.stream(data)) == pikmin2_treasures.render_with_soup(data)
+        return measure(lambda: pikmin2_treasures.render_with_soup(data), repeat)
+
+@benchmark('treasures.generate_synthetic_5000', repeat = 3)
+def bench_treasures_synthetic(repeat: int) -> float:
+    data = make_synthetic_treasures(5000)
+    with app.test_request_context():
+        return measure(lambda: pikmin2_treasures.generate(data), repeat)
+
+@benchmark('cave_surveys.generate_cold', repeat = 3)
+def bench_cave_surveys_cold(repeat: int) -> float:
+    data = snapshot.get_data('pikmin2-cave-surveys.yaml')
+    def generate():
+        pikmin2_cave_surveys.stage_cache.clear()
+        pikmin2_cave_surveys.generate(data)
+    with app.test_request_context():
+        return measure(generate, repeat)
+
+@benchmark('cave_surveys.generate_cached')
+def bench_cave_surveys_cached(repeat: int) -> float:
+    data = snapshot.get_data('pikmin2-cave-surveys.yaml')
+    with app.test_request_context():
+        pikmin2_cave_surveys.generate(data)
+        return measure(lambda: pikmin2_cave_surveys.generate(data), repeat)
+
+@benchmark('pixel_arts.generate')
+def bench_pixel_arts(repeat: int) -> float:
+    manifest = pixel_arts.build()
+    scaled = snapshot.get_data('pixel-arts-scaled.yaml')
+    with app.test_request_context():
+        return measure(lambda: pixel_arts.generate(manifest, scaled), repeat)
+
+@benchmark('create_table_200x50')
+def bench_create_table(repeat: int) -> float:
+    rng = np.random.default_rng(SEED)
+    # 縦に同じ値が続く列 (rowspanでまとめられる) と、ばらばらの値の列を混ぜる
+    array = rng.integers(0, 1000, size = (200, 50)).astype(str).astype(object)
+    array[:, ::5] = (np.arange(200)[:, None] // 10).astype(str)
+    array[:, 1::7] = ''
+    background_color = np.where(rng.random((200, 50)) < 0.1, '#ffeeee', '').astype(object)
+    return measure(lambda: pikmin2_cave_surveys.create_table(array, background_color = background_color), repeat)
+
+@benchmark('create_count_table2d_200x50')
+def bench_create_count_table2d(repeat: int) -> float:
+    rng = np.random.default_rng(SEED)
+    counts = rng.integers(0, 1 << 20, size = (200, 50))
+    xlabels = list(range(50))
+    ylabels = [f'row {i}' for i in range(200)]
+    return measure(
+        lambda: pikmin2_cave_surveys.create_count_table2d(counts, xlabels, ylabels, title = '縦＼横'),
+        repeat,
+    )
+
+# WSGIアプリを直接呼ぶベンチマークの1回あたりのリクエスト数
+NUM_REQUESTS = 1000
+WSGI_URL = '/pikmin2/treasures.html'
+
+def call_wsgi(wsgi_app: Callable[..., Any], environ: dict[str, Any]):
+    '''
+    サーバーを介さずにWSGIアプリを呼び、本文を読み切る
+    '''
+    response = wsgi_app(dict(environ), lambda status, headers, exc_info = None: None)
+    for _ in response:
+        pass
+    if hasattr(response, 'close'):
+        response.close()
+
+def measure_wsgi(wsgi_app: Callable[..., Any], repeat: int) -> float:
+    environ = EnvironBuilder(WSGI_URL, headers = {'Accept-Encoding': 'gzip'}).get_environ()
+    call_wsgi(wsgi_app, environ)
+    return measure(lambda: [call_wsgi(wsgi_app, environ) for _ in range(NUM_REQUESTS)], repeat)
+
+@benchmark(f'wsgi.flask_{NUM_REQUESTS}_requests', repeat = 3)
+def bench_wsgi_flask(repeat: int) -> float:
+    '''
+    `page()`のルート (生成・圧縮はキャッシュ済み)
+    '''
+    return measure_wsgi(app.wsgi_app, repeat)
+
+@benchmark(f'wsgi.prerendered_{NUM_REQUESTS}_requests', repeat = 3)
+def bench_wsgi_prerendered(repeat: int) -> float:
+    return measure_wsgi(prerendered.create_app(render = True), repeat)
+
+def make_synthetic_trial(shape: tuple[int, ...]) -> dict[str, Any]:
+    '''
+    軸`a`, `b`, ...の全ての組み合わせに乱数の件数を持つ`trial`
+    '''
+    rng = np.random.default_rng(SEED)
+    axes = [chr(ord('a') + i) for i in range(len(shape))]
+    result = {}
+    for index in np.ndindex(*shape):
+        key = '{' + ', '.join(f'{axis}: {i}' for axis, i in zip(axes, index)) + '}'
+        result[key] = int(rng.integers(0, 1 << 20))
+    return {'seed': 0, 'num': sum(result.values()), 'result': result}
+
+@benchmark('cave_surveys.crosstab_10x10x10x5', repeat = 3)
+def bench_crosstab(repeat: int) -> float:
+    '''
+    5000通りの組み合わせの結果を解析し、2軸ずつにまとめた表を作る
+    '''
+    trial = make_synthetic_trial((10, 10, 10, 5))
+    def crosstab():
+        table = SurveyResult.from_trial(trial).table('a', 'b', 'c', 'd')
+        pikmin2_cave_surveys.create_count_table2d(table.pivot(('a', 'b'), ('c', 'd')))
+    return measure(crosstab, repeat)
+
+def run_python(args: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd = ROOT, check = True, stdout = subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+@benchmark('import.server', repeat = 3)
+def bench_import_server(repeat: int) -> float:
+    '''
+    新しいプロセスで`server`をimportする時間 (インタプリタの起動時間を除く)
+    '''
+    startup = min(run_python(['-c', 'pass']) for _ in range(repeat))
+    return min(run_python(['-c', 'import server']) for _ in range(repeat)) - startup
+
+@benchmark('cold_start.index', repeat = 5)
+def bench_cold_start(repeat: int) -> float:
+    '''
+    新しいプロセスで`server`をimportしてから`/`を返すまでの時間 (インタプリタの起動時間を除く)
+    '''
+    def cold_start() -> float:
+        result, _ = run_child(['/'], importtime = False)
+        return result['import'] + result['requests'][0][2]
+    return min(cold_start() for _ in range(repeat))
+
+@benchmark('freeze.parallel', repeat = 1)
+def bench_freeze(repeat: int) -> float:
+    '''
+    一時ディレクトリへのfreeze.py全体 (`docs/`には書き込まない)
+    '''
+    with tempfile.TemporaryDirectory() as destination:
+        return min(
+            run_python(['freeze.py', '--parallel', '--destination', destination])
+            for _ in range(repeat)
+        )
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    '''
+    結果を表示し、ベースラインより`tolerance`以上遅くなったベンチマークの名前を返す
+    '''
+    regressions = []
+    for name, seconds in results.items():
+        line = f'{name:36s} {seconds * 1000:10.2f} ms'
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += f'  (baseline {baseline[name] * 1000:10.2f} ms, x{ratio:.2f})'
+            if ratio > 1 + tolerance:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+def read_results(path: Path) -> dict[str, float]:
+    return {name: result['seconds'] for name, result in json.loads(path.read_text(encoding = 'utf-8'))['results'].items()}
+
+def get_environment() -> dict[str, str]:
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'platform': platform.platform()}
+
+def check_environment(path: Path):
+    '''
+    ベースラインを計測した環境が今と違えば警告する (別のマシンの値との比較は目安にしかならない)
+    '''
+    report = json.loads(path.read_text(encoding = 'utf-8'))
+    current = get_environment()
+    different = [key for key in current if report.get(key) != current[key]]
+    if different:
+        print('warning: the baseline was measured on a different environment ('
+              + ', '.join(f'{key} {report.get(key)} != {current[key]}' for key in different)
+              + '); refresh it with --save-baseline', file = sys.stderr)
+
+def write_results(path: Path, results: dict[str, float]):
+    path.parent.mkdir(parents = True, exist_ok = True)
+    report = {
+        **get_environment(),
+        'results': {
+            name: {'seconds': seconds, 'repeat': BENCHMARKS[name][1]}
+            for name, seconds in results.items()
+        },
+    }
+    path.write_text(json.dumps(report, indent = 1), encoding = 'utf-8')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', nargs = '*', default = None, help = '名前がこれで始まるベンチマークだけ実行する')
+    parser.add_argument('--skip-freeze', action = 'store_true', help = 'freeze.py全体の計測を飛ばす')
+    parser.add_argument('--output', type = Path, default = OUTPUT_PATH, help = f'結果の書き出し先 (既定: {OUTPUT_PATH.relative_to(ROOT)})')
+    parser.add_argument('--baseline', type = Path, default = BASELINE_PATH, help = f'比較するベースライン (既定: {BASELINE_PATH.relative_to(ROOT)})')
+    parser.add_argument('--save-baseline', action = 'store_true', help = '結果をベースラインとして保存する')
+    parser.add_argument('--tolerance', type = float, default = DEFAULT_TOLERANCE, help = f'許容する遅れの割合 (既定: {DEFAULT_TOLERANCE})')
+    args = parser.parse_args()
+
+    results: dict[str, float] = {}
+    for name, (func, repeat) in BENCHMARKS.items():
+        if args.only is not None and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        if args.skip_freeze and name.startswith('freeze.'):
+            continue
+        results[name] = func(repeat)
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        check_environment(args.baseline)
+        baseline = read_results(args.baseline)
+    regressions = compare(results, baseline, args.tolerance)
+    write_results(args.output, results)
+    print(f'-> {args.output}')
+    if args.save_baseline:
+        write_results(args.baseline, results)
+        print(f'-> {args.baseline}')
+    if regressions:
+        print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+        sys.exit(1)
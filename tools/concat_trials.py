@@ -1,32 +1,256 @@
+'''
+洞窟調査の分割された結果 (シャード) を1つの`trial`にまとめる
+
+各行が`{"seed": 0x..., "num": 0x..., "result": {...}}`の形式のファイルを順に読み、
+シードの範囲を区間の集合で管理しながら結果を足し合わせる (シャードの順番は問わない)
+既に取り込んだ範囲に含まれるシャードは重複として飛ばし、一部だけ重なるシャードは取り込まない
+(`--stage`では既存の`trial`の範囲も取り込み済みとして扱うので、同じシャードを何度渡してもよい)
+
+使い方:
+    python tools/concat_trials.py shard1.txt shard2.txt ...      # まとめた`trial`を表示
+    cat shards/*.txt | python tools/concat_trials.py              # 標準入力から読む (`end`の行で終了)
+    python tools/concat_trials.py --stage CH20-1 shards/*.txt     # data/pikmin2-cave-surveys.yamlの`trial`に足し込む
+'''
+import argparse
+import bisect
+import hashlib
 import json
+import os
+import re
+import sys
 import yaml
-from typing import Any
-
-trials: list[dict[str, Any]] = []
-while True:
-    text = input('> ').strip()
-    if text == 'end':
-        break
-    elif text == '':
-        continue
-    trial = yaml.safe_load(text)
-    trials.append(trial)
-
-trials = sorted(trials, key = lambda t: t['seed'])
-
-# シードが繋がっているかチェック
-for i in range(len(trials) - 1):
-    assert trials[i]['seed'] + trials[i]['num'] == trials[i + 1]['seed']
-
-seed: int = trials[0]['seed']
-num: int = trials[-1]['seed'] + trials[-1]['num'] - seed
-
-result = {}
-for trial in trials:
-    r: dict = trial['result']
-    for key, value in r.items():
-        result[key] = result.get(key, 0) + r[key]
-result = dict(sorted(result.items(), key = lambda t: t[0]))
-
-output = f'{{"seed": 0x{seed:08X}, "num": 0x{num:08X}, "result": {json.dumps(result)}}}'
-print(output)
\ No newline at end of file
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TextIO
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.cave_survey_results import SurveyResult
+
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+DATA_PATH = Path(__file__).parent.parent / 'data/pikmin2-cave-surveys.yaml'
+# シードの範囲は[0, 0x80000000)
+SEED_SPACE = 0x80000000
+
+class IntervalSet:
+    '''
+    互いに交わらない半開区間[start, end)の集合 (隣接する区間は1つにまとめる)
+    '''
+
+    def __init__(self):
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+
+    def overlaps(self, start: int, end: int) -> list[tuple[int, int]]:
+        '''
+        [start, end)と重なる部分
+        '''
+        i = bisect.bisect_right(self.ends, start)
+        overlaps = []
+        while i < len(self.starts) and self.starts[i] < end:
+            overlaps.append((max(start, self.starts[i]), min(end, self.ends[i])))
+            i += 1
+        return overlaps
+
+    def contains(self, start: int, end: int) -> bool:
+        i = bisect.bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] <= start and end <= self.ends[i]
+
+    def add(self, start: int, end: int):
+        '''
+        [start, end)を追加する (既存の区間と重なってはいけない)
+        '''
+        assert start < end and not self.overlaps(start, end), (start, end)
+        # 接する区間(end == startなど)も含めてまとめる
+        lo = bisect.bisect_left(self.ends, start)
+        hi = bisect.bisect_right(self.starts, end)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+
+    def gaps(self, start: int, end: int) -> list[tuple[int, int]]:
+        '''
+        [start, end)のうち含まれていない部分
+        '''
+        gaps = []
+        position = start
+        for s, e in self.overlaps(start, end):
+            if position < s:
+                gaps.append((position, s))
+            position = e
+        if position < end:
+            gaps.append((position, end))
+        return gaps
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self.starts, self.ends)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+def format_range(start: int, end: int) -> str:
+    return f'0x{start:08X}..0x{end - 1:08X}'
+
+def get_result_digest(result: dict[str, int]) -> str:
+    return hashlib.sha256(json.dumps(result, sort_keys = True).encode('utf-8')).hexdigest()
+
+class TrialMerger:
+    '''
+    シャードを1つずつ受け取り、結果の合計と取り込んだ範囲だけを保持する
+    '''
+
+    def __init__(self, initial: dict[str, Any] | None = None):
+        self.covered = IntervalSet()
+        self.result: dict[str, int] = {}
+        # 取り込んだシャードの範囲 -> 結果のハッシュ (重複の判定用)
+        self.shards: dict[tuple[int, int], str] = {}
+        self.num_merged = 0
+        self.num_duplicates = 0
+        self.rejected: list[tuple[int, int]] = []
+        if initial is not None:
+            self.add(initial)
+            self.num_merged = 0
+
+    def add(self, trial: dict[str, Any]) -> bool:
+        '''
+        シャードを取り込み、取り込んだかを返す
+        同じ範囲で結果が異なるシャードは`ValueError`
+        '''
+        start: int = trial['seed']
+        end: int = start + trial['num']
+        if not 0 <= start < end <= SEED_SPACE:
+            raise ValueError(f'seed range {start:#x} + {trial["num"]:#x} is out of the seed space')
+        digest = get_result_digest(trial['result'])
+        if (start, end) in self.shards:
+            if self.shards[start, end] != digest:
+                raise ValueError(f'{format_range(start, end)}: results differ from the shard already merged')
+            self.num_duplicates += 1
+            return False
+        if self.covered.contains(start, end):
+            # 既存の`trial`などにまとめ済みの範囲
+            self.num_duplicates += 1
+            return False
+        if self.covered.overlaps(start, end):
+            # 合計から一部だけ取り除くことはできないので取り込まない
+            self.rejected.append((start, end))
+            return False
+        self.covered.add(start, end)
+        self.shards[start, end] = digest
+        for key, count in trial['result'].items():
+            self.result[key] = self.result.get(key, 0) + count
+        self.num_merged += 1
+        return True
+
+    def gaps(self) -> list[tuple[int, int]]:
+        '''
+        取り込んだ範囲の最初から最後までのうち抜けている部分
+        '''
+        if len(self.covered) == 0:
+            return []
+        return self.covered.gaps(self.covered.starts[0], self.covered.ends[-1])
+
+    def to_trial(self) -> dict[str, Any]:
+        '''
+        まとめた`trial` (範囲が1つに繋がっていなければ`ValueError`)
+        '''
+        if len(self.covered) != 1:
+            gaps = ', '.join(format_range(*gap) for gap in self.gaps())
+            raise ValueError(f'seed ranges are not contiguous (gaps: {gaps or "no shards"})')
+        (start, end), = self.covered
+        trial = {
+            'seed': start,
+            'num': end - start,
+            'result': dict(sorted(self.result.items(), key = lambda t: t[0])),
+        }
+        # 軸の組ごとの合計が`num`に一致するか
+        SurveyResult.from_trial(trial)
+        return trial
+
+    def report(self, file: TextIO = sys.stderr):
+        print(f'{self.num_merged} shards merged, {self.num_duplicates} duplicates skipped', file = file)
+        for start, end in self.rejected:
+            print(f'  overlap: {format_range(start, end)} was not merged', file = file)
+        for start, end in self.gaps():
+            print(f'  gap: {format_range(start, end)} ({end - start} seeds)', file = file)
+        covered = sum(end - start for start, end in self.covered)
+        print(f'  covered: {covered} seeds ({covered / SEED_SPACE:.4%} of the seed space)', file = file)
+
+def read_trials(lines: Iterable[str]) -> Iterator[dict[str, Any]]:
+    '''
+    1行に1つの`trial`を読む (空行は無視し、`end`の行で終了する)
+    '''
+    for line in lines:
+        text = line.strip()
+        if text == 'end':
+            break
+        elif text == '':
+            continue
+        yield yaml.load(text, Loader = YamlLoader)
+
+def format_trial(trial: dict[str, Any]) -> str:
+    return f'{{"seed": 0x{trial["seed"]:08X}, "num": 0x{trial["num"]:08X}, "result": {json.dumps(trial["result"])}}}'
+
+def get_trial_pattern(stage_name: str) -> re.Pattern:
+    '''
+    ステージの`trial:`の行 (グループ1が`trial: `まで、グループ2が値)
+    '''
+    return re.compile(rf'^({re.escape(stage_name)}:\n(?:[ \t]+.*\n)*?[ \t]+trial: )(.*)$', re.MULTILINE)
+
+def read_stage_trial(text: str, stage_name: str) -> dict[str, Any] | None:
+    match = get_trial_pattern(stage_name).search(text)
+    if match is None:
+        return None
+    return yaml.load(match.group(2), Loader = YamlLoader)
+
+def write_stage_trial(path: Path, stage_name: str, trial: dict[str, Any]):
+    '''
+    `path`のステージの`trial`を置き換える (他の行はそのまま残す)
+    '''
+    text = path.read_text(encoding = 'utf-8')
+    pattern = get_trial_pattern(stage_name)
+    if pattern.search(text) is None:
+        raise KeyError(f'{stage_name} has no trial in {path}')
+    text = pattern.sub(lambda m: m.group(1) + format_trial(trial), text, count = 1)
+    temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    temp_path.write_text(text, encoding = 'utf-8')
+    temp_path.replace(path)
+
+def iter_lines(paths: list[str]) -> Iterator[str]:
+    if len(paths) == 0:
+        paths = ['-']
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+        else:
+            with open(path, encoding = 'utf-8') as f:
+                yield from f
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs = '*', help = 'シャードのファイル (省略または`-`で標準入力)')
+    parser.add_argument('--stage', help = 'このステージの`trial`に足し込む')
+    parser.add_argument('--data', type = Path, default = DATA_PATH, help = '足し込むYAMLファイル')
+    parser.add_argument('--dry-run', action = 'store_true', help = '`--stage`の結果を書き込まずに表示する')
+    args = parser.parse_args()
+
+    initial = None
+    if args.stage is not None:
+        initial = read_stage_trial(args.data.read_text(encoding = 'utf-8'), args.stage)
+        if initial is None:
+            sys.exit(f'{args.stage} has no trial in {args.data}')
+    merger = TrialMerger(initial)
+    for trial in read_trials(iter_lines(args.files)):
+        merger.add(trial)
+    merger.report()
+
+    try:
+        trial = merger.to_trial()
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.stage is None or args.dry_run:
+        print(format_trial(trial))
+    else:
+        write_stage_trial(args.data, args.stage, trial)
+        print(f'{args.stage}: seed = 0x{trial["seed"]:08X}, num = 0x{trial["num"]:08X} -> {args.data}', file = sys.stderr)
@@ -0,0 +1,111 @@
+'''
+ドット絵の拡大版の重複を取り除く
+
+`static/images/pixel-arts`の画像のうち、別の画像を整数倍に(最近傍で)拡大したものとピクセルが完全に一致するものを探す
+`--apply`を付けると重複した画像を削除し、元の画像と倍率を`data/pixel-arts-scaled.yaml`に記録する
+(ページではCSSで拡大して表示する)
+
+config.yamlやテンプレートなどから直接参照されている画像 (ファビコンなど) は削除しない
+
+使い方: python tools/dedupe_pixel_arts.py [--apply]
+'''
+import argparse
+import sys
+import numpy as np
+import yaml
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts import pixel_arts, png
+
+ROOT = Path(__file__).parent.parent
+MAPPING_PATH = ROOT / 'data/pixel-arts-scaled.yaml'
+# 画像を直接参照しうるファイル
+REFERENCE_GLOBS = ['config.yaml', 'templates/**/*.html', 'static/**/*.js', 'static/**/*.css']
+
+def get_referenced_files() -> set[str]:
+    texts = [path.read_text(encoding = 'utf-8') for pattern in REFERENCE_GLOBS for path in ROOT.glob(pattern)]
+    return {
+        path.name for path in pixel_arts.get_image_paths()
+        if any(f'pixel-arts/{path.name}' in text for text in texts)
+    }
+
+def upscale(image: np.ndarray, scale: int) -> np.ndarray:
+    return np.repeat(np.repeat(image, scale, axis = 0), scale, axis = 1)
+
+def find_duplicates(images: dict[str, np.ndarray]) -> dict[str, tuple[str, int]]:
+    '''
+    {重複した画像: (元の画像, 倍率)} (元の画像は重複していないもの)
+    '''
+    # 小さい順に見て、それより前の重複していない画像と比べる
+    filenames = sorted(images, key = lambda f: (images[f].shape[0] * images[f].shape[1], f))
+    sources: list[str] = []
+    duplicates: dict[str, tuple[str, int]] = {}
+    for filename in filenames:
+        height, width, _ = images[filename].shape
+        for source in sources:
+            source_height, source_width, _ = images[source].shape
+            if height % source_height != 0 or width % source_width != 0:
+                continue
+            scale = height // source_height
+            if width // source_width != scale:
+                continue
+            if np.array_equal(upscale(images[source], scale), images[filename]):
+                duplicates[filename] = (source, scale)
+                break
+        else:
+            sources.append(filename)
+    return duplicates
+
+def read_mapping() -> dict[str, dict[str, object]]:
+    if not MAPPING_PATH.exists():
+        return {}
+    return yaml.safe_load(MAPPING_PATH.read_text(encoding = 'utf-8')) or {}
+
+def write_mapping(mapping: dict[str, dict[str, object]]):
+    lines = ['# tools/dedupe_pixel_arts.pyが書き出す (削除した拡大版の画像 -> 元の画像と倍率)']
+    for filename, entry in sorted(mapping.items()):
+        lines.append(f'{filename}: {{source: {entry["source"]}, scale: {entry["scale"]}}}')
+    if len(mapping) == 0:
+        lines.append('{}')
+    MAPPING_PATH.write_text('\n'.join(lines) + '\n', encoding = 'utf-8')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apply', action = 'store_true', help = '重複した画像を削除して対応を記録する')
+    args = parser.parse_args()
+
+    images: dict[str, np.ndarray] = {}
+    for path in pixel_arts.get_image_paths():
+        try:
+            images[path.name] = png.decode(path)
+        except ValueError as e:
+            print(f'skipped: {e}', file = sys.stderr)
+    referenced = get_referenced_files()
+    duplicates = {
+        filename: source for filename, source in find_duplicates(images).items()
+        if filename not in referenced
+    }
+
+    saved = 0
+    for filename, (source, scale) in sorted(duplicates.items()):
+        size = (pixel_arts.IMAGE_DIR / filename).stat().st_size
+        saved += size
+        print(f'{filename} = {source} x{scale} ({size} B)')
+    print(f'{len(duplicates)} duplicates in {len(images)} images, {saved} B'
+          f'{" removed" if args.apply else " can be removed (run with --apply)"}')
+
+    mapping = read_mapping()
+    for filename, entry in mapping.items():
+        if entry['source'] in duplicates:
+            # 元の画像も別の画像の拡大版だった
+            source, scale = duplicates[entry['source']]
+            mapping[filename] = {'source': source, 'scale': entry['scale'] * scale}
+    for filename, (source, scale) in duplicates.items():
+        mapping[filename] = {'source': source, 'scale': scale}
+    if args.apply:
+        for filename in duplicates:
+            (pixel_arts.IMAGE_DIR / filename).unlink()
+        write_mapping(mapping)
+        print(f'-> {MAPPING_PATH}')
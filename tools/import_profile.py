@@ -0,0 +1,95 @@
+'''
+サーバーの起動時間の内訳
+
+新しいプロセスで`python -X importtime`を使って`server`をimportし、指定したURLを1回ずつ処理して、
+モジュールごとのimport時間 (自身・依存を含む累計) とパッケージごとの合計を表示する
+`--repeat`を付けると、起動から最初のURLを返すまでの時間を繰り返し計り、最速の値も表示する
+
+使い方:
+    python tools/import_profile.py                               # `/`を返すまでにimportされるモジュール
+    python tools/import_profile.py --url /pikmin2/treasures.html --top 30
+    python tools/import_profile.py --repeat 10                   # 起動から`/`を返すまでの時間
+'''
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).parent.parent
+
+# 子プロセスで実行するコード (import時間とURLごとの処理時間をJSONで出力する)
+CHILD_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.app.config['WARM_UP'] = False
+client = server.app.test_client()
+requests = []
+for url in sys.argv[1:]:
+    t = time.perf_counter()
+    status = client.get(url).status_code
+    requests.append([url, status, time.perf_counter() - t])
+print(json.dumps({'import': imported - start, 'requests': requests}))
+'''
+
+def run_child(urls: list[str], importtime: bool) -> tuple[dict[str, Any], str]:
+    '''
+    子プロセスを実行して(計測結果, `-X importtime`の出力)を返す
+    '''
+    options = ['-X', 'importtime'] if importtime else []
+    completed = subprocess.run(
+        [sys.executable, *options, '-c', CHILD_SCRIPT, *urls],
+        cwd = ROOT, capture_output = True, text = True, check = True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1]), completed.stderr
+
+def parse_importtime(output: str) -> list[tuple[str, int, int]]:
+    '''
+    `-X importtime`の出力を(モジュール名, 自身の時間, 累計の時間)の一覧にする (時間はマイクロ秒)
+    '''
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def report(modules: list[tuple[str, int, int]], top: int):
+    print(f'{"module":48s} {"self [ms]":>10s} {"cumulative [ms]":>16s}')
+    for name, self_us, cumulative_us in sorted(modules, key = lambda t: -t[2])[:top]:
+        print(f'{name:48s} {self_us / 1000:10.2f} {cumulative_us / 1000:16.2f}')
+    packages: dict[str, int] = {}
+    for name, self_us, _ in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    print()
+    print(f'{"package":48s} {"total [ms]":>10s}')
+    for package, total in sorted(packages.items(), key = lambda t: -t[1])[:top]:
+        print(f'{package:48s} {total / 1000:10.2f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', action = 'append', default = None, help = '処理するURL (複数指定可、既定: /)')
+    parser.add_argument('--top', type = int, default = 20, help = '表示するモジュール・パッケージの数')
+    parser.add_argument('--repeat', type = int, default = 0, help = '起動時間を計る回数 (importtimeなし)')
+    args = parser.parse_args()
+    urls = args.url or ['/']
+
+    result, output = run_child(urls, importtime = True)
+    report(parse_importtime(output), args.top)
+    print()
+    print(f'import server: {result["import"] * 1000:.2f} ms (with -X importtime)')
+    for url, status, seconds in result['requests']:
+        print(f'GET {url}: {status} in {seconds * 1000:.2f} ms')
+
+    if args.repeat > 0:
+        # 子プロセス内で計るので、インタプリタ自体の起動時間は含まない
+        best = min(
+            (lambda r: r['import'] + r['requests'][0][2])(run_child(urls[:1], importtime = False)[0])
+            for _ in range(args.repeat)
+        )
+        print(f'cold start to first response of {urls[0]}: {best * 1000:.2f} ms (best of {args.repeat})')
@@ -0,0 +1,288 @@
+'''
+洞窟調査の並列・再開可能な実行
+
+ステージのシードの範囲をシャードに分け、シャードごとにワーカーのコマンド (既定は`tools/survey_worker.py`、
+実際の調査ではCaveGenEditedを組み込んだCaveGen) を別プロセスで並列に実行する
+終わったシャードの結果は`build/surveys/<ステージ名>/`に1つずつ保存するので、途中で止まっても続きから再開できる
+全てのシャードが揃ったら`tools/concat_trials.py`と同じ方法で合計する
+
+`--precision`を付けると、最初から途切れずに終わったシャードの合計で全ての確率の信頼区間の幅の半分が
+推定値のその割合以下になった時点で残りのシャードを打ち切る
+まだ1度も出ていない結果は区間が狭くならないので、珍しい結果があるステージは最後まで調べることになる
+(ワーカーは出た結果しか出力しないので、既存の`trial`に出ている結果と真偽値の軸の真・偽はまだ出ていなければ0件とみなす)
+
+ワーカーのコマンドの`{stage}`・`{seed}`・`{num}`・`{python}`は置き換えられる (`{seed}`と`{num}`は`0x%08X`の形式)
+出力のうち`{"seed": ...`で始まる最後の行を結果とする
+
+使い方:
+    python tools/survey.py CH20-1 --num 0x10000000 -j 4               # 仮のワーカーで調査して結果を表示
+    python tools/survey.py CH20-1 --num 0x10000000 --apply            # data/pikmin2-cave-surveys.yamlに足し込む
+    python tools/survey.py CH20-1 --precision 0.01                    # 全ての確率が±1%の精度になったら打ち切る
+    python tools/survey.py CH20-1 --worker "java -jar CaveGen.jar cave {stage} -seed {seed} -num {num} -noImages"
+'''
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Iterable
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts import intervals
+from scripts.cave_survey_results import parse_result_key
+
+from concat_trials import (
+    DATA_PATH, SEED_SPACE, TrialMerger,
+    format_range, format_trial, read_stage_trial, read_trials, write_stage_trial,
+)
+
+ROOT = Path(__file__).parent.parent
+CHECKPOINT_DIR = ROOT / 'build/surveys'
+DEFAULT_WORKER = '{python} tools/survey_worker.py {stage} --seed {seed} --num {num}'
+DEFAULT_SHARD_SIZE = 0x01000000
+
+def split_shards(seed: int, num: int, shard_size: int) -> list[tuple[int, int]]:
+    '''
+    [seed, seed + num)を`shard_size`ずつの(最初のシード, シードの数)に分ける
+    '''
+    return [(start, min(shard_size, seed + num - start)) for start in range(seed, seed + num, shard_size)]
+
+def get_checkpoint_path(directory: Path, seed: int, num: int) -> Path:
+    return directory / f'{seed:08X}-{num:08X}.txt'
+
+def read_checkpoint(path: Path) -> dict[str, Any] | None:
+    '''
+    保存したシャードの結果 (なければ、または壊れていれば`None`)
+    '''
+    try:
+        trials = list(read_trials(path.read_text(encoding = 'utf-8').splitlines()))
+    except (FileNotFoundError, ValueError, AttributeError, TypeError):
+        return None
+    return trials[0] if len(trials) == 1 and isinstance(trials[0], dict) else None
+
+def write_checkpoint(path: Path, trial: dict[str, Any]):
+    temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    temp_path.write_text(format_trial(trial) + '\n', encoding = 'utf-8')
+    temp_path.replace(path)
+
+def prepare_checkpoint_dir(directory: Path, worker: str, fresh: bool):
+    '''
+    ワーカーのコマンドが前回と違えば保存した結果は使えないので、`fresh`でなければ中断する
+    '''
+    meta_path = directory / 'meta.json'
+    directory.mkdir(parents = True, exist_ok = True)
+    if fresh:
+        for path in directory.glob('*.txt'):
+            path.unlink()
+    elif meta_path.exists():
+        previous = json.loads(meta_path.read_text(encoding = 'utf-8'))
+        if previous.get('worker') != worker:
+            sys.exit(f'{directory} has results of another worker ({previous.get("worker")!r}); use --fresh to discard them')
+    meta_path.write_text(json.dumps({'worker': worker}), encoding = 'utf-8')
+
+def run_shard(worker: str, stage: str, seed: int, num: int) -> dict[str, Any]:
+    '''
+    1シャード分のワーカーを実行して結果の`trial`を返す
+    '''
+    command = worker.format(stage = stage, seed = f'0x{seed:08X}', num = f'0x{num:08X}', python = shlex.quote(sys.executable))
+    completed = subprocess.run(shlex.split(command), cwd = ROOT, capture_output = True, text = True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'exit status {completed.returncode}: {completed.stderr.strip()[-500:]}')
+    lines = [line for line in completed.stdout.splitlines() if line.startswith('{"seed"')]
+    if len(lines) == 0:
+        raise RuntimeError('the worker printed no result')
+    trial, = read_trials(lines[-1:])
+    if (trial['seed'], trial['num']) != (seed, num):
+        raise RuntimeError(f'the worker surveyed {format_range(trial["seed"], trial["seed"] + trial["num"])}')
+    return trial
+
+def get_prefix(shards: list[tuple[int, int]], results: dict[tuple[int, int], dict[str, Any]]) -> list[dict[str, Any]]:
+    '''
+    最初のシャードから途切れずに終わっているシャードの結果
+    '''
+    prefix = []
+    for shard in shards:
+        if shard not in results:
+            break
+        prefix.append(results[shard])
+    return prefix
+
+def run_survey(
+    stage: str,
+    shards: list[tuple[int, int]],
+    directory: Path,
+    worker: str,
+    jobs: int | None = None,
+    should_stop: Callable[[list[dict[str, Any]]], bool] | None = None,
+) -> tuple[list[dict[str, Any]], list[tuple[int, int]]]:
+    '''
+    保存済みでないシャードを並列に実行し、(全シャードの結果, 失敗したシャード)を返す
+    `should_stop`が最初から途切れずに終わったシャードの結果に対して真を返したら、残りを打ち切ってそのシャードの結果だけを返す
+    '''
+    results: dict[tuple[int, int], dict[str, Any]] = {}
+    pending = []
+    for seed, num in shards:
+        trial = read_checkpoint(get_checkpoint_path(directory, seed, num))
+        if trial is not None:
+            results[seed, num] = trial
+        else:
+            pending.append((seed, num))
+    print(f'{stage}: {len(shards)} shards, {len(results)} already done, {len(pending)} to run', file = sys.stderr)
+    if should_stop is not None and should_stop(get_prefix(shards, results)):
+        print(f'{stage}: precise enough with the saved shards', file = sys.stderr)
+        return get_prefix(shards, results), []
+
+    failed = []
+    stopped = False
+    start_time = time.perf_counter()
+    # ワーカーは別プロセスなので、スレッドはその終了を待つだけ
+    with ThreadPoolExecutor(jobs or os.cpu_count()) as pool:
+        futures = {pool.submit(run_shard, worker, stage, seed, num): (seed, num) for seed, num in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            seed, num = futures[future]
+            try:
+                trial = future.result()
+            except RuntimeError as e:
+                print(f'  failed: {format_range(seed, seed + num)}: {e}', file = sys.stderr)
+                failed.append((seed, num))
+                continue
+            write_checkpoint(get_checkpoint_path(directory, seed, num), trial)
+            results[seed, num] = trial
+            elapsed = time.perf_counter() - start_time
+            print(f'  [{done}/{len(pending)}] {format_range(seed, seed + num)} '
+                  f'({elapsed:.1f} s, eta {elapsed / done * (len(pending) - done):.1f} s)', file = sys.stderr)
+            if should_stop is not None and should_stop(get_prefix(shards, results)):
+                stopped = True
+                break
+        if stopped:
+            # 実行中のシャードは終わるのを待ち、結果は次回のために保存しておく
+            pool.shutdown(cancel_futures = True)
+            for future, (seed, num) in futures.items():
+                if future.done() and not future.cancelled() and future.exception() is None and (seed, num) not in results:
+                    write_checkpoint(get_checkpoint_path(directory, seed, num), future.result())
+    if stopped:
+        prefix = get_prefix(shards, results)
+        num = sum(trial['num'] for trial in prefix)
+        print(f'{stage}: stopped early after 0x{num:08X} seeds ({len(prefix)}/{len(shards)} shards)', file = sys.stderr)
+        return prefix, []
+    return [results[shard] for shard in shards if shard in results], sorted(failed)
+
+def get_outcome_counts(trial: dict[str, Any], known_keys: Iterable[str] = ()) -> np.ndarray:
+    '''
+    精度を判定する件数
+    CaveGenEditedは出た結果しか出力しないので、`known_keys` (既存の`trial`の結果など) のうちまだ出ていないものは0件とし、
+    真偽値の軸は真・偽それぞれの件数も加える (片方しか出ていなければもう片方は0件)
+    '''
+    result = trial['result']
+    counts = [result.get(key, 0) for key in dict.fromkeys([*result, *known_keys])]
+    marginals: dict[str, dict[bool, int]] = {}
+    for key, count in result.items():
+        for axis, value in parse_result_key(key).items():
+            if isinstance(value, bool):
+                marginals.setdefault(axis, {True: 0, False: 0})[value] += count
+    for marginal in marginals.values():
+        counts += marginal.values()
+    return np.array(counts, dtype = np.int64)
+
+def is_precise(
+    trial: dict[str, Any],
+    precision: float,
+    confidence: float = intervals.DEFAULT_CONFIDENCE,
+    method: str = 'wilson',
+    known_keys: Iterable[str] = (),
+) -> bool:
+    '''
+    全ての結果 (まだ出ていない既知の結果を含む) の確率の信頼区間の幅の半分が、推定値の`precision`倍以下か
+    '''
+    counts = get_outcome_counts(trial, known_keys)
+    widths = intervals.relative_half_widths(counts, trial['num'], confidence, method)
+    return bool((widths <= precision).all())
+
+def report_intervals(
+    trial: dict[str, Any],
+    confidence: float = intervals.DEFAULT_CONFIDENCE,
+    method: str = 'wilson',
+):
+    '''
+    結果ごとの件数・確率・信頼区間・相対精度を表示する
+    '''
+    keys = list(trial['result'])
+    counts = np.array([trial['result'][key] for key in keys])
+    low, high = intervals.interval(counts, trial['num'], confidence, method)
+    widths = intervals.relative_half_widths(counts, trial['num'], confidence, method)
+    print(f'{confidence:.0%} {method} intervals over 0x{trial["num"]:08X} seeds:', file = sys.stderr)
+    for key, count, l, h, width in zip(keys, counts, low, high, widths):
+        print(f'  {key:40s} {count:12d} {count / trial["num"]:10.6%} [{l:10.6%}, {h:10.6%}] ±{width:.2%}', file = sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stage', help = 'ステージ名 (例: CH20-1)')
+    parser.add_argument('--seed', type = lambda s: int(s, 0), default = 0, help = '最初のシード (既定: 0)')
+    parser.add_argument('--num', type = lambda s: int(s, 0), default = SEED_SPACE, help = 'シードの数 (既定: 0x80000000)')
+    parser.add_argument('--shard-size', type = lambda s: int(s, 0), default = DEFAULT_SHARD_SIZE, help = '1シャードのシードの数')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = '並列数 (既定: CPU数)')
+    parser.add_argument('--worker', default = DEFAULT_WORKER, help = 'ワーカーのコマンド')
+    parser.add_argument('--fresh', action = 'store_true', help = '保存したシャードの結果を捨てて最初から実行する')
+    parser.add_argument('--data', type = Path, default = DATA_PATH, help = '足し込むYAMLファイル')
+    parser.add_argument('--apply', action = 'store_true', help = '結果をステージの`trial`に足し込む')
+    parser.add_argument('--precision', type = float, default = None,
+                        help = '全ての確率の信頼区間の幅の半分が推定値のこの割合以下になったら打ち切る (例: 0.01)')
+    parser.add_argument('--confidence', type = float, default = intervals.DEFAULT_CONFIDENCE, help = '信頼係数 (既定: 0.95)')
+    parser.add_argument('--method', choices = intervals.METHODS, default = 'wilson',
+                        help = '信頼区間の求め方 (clopper-pearsonはscipyが必要)')
+    args = parser.parse_args()
+    if not 0 <= args.seed < args.seed + args.num <= SEED_SPACE or args.shard_size <= 0:
+        sys.exit('the seed range must be in [0, 0x80000000) and the shard size must be positive')
+    if args.method == 'clopper-pearson' and intervals.stats is None:
+        sys.exit('--method clopper-pearson requires scipy')
+
+    existing = read_stage_trial(args.data.read_text(encoding = 'utf-8'), args.stage) if args.data.exists() else None
+    initial = None
+    if args.apply:
+        initial = existing
+        if initial is None:
+            sys.exit(f'{args.stage} has no trial in {args.data}')
+    # 既存の`trial`に出ている結果は、今回の調査でまだ出ていなくても精度の判定に含める
+    known_keys = list(existing['result']) if existing is not None else []
+
+    should_stop = None
+    if args.precision is not None:
+        def should_stop(prefix: list[dict[str, Any]]) -> bool:
+            # 足し込む場合は既存の`trial`も合わせた精度で判定する
+            merger = TrialMerger(initial)
+            for trial in prefix:
+                merger.add(trial)
+            try:
+                trial = merger.to_trial()
+            except ValueError:
+                return False
+            return is_precise(trial, args.precision, args.confidence, args.method, known_keys)
+
+    directory = CHECKPOINT_DIR / args.stage
+    prepare_checkpoint_dir(directory, args.worker, args.fresh)
+    shards = split_shards(args.seed, args.num, args.shard_size)
+    trials, failed = run_survey(args.stage, shards, directory, args.worker, args.jobs, should_stop)
+    if failed:
+        sys.exit(f'{len(failed)} shards failed; run the same command again to retry them')
+
+    merger = TrialMerger(initial)
+    for trial in trials:
+        merger.add(trial)
+    merger.report()
+    try:
+        trial = merger.to_trial()
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.precision is not None:
+        report_intervals(trial, args.confidence, args.method)
+    if args.apply:
+        write_stage_trial(args.data, args.stage, trial)
+        print(f'{args.stage}: seed = 0x{trial["seed"]:08X}, num = 0x{trial["num"]:08X} -> {args.data}', file = sys.stderr)
+    else:
+        print(format_trial(trial))
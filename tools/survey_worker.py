@@ -0,0 +1,67 @@
+'''
+CaveGenEditedの代わりにローカルで動かす調査の仮のワーカー
+
+CaveGenは使わず、シードのハッシュから結果を決める (同じシードは必ず同じ結果になる)
+結果の分布は`data/pikmin2-cave-surveys.yaml`にある同じステージの`trial`の割合に合わせ、
+CaveGenEditedと同じ`{"seed": 0x..., "num": 0x..., "result": {...}}`の行を出力する
+
+使い方: python tools/survey_worker.py CH20-1 --seed 0x00000000 --num 0x01000000
+'''
+import argparse
+import sys
+import numpy as np
+import yaml
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.cave_survey_results import parse_result_key
+from concat_trials import DATA_PATH, format_trial, read_stage_trial
+
+# 1度にハッシュを計算するシードの数
+CHUNK_SIZE = 1 << 22
+
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    '''
+    64ビットの整数のハッシュ (SplitMix64の出力関数)
+    '''
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def survey(result: dict[str, int], seed: int, num: int) -> dict[str, int]:
+    '''
+    `result`と同じ割合になるように[seed, seed + num)の各シードの結果を決めて数える
+    同じ軸の組を持つキーごとに、各シードはどれか1つのキーに数えられる
+    '''
+    groups: dict[frozenset[str], list[str]] = {}
+    for key in result:
+        groups.setdefault(frozenset(parse_result_key(key)), []).append(key)
+    counts = {key: 0 for key in result}
+    with np.errstate(over = 'ignore'):
+        for group_index, keys in enumerate(groups.values()):
+            weights = np.array([result[key] for key in keys], dtype = np.float64)
+            thresholds = np.cumsum(weights / weights.sum())[:-1]
+            for start in range(seed, seed + num, CHUNK_SIZE):
+                seeds = np.arange(start, min(start + CHUNK_SIZE, seed + num), dtype = np.uint64)
+                # 軸の組ごとに別のハッシュを使い、組の間で結果が偏らないようにする
+                hashes = splitmix64(seeds ^ np.uint64(group_index << 32))
+                uniform = (hashes >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+                bins = np.bincount(np.searchsorted(thresholds, uniform, side = 'right'), minlength = len(keys))
+                for key, count in zip(keys, bins):
+                    counts[key] += int(count)
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stage', help = 'ステージ名 (例: CH20-1)')
+    parser.add_argument('--seed', type = lambda s: int(s, 0), required = True, help = '最初のシード')
+    parser.add_argument('--num', type = lambda s: int(s, 0), required = True, help = 'シードの数')
+    parser.add_argument('--data', type = Path, default = DATA_PATH, help = '結果の割合を取るYAMLファイル')
+    args = parser.parse_args()
+
+    trial = read_stage_trial(args.data.read_text(encoding = 'utf-8'), args.stage)
+    if trial is None:
+        sys.exit(f'{args.stage} has no trial in {args.data}')
+    print(format_trial({'seed': args.seed, 'num': args.num, 'result': survey(trial['result'], args.seed, args.num)}))